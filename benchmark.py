@@ -0,0 +1,352 @@
+"""Resumable, parallel BoolQ / PIQA / OpenBookQA benchmark of the GGUF models in models/ (from eval_multi.ipynb)."""
+import argparse
+import csv
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from chatmodules.model_registry import (ModelRegistry, available_memory_bytes, estimate_memory_bytes,
+                                        physical_core_count, read_model_info)
+
+models_dir = "models/"
+DATA_DIR = "eval/data/"
+CHECKPOINT_DIR = "eval/"
+N_CTX = 2048
+SEED = 42
+
+# ========== Task Configurations ==========
+TASKS = {
+    "BoolQ": {
+        "dataset": "boolq",
+        "split": "validation",
+        "answer_type": "bool",
+        "choices": ["TRUE", "FALSE"]
+    },
+    "PIQA": {
+        "dataset": "piqa",
+        "split": "validation",
+        "answer_type": "mc",
+        "choices": ["A", "B"]
+    },
+    "OpenBookQA": {
+        "dataset": "openbookqa",
+        "split": "test",
+        "subset": "main",
+        "answer_type": "mc4",
+        "choices": ["A", "B", "C", "D"]
+    }
+}
+
+
+# ========== Datasets ==========
+def dataset_cache_path(task_name, data_dir=DATA_DIR):
+    config = TASKS[task_name]
+    return os.path.join(data_dir, f"{config['dataset']}_{config.get('subset', 'default')}_{config['split']}.jsonl")
+
+
+def cache_dataset(task_name, data_dir=DATA_DIR):
+    """Download the task split once (via `datasets`) and store it as JSON lines for offline runs."""
+    path = dataset_cache_path(task_name, data_dir)
+    if os.path.exists(path):
+        return path
+
+    from datasets import load_dataset
+    config = TASKS[task_name]
+    if "subset" in config:
+        dataset = load_dataset(config["dataset"], config["subset"], split=config["split"])
+    else:
+        dataset = load_dataset(config["dataset"], split=config["split"])
+
+    os.makedirs(data_dir, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for row in dataset:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def sample_rows(path, n, seed=SEED):
+    """Pick `n` rows with a fixed seed; only the sampled lines are parsed. Returns [(index, row)]."""
+    with open(path, encoding="utf-8") as f:
+        total = sum(1 for _ in f)
+    chosen = set(random.Random(seed).sample(range(total), min(n, total)))
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            if index in chosen:
+                rows.append((index, json.loads(line)))
+    return rows
+
+
+# ========== Prompts ==========
+def build_prompt(task_name, sample):
+    """Return (prompt, gold answer) for one dataset row."""
+    config = TASKS[task_name]
+    if config["answer_type"] == "bool":
+        prompt = f"""Question: {sample['question']}
+
+Passage: {sample['passage']}
+
+Please answer TRUE or FALSE.
+Answer:"""
+        return prompt, "true" if sample["answer"] else "false"
+
+    if config["dataset"] == "piqa":
+        prompt = f"""Choose the best option for the physical question below.
+
+Question: {sample['goal']}
+
+A: {sample['sol1']}
+B: {sample['sol2']}
+
+Which option is better? Answer with A or B.
+Answer:"""
+        return prompt, "a" if sample["label"] == 0 else "b"
+
+    if config["dataset"] == "openbookqa":
+        prompt = f"""You are answering a multiple choice science question. Choose the correct option: A, B, C, or D.
+
+Question: {sample['question_stem']}
+
+"""
+        for label, text in zip(sample["choices"]["label"], sample["choices"]["text"]):
+            prompt += f"{label}: {text}\n"
+        prompt += "\nAnswer:"
+        return prompt, sample["answerKey"].lower()
+
+    raise ValueError(f"No prompt template for task {task_name}")
+
+
+def prepare_items(task_names, n, seed=SEED, data_dir=DATA_DIR, offline=False):
+    """Build every prompt once; the same items are evaluated by every model."""
+    items = []
+    for task_name in task_names:
+        path = dataset_cache_path(task_name, data_dir)
+        if not os.path.exists(path):
+            if offline:
+                raise FileNotFoundError(f"{path} not found; run once without --offline (or with --prepare) to cache it")
+            cache_dataset(task_name, data_dir)
+        for index, sample in sample_rows(path, n, seed):
+            prompt, gold = build_prompt(task_name, sample)
+            items.append({"task": task_name, "index": index, "prompt": prompt, "gold": gold})
+    return items
+
+
+def parse_prediction(task_name, response):
+    response = response.strip().lower()
+    if TASKS[task_name]["answer_type"] == "bool":
+        return "true" if "true" in response else "false" if "false" in response else ""
+    for opt in ["a", "b", "c", "d", "e"]:
+        if opt in response:
+            return opt
+    return None
+
+
+# ========== Log-likelihood scoring ==========
+def _last_logprobs(model):
+    # 最后一个已解码位置的 logits（未开启 logits_all 时只保留这一行）
+    import numpy as np
+    import llama_cpp
+    logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits(model.ctx), shape=(model.n_vocab(),)).astype(np.float64)
+    logits -= logits.max()
+    return logits - np.log(np.exp(logits).sum())
+
+
+def score_choices(model, prompt, choices):
+    """
+    Log-probability of each answer choice (" A", " TRUE", ...) as the continuation of `prompt`.
+
+    The prompt is decoded once (reusing whatever prefix the previous prompt left in the KV cache) and every choice is
+    scored on top of it; multi-token choices only decode their own tokens and are then rolled back.
+    """
+    tokens = model.tokenize(prompt.encode("utf-8"))
+    prefix = 0
+    limit = min(model.n_tokens, len(tokens) - 1)
+    while prefix < limit and model.input_ids[prefix] == tokens[prefix]:
+        prefix += 1
+    model.n_tokens = prefix
+    model.eval(tokens[prefix:])
+    n_prompt = model.n_tokens
+    prompt_logprobs = _last_logprobs(model)
+
+    scores = {}
+    for choice in choices:
+        choice_tokens = model.tokenize((" " + choice).encode("utf-8"), add_bos=False)
+        logprob = prompt_logprobs[choice_tokens[0]]
+        for prev, token in zip(choice_tokens, choice_tokens[1:]):
+            model.eval([prev])
+            logprob += _last_logprobs(model)[token]
+        model.n_tokens = n_prompt
+        scores[choice] = float(logprob)
+    return scores
+
+
+# ========== Checkpoint ==========
+def load_checkpoint(path):
+    """Finished results from an earlier (possibly interrupted) run, keyed by (model, task, index, mode)."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 中断时可能留下半行
+                continue
+            done[(record["model"], record["task"], record["index"], record.get("mode", "generate"))] = record
+    return done
+
+
+def append_record(fd, record):
+    # O_APPEND + 单次 write：多个进程同时追加时每行保持完整
+    os.write(fd, (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+# ========== Workers ==========
+def plan_workers(model_paths, max_workers=None, n_ctx=N_CTX):
+    """Number of models evaluated at once (bounded by cores and by RAM for the largest models) and threads for each."""
+    cores = physical_core_count()
+    workers = min(len(model_paths), max_workers or cores)
+    memory = available_memory_bytes()
+    if memory:
+        sizes = sorted((estimate_memory_bytes(read_model_info(path), n_ctx) for path in model_paths), reverse=True)
+        fits = 0
+        while fits < len(sizes) and sum(sizes[:fits + 1]) <= memory:
+            fits += 1
+        workers = min(workers, fits)
+    workers = max(1, workers)
+    return workers, max(1, cores // workers)
+
+
+def evaluate_model(model_path, items, checkpoint_path, n_threads, n_gpu_layers=-1, seed=SEED, mode="generate"):
+    """
+    Runs in a worker process: load one model, answer every pending item, checkpoint each result as it finishes.
+
+    mode "generate" samples a short free-text answer and parses it; "loglik" picks the choice with the highest
+    log-probability after one forward pass over the prompt.
+    """
+    from llama_cpp import Llama
+
+    model_id = os.path.splitext(os.path.basename(model_path))[0]
+    model = Llama(model_path=model_path, n_ctx=N_CTX, n_threads=n_threads, n_gpu_layers=n_gpu_layers, seed=seed,
+                  verbose=False)
+    fd = os.open(checkpoint_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        for item in items:
+            start = time.perf_counter()
+            if mode == "loglik":
+                response = score_choices(model, item["prompt"], TASKS[item["task"]]["choices"])
+                pred = max(response, key=response.get).lower()
+            else:
+                response = model(item["prompt"], max_tokens=20, temperature=0.7, stop=["\n"])["choices"][0]["text"]
+                pred = parse_prediction(item["task"], response)
+            append_record(fd, {
+                "model": model_id, "task": item["task"], "index": item["index"], "mode": mode, "response": response,
+                "pred": pred, "gold": item["gold"], "correct": pred == item["gold"],
+                "seconds": round(time.perf_counter() - start, 3),
+            })
+    finally:
+        os.close(fd)
+    return model_id, len(items)
+
+
+# ========== Results ==========
+def summarize(records, model_ids, task_names):
+    """Model x Task accuracy table (in %), with the per-model average, best first."""
+    table = {}
+    for model_id in model_ids:
+        row = {}
+        for task_name in task_names:
+            results = [r["correct"] for r in records if r["model"] == model_id and r["task"] == task_name]
+            if results:
+                row[task_name] = round(100 * sum(results) / len(results), 2)
+        if row:
+            row["Avg"] = round(sum(row.values()) / len(row), 2)
+            table[model_id] = row
+    return dict(sorted(table.items(), key=lambda kv: kv[1]["Avg"], reverse=True))
+
+
+def save_summary(table, task_names, output_path):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Model"] + task_names + ["Avg"])
+        for model_id, row in table.items():
+            writer.writerow([model_id] + [row.get(name, "") for name in task_names + ["Avg"]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark local GGUF models on BoolQ / PIQA / OpenBookQA")
+    parser.add_argument("--models", nargs="*", help="model ids to evaluate (default: every model in models/)")
+    parser.add_argument("--tasks", nargs="*", default=list(TASKS), choices=list(TASKS))
+    parser.add_argument("-n", "--samples", type=int, default=100, help="samples per task")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--mode", choices=["generate", "loglik"], default="generate",
+                        help="generate a free-text answer, or score the answer choices by log-likelihood")
+    parser.add_argument("--workers", type=int, default=None, help="models evaluated in parallel (default: auto)")
+    parser.add_argument("--gpu-layers", type=int, default=-1)
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--checkpoint", default=None,
+                        help="JSONL checkpoint (default: eval/benchmark_<mode>_<n>_<seed>.jsonl)")
+    parser.add_argument("--offline", action="store_true", help="only use datasets already cached in --data-dir")
+    parser.add_argument("--prepare", action="store_true", help="only download and cache the datasets, then exit")
+    args = parser.parse_args()
+
+    if args.offline:
+        os.environ["HF_DATASETS_OFFLINE"] = "1"
+    if args.prepare:
+        for task_name in args.tasks:
+            print("Cached:", cache_dataset(task_name, args.data_dir))
+        return
+
+    registry = ModelRegistry(models_dir)
+    model_ids = args.models or registry.model_ids()
+    model_paths = {model_id: registry.path(model_id) for model_id in model_ids}
+    checkpoint_path = args.checkpoint or os.path.join(CHECKPOINT_DIR,
+                                                      f"benchmark_{args.mode}_{args.samples}_{args.seed}.jsonl")
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+
+    items = prepare_items(args.tasks, args.samples, args.seed, args.data_dir, args.offline)
+    done = load_checkpoint(checkpoint_path)
+    pending = {}
+    for model_id in model_ids:
+        todo = [item for item in items if (model_id, item["task"], item["index"], args.mode) not in done]
+        if todo:
+            pending[model_id] = todo
+    print(f"{len(items)} prompts x {len(model_ids)} models; {sum(map(len, pending.values()))} evaluations pending")
+
+    if pending:
+        workers, n_threads = plan_workers([model_paths[m] for m in pending], args.workers)
+        print(f"Running {workers} worker(s) with {n_threads} thread(s) each; checkpoint: {checkpoint_path}")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(evaluate_model, model_paths[model_id], todo, checkpoint_path, n_threads,
+                                       args.gpu_layers, args.seed, args.mode): model_id
+                       for model_id, todo in pending.items()}
+            for future in as_completed(futures):
+                try:
+                    model_id, count = future.result()
+                    print(f"=== {model_id}: {count} evaluations done ===")
+                except Exception as e:
+                    # 已完成的结果都在 checkpoint 中，重新运行即可从中断处继续
+                    print(f"=== {futures[future]} failed: {e} ===")
+
+    wanted = {(item["task"], item["index"]) for item in items}
+    records = [r for r in load_checkpoint(checkpoint_path).values()
+               if (r["task"], r["index"]) in wanted and r.get("mode", "generate") == args.mode]
+    table = summarize(records, model_ids, args.tasks)
+    for model_id, row in table.items():
+        print(model_id, " ".join(f"{name}={row[name]:.2f}" for name in args.tasks + ["Avg"] if name in row))
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_path = os.path.join(CHECKPOINT_DIR, f"eval_results_{args.mode}_{args.samples}samples_{timestamp}.csv")
+    save_summary(table, args.tasks, output_path)
+    print(f"\n✅ Combined results saved to: {output_path}")
+
+
+if __name__ == '__main__':
+    main()
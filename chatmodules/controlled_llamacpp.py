@@ -0,0 +1,163 @@
+"""LlamaCpp whose streamed generation can be ended early from Python."""
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.outputs import Generation, LLMResult
+from langchain_core.runnables.config import run_in_executor
+from langchain_community.llms.llamacpp import LlamaCpp
+from pydantic import PrivateAttr
+
+from chatmodules.prefix_cache import model_fingerprint
+from chatmodules.response_cache import response_cache
+from chatmodules.stream_parsers import THINK_CLOSE, THINK_OPEN, ActionStreamParser, ThinkFilter
+from chatmodules.turn_control import find_turn_control
+
+# 默认思考预算（token），可按模型调整；None 表示不限制
+DEFAULT_REASONING_BUDGET = 1024
+# 思考预算用完后补上的结束标签，之后模型直接开始作答
+FORCED_THINK_CLOSE = f"\n{THINK_CLOSE}\n\n"
+
+
+class ControlledLlamaCpp(LlamaCpp):
+    """
+    Drop-in LlamaCpp that watches its own token stream.
+
+    Per-call options are passed as LLM kwargs (e.g. through `LLMChain.llm_kwargs`), so a single loaded model can be
+    shared by bots that want different behaviour:
+
+    - stop_on_action: stop decoding as soon as a complete agent action JSON has been generated.
+    - reasoning_budget: maximum number of tokens spent inside `<think>`; once reached, `</think>` is appended and
+      generation continues from there, so the answer starts.
+    - use_response_cache: serve repeated requests from `response_cache` when generation is deterministic
+      (temperature 0 or a fixed seed). The key covers the model file, the full prompt and every sampling setting.
+
+    A TurnControl among the callbacks ends the streamed generation as soon as the turn is cancelled or past its
+    deadline; the text generated so far is returned and the stop reason is reported in `generation_info`.
+
+    Speculative decoding is configured at load time (a `draft_model` in `model_kwargs`, see `load_llamacpp`).
+    The thinking/answer token counts and draft acceptance of each generation are returned in its `generation_info`,
+    where callbacks (see `GenerationStatsHandler`) can pick them up.
+    """
+
+    _last_stats: dict = PrivateAttr(default_factory=dict)
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            self._last_stats = {}
+            text = self._call(prompt, stop=stop, run_manager=run_manager, **kwargs)
+            generations.append([Generation(text=text, generation_info=self._last_stats or None)])
+        return LLMResult(generations=generations)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        # LLM 默认的 _agenerate 经 _acall 只返回文本，会丢掉 generation_info；agent 的 ainvoke 走的是这里
+        return await run_in_executor(None, self._generate, prompts, stop,
+                                     run_manager.get_sync() if run_manager else None, **kwargs)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        stop_on_action = kwargs.pop("stop_on_action", False)
+        reasoning_budget = kwargs.pop("reasoning_budget", None)
+        use_response_cache = kwargs.pop("use_response_cache", False)
+        if not (use_response_cache and self.is_deterministic(**kwargs)):
+            return self._call_model(prompt, stop, run_manager, stop_on_action, reasoning_budget, **kwargs)
+
+        model_hash = model_fingerprint(self.model_path)
+        params = {**self._get_parameters(stop), **kwargs, "seed": self.seed, "stop_on_action": stop_on_action,
+                  "reasoning_budget": reasoning_budget}
+        cache_key = response_cache.key(model_hash, prompt, params)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            text, stats = cached
+            self._last_stats = {**stats, "cached": True}
+            if run_manager and text:
+                run_manager.on_llm_new_token(token=text, verbose=self.verbose)
+            return text
+
+        text = self._call_model(prompt, stop, run_manager, stop_on_action, reasoning_budget, **kwargs)
+        if not self._last_stats.get("stopped"):
+            # 被中途停止的回复不完整，不写入缓存
+            response_cache.put(cache_key, model_hash, text, self._last_stats)
+        return text
+
+    def is_deterministic(self, **kwargs):
+        """Greedy sampling or a fixed seed: the same prompt always yields the same text."""
+        temperature = kwargs.get("temperature", self.temperature)
+        return (temperature is not None and temperature <= 0) or self.seed != -1
+
+    def _call_model(self, prompt, stop, run_manager, stop_on_action, reasoning_budget, **kwargs):
+        # 推测解码：统计本次调用中草稿 token 的接受情况
+        draft = getattr(self.client, "draft_model", None)
+        if draft is not None and hasattr(draft, "reset_stats"):
+            draft.reset_stats()
+        text = self._generate_text(prompt, stop, run_manager, stop_on_action, reasoning_budget, **kwargs)
+        if draft is not None and hasattr(draft, "stats"):
+            self._last_stats.update(draft.stats())
+        return text
+
+    def _generate_text(self, prompt, stop, run_manager, stop_on_action, reasoning_budget, **kwargs):
+        if not self.streaming:
+            return super()._call(prompt, stop=stop, run_manager=run_manager, **kwargs)
+
+        action_parser = ActionStreamParser() if stop_on_action else None
+        think = ThinkFilter(in_think=prompt.rstrip().lower().endswith(THINK_OPEN))
+        control = find_turn_control(run_manager)
+        budget_hit = False
+        stopped = None
+        chunks = []
+        while True:
+            over_budget = False
+            # 续写时提示词与上一段共享前缀，llama.cpp 会复用已有的 KV cache
+            stream = self._stream(prompt=prompt + "".join(chunks), stop=stop, run_manager=run_manager, **kwargs)
+            try:
+                for chunk in stream:
+                    chunks.append(chunk.text)
+                    think.feed(chunk.text)
+                    if action_parser is not None and action_parser.feed(chunk.text):
+                        # action JSON 已完整，后续 token 不会被使用，直接停止解码
+                        break
+                    if control is not None and control.stop_reason():
+                        # 用户取消或超出本轮的时间/token 限制：保留已生成的部分
+                        stopped = control.stop_reason()
+                        break
+                    if reasoning_budget is not None and think.in_think and think.thinking_tokens >= reasoning_budget:
+                        over_budget = True
+                        break
+            finally:
+                stream.close()
+            if not over_budget:
+                break
+
+            budget_hit = True
+            reasoning_budget = None
+            chunks.append(FORCED_THINK_CLOSE)
+            think.feed(FORCED_THINK_CLOSE)
+            if action_parser is not None:
+                action_parser.feed(FORCED_THINK_CLOSE)
+            if run_manager:
+                run_manager.on_llm_new_token(token=FORCED_THINK_CLOSE, verbose=self.verbose)
+            max_tokens = kwargs.get("max_tokens", self.max_tokens)
+            if max_tokens and max_tokens > 0:
+                kwargs["max_tokens"] = max(1, max_tokens - len(chunks))
+
+        self._last_stats = {**think.stats(), "budget_hit": budget_hit}
+        if stopped:
+            self._last_stats["stopped"] = stopped
+        return "".join(chunks)
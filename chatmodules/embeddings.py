@@ -0,0 +1,77 @@
+"""Small CPU text embedders behind one interface: embed(texts) -> L2-normalized float32 array of shape (n, dim)."""
+import re
+import zlib
+
+import numpy as np
+
+HASHING_EMBEDDER = "hash"
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class HashingEmbedder(object):
+    """
+    Character n-gram counts hashed into `dim` buckets (the hashing trick).
+
+    Needs no model file and costs microseconds per text; it captures surface similarity (shared words and word
+    pieces, in any script) rather than meaning, which is enough for short, formulaic queries and for tests.
+    """
+
+    def __init__(self, dim=512, ngram_sizes=(2, 3, 4)):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+        self.name = f"hash-{dim}"
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = " " + re.sub(r"\s+", " ", text.casefold()).strip() + " "
+            for n in self.ngram_sizes:
+                for i in range(len(text) - n + 1):
+                    h = zlib.crc32(text[i:i + n].encode("utf-8"))
+                    # 用哈希的另一位决定符号，减少桶冲突带来的偏差
+                    vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return normalize_rows(vectors)
+
+
+class LlamaEmbedder(object):
+    """Sentence embeddings from a GGUF embedding model (e.g. a small BERT/nomic/bge export) through llama.cpp."""
+
+    def __init__(self, model_path, n_ctx=512, n_threads=None):
+        from llama_cpp import Llama
+
+        self.model = Llama(model_path=model_path, embedding=True, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+        self.name = model_path
+        self.dim = self.model.n_embd()
+
+    def embed(self, texts):
+        return normalize_rows(self.model.embed(list(texts)))
+
+
+class SentenceTransformerEmbedder(object):
+    """Embeddings from a sentence-transformers model (optional dependency), forced onto the CPU."""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.name = model_name
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return normalize_rows(self.model.encode(list(texts), convert_to_numpy=True))
+
+
+def load_embedder(spec):
+    """None -> None; "hash" -> HashingEmbedder; a .gguf path -> LlamaEmbedder; else a sentence-transformers name."""
+    if not spec:
+        return None
+    if spec == HASHING_EMBEDDER:
+        return HashingEmbedder()
+    if spec.endswith(".gguf"):
+        return LlamaEmbedder(spec)
+    return SentenceTransformerEmbedder(spec)
@@ -1,6 +1,8 @@
+import asyncio
 import os
-import sys
 import re
+import sys
+import time
 import warnings
 import json
 from typing import Any
@@ -10,19 +12,45 @@ from langchain.agents.agent_types import AgentType
 from langchain.agents.agent import AgentExecutor
 from langchain.agents.conversational_chat.base import ConversationalChatAgent
 from langchain.agents.agent import AgentOutputParser
-from langchain_core.prompts import PromptTemplate
-from langchain.memory import ConversationBufferMemory
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
 from langchain.schema import AIMessage
 from langchain.schema.agent import AgentAction, AgentFinish
 from langchain_community.llms.gpt4all import GPT4All
-from langchain_community.llms.llamacpp import LlamaCpp
+from chatmodules.model_registry import ModelRegistry
+from chatmodules.streaming import FinalAnswerStreamHandler, GenerationStatsHandler
+from chatmodules.turn_metrics import TurnMetricsHandler, metrics_log
+from chatmodules.controlled_llamacpp import DEFAULT_REASONING_BUDGET, ControlledLlamaCpp
+from chatmodules.intent_router import IntentRouter
+from chatmodules.long_term_memory import RECALL_TOKEN_BUDGET, recall_messages
+from chatmodules.prefix_cache import prefix_cache, system_prefix_text
+from chatmodules.stream_parsers import ActionStreamParser, partial_final_answer
+from chatmodules.token_budget_memory import TokenBudgetMemory, history_token_budget
+from chatmodules.turn_control import TurnControl
 from tools.get_weather import GetWeatherRun
 from tools.get_time import GetTimeRun
+from tools.cache import CachedTool, TTLCache
+from tools.runtime import ToolRuntime
 
 warnings.filterwarnings("ignore")
 
 models_dir_prefix = "models/"
 use_gpu = True
+# 推测解码：None、"prompt-lookup"、"auto"（models/ 中最小的同分词器模型）或草稿模型 id
+SPECULATIVE = None
+# 一轮对话中所有工具调用的总时间上限（秒）
+TURN_TOOL_TIMEOUT = 30
+# 每轮的墙钟时间（秒）和生成 token 数上限（所有 agent 步骤合计），超出后停止；None 表示不限制
+TURN_TIMEOUT = None
+TURN_MAX_TOKENS = None
+# 时间、当前天气这类单工具问题由 intent_router 直接调用工具并按模板回答，不经过 LLM
+USE_INTENT_ROUTER = True
+BOT_TYPE = "agent"
+
+# 所有 agent 共享的工具执行线程池和结果缓存
+tool_runtime = ToolRuntime()
+tool_cache = TTLCache(max_entries=256)
+# 默认只用规则；传入带 embedder 的 IntentRouter 可启用嵌入分类（见 chatmodules.embeddings）
+default_intent_router = IntentRouter()
 
 # Define the system prompt
 GIVEN_NAME = "Murph"
@@ -53,7 +81,7 @@ FORMAT_INSTRUCTIONS_CHINESE = """RESPONSE FORMAT INSTRUCTIONS
 ----------------------------
 When responding to me, please output a response in one of two formats:
 **Option 1:**
-Use this if you want the human to use a tool.
+Use this if you want the human to use a tool. If you need several independent tools at once, output a JSON list of such objects in one code snippet.
 Markdown code snippet formatted in the following schema:
 ```json
 {{{{
@@ -70,6 +98,22 @@ Use this if you want to respond directly to the human. Markdown code snippet for
 }}}}
 ```"""
 
+TOOLS_INSTRUCTIONS = """TOOLS
+------
+Assistant can ask the user to use tools to look up information that may be helpful in answering the users original question. The tools the human can use are:
+
+{tools}
+
+"""
+
+# 工具说明和格式要求放在 system message 中，human message 只保留用户输入，
+# 这样 system message 就是每轮都不变的前缀，可以由 prefix_cache 复用其 KV 状态
+HUMAN_MESSAGE = """USER'S INPUT
+--------------------
+Here is the user's input (remember to respond with a markdown code snippet of a json blob with a single action, and NOTHING else):
+
+{{{{input}}}}"""
+
 # ============================
 # Custom Output Parser for Tool Calling
 # ============================
@@ -79,46 +123,20 @@ class MyAgentOutputParser(AgentOutputParser):
         return FORMAT_INSTRUCTIONS_CHINESE
 
     def parse(self, text: str) -> Any:
-        def extract_clean_answer(response: str) -> str:
-            print("response before removing <think> tags:", response)
-            """
-            清洗回答内容，去除 <think> 标签及其内容，以及孤立的 <think> 或 </think>。
-            然后尝试提取最后一个 ```json ... ``` 块作为有效 JSON。
-            """
-            # 1. 移除成对的 <think>...</think>
-            response = re.sub(r"<think>[\s\S]*?</think>", "", response, flags=re.IGNORECASE)
-
-            # 2. 移除孤立标签
-            response = re.sub(r"[\s\S]*?</?think>", "", response, flags=re.IGNORECASE)
-
-            # 3. 清除多余空行
-            response = re.sub(r"\n\s*\n", "\n\n", response)
-
-            print("response after removing <think> tags:", response)
-
-            # 提取所有 ```json ... ``` 块，取最后一个
-            json_blocks = re.findall(r"```json(.*?)```", response, re.DOTALL)
-            if json_blocks:
-                return json_blocks[-1].strip()
-            else:
-                # fallback：尝试提取一般 JSON 块（不带 markdown）
-                json_candidates = re.findall(r"\{[\s\S]*?\}", response)
-                return json_candidates[-1].strip() if json_candidates else ""
-
-        # 打印调试（可选）
-        # print("==== Full LLM Output ====")
-        # print(text)
-
-        cleaned_output = extract_clean_answer(text)
-
-        if not cleaned_output:
+        # 与生成时提前停止所用的是同一个增量解析器：跳过 <think> 内容，取最后一个完整的 action JSON
+        response = ActionStreamParser().feed_all(text)
+
+        if response is None:
+            print("❌ 未找到有效的 action JSON，模型输出如下：\n", text)
             raise ValueError("清理后输出为空，无法解析 JSON。")
 
-        try:
-            response = json.loads(cleaned_output)
-        except Exception as e:
-            print("❌ JSON 解析失败，内容如下：\n", cleaned_output)
-            raise e
+        if isinstance(response, list):
+            # 一次请求多个独立工具：返回多个 AgentAction，由 AgentExecutor 并发执行
+            actions = [item for item in response if isinstance(item, dict) and item.get("action") != "Final Answer"]
+            if actions:
+                return [AgentAction(tool=item.get("action"), tool_input=item.get("action_input"), log=text if i == 0 else "")
+                        for i, item in enumerate(actions)]
+            response = response[-1] if response else {}
 
         action = response.get("action")
         action_input = response.get("action_input")
@@ -140,48 +158,132 @@ class MyAgentOutputParser(AgentOutputParser):
 # Main Agent Chatbot Class
 # ============================
 class GPT4AllAgentbot:
-    def __init__(self, model_index):
-        model_list = os.listdir(models_dir_prefix)
-        model_name = model_list[model_index]
-        print("Loading model:", models_dir_prefix + model_name)
-
-        # self.llm = GPT4All(model=models_dir_prefix + model_name, device="gpu" if use_gpu else "cpu")
-        self.llm = LlamaCpp(model_path=models_dir_prefix + model_name, temperature=0.7, max_tokens=5120, n_ctx=131072, n_threads=6, verbose=False)
+    def __init__(self, model_id, llm=None, reasoning_budget=DEFAULT_REASONING_BUDGET, speculative=SPECULATIVE,
+                 turn_timeout=TURN_TIMEOUT, turn_max_tokens=TURN_MAX_TOKENS, use_intent_router=USE_INTENT_ROUTER,
+                 intent_router=None, long_term_memory=None):
+        if llm is None:
+            # llm = GPT4All(model=ModelRegistry(models_dir_prefix).path(model_id), device="gpu" if use_gpu else "cpu")
+            # n_ctx / n_threads / n_batch 根据 GGUF 元数据和本机资源自动确定
+            llm = ModelRegistry(models_dir_prefix).create_llm(model_id, speculative=speculative)
+        # llm 可由 ModelPool 传入，多个 chatbot 实例共享同一个已加载模型
+        self.model_id = model_id
+        self.llm = llm
+        self.turn_timeout = turn_timeout
+        self.turn_max_tokens = turn_max_tokens
+        self.intent_router = (intent_router or default_intent_router) if use_intent_router else None
+        # 可选的 LongTermMemory（可在多个 chatbot 间共享）：每轮写入，并按相关性召回以前的轮次
+        self.long_term_memory = long_term_memory
         
         self.gettimetool = GetTimeRun()
         self.getweathertool = GetWeatherRun()
-        self.tools = [Tool(
-                        name=self.gettimetool.name,
-                        func=lambda no_use: self.gettimetool.run(no_use),
-                        description=self.gettimetool.description
-                        ),
-                      Tool(
-                        name=self.getweathertool.name,
-                        func=lambda city_country: self.getweathertool.run(city_country),
-                        description=self.getweathertool.description
-                        ),
+        # 工具在 tool_runtime 中执行：每个工具有独立超时，同一步请求的多个工具并发执行
+        # 相同（规范化后）参数的调用在 TTL 内直接返回缓存结果
+        self.tools = [tool_runtime.as_langchain_tool(CachedTool(self.gettimetool, tool_cache)),
+                      tool_runtime.as_langchain_tool(CachedTool(self.getweathertool, tool_cache)),
                       ]
                      # + load_tools(['wolfram-alpha', 'google-serper'])
         self.tool_names = [tool.name for tool in self.tools]
-
-        self.memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+        tool_strings = "\n".join(f"> {tool.name}: {tool.description}" for tool in self.tools)
+        self.system_message = (PREFIX
+                               + TOOLS_INSTRUCTIONS.format(tools=tool_strings.replace("{", "{{").replace("}", "}}"))
+                               + FORMAT_INSTRUCTIONS_CHINESE.format(tool_names=", ".join(self.tool_names)))
+
+        reserved_tokens = self.llm.get_num_tokens(self.system_message)
+        if long_term_memory is not None:
+            reserved_tokens += RECALL_TOKEN_BUDGET
+        self.memory = TokenBudgetMemory(llm=self.llm, memory_key="chat_history", input_key="input", return_messages=True,
+                                        max_token_limit=history_token_budget(self.llm, reserved_tokens=reserved_tokens))
         self.output_parser = MyAgentOutputParser()
 
         self.agent_cls = ConversationalChatAgent
         self.agent_obj = self.agent_cls.from_llm_and_tools(self.llm, self.tools, 
                                                            callback_manager=None, 
                                                            output_parser=self.output_parser, 
-                                                           system_message=PREFIX)
+                                                           system_message=self.system_message,
+                                                           human_message=HUMAN_MESSAGE)
+        # 与 GPT4AllChatbot 相同：长期记忆的召回片段放在历史之后、用户输入之前
+        messages = list(self.agent_obj.llm_chain.prompt.messages)
+        history_index = next(i for i, m in enumerate(messages) if getattr(m, "variable_name", None) == "chat_history")
+        messages.insert(history_index + 1, MessagesPlaceholder(variable_name="recalled"))
+        self.agent_obj.llm_chain.prompt = ChatPromptTemplate.from_messages(messages)
         self.agent_executor = AgentExecutor.from_agent_and_tools(agent=self.agent_obj, 
                                                                  tools=self.tools, 
                                                                  callback_manager=None, 
                                                                  verbose=True, 
                                                                  memory=self.memory)
-
-    def get_response(self, dialogue_list):
+        self.prefix_text = system_prefix_text(self.agent_obj.llm_chain.prompt)
+        self.last_turn_metrics = {}
+        if isinstance(self.llm, ControlledLlamaCpp):
+            # action JSON 一旦完整就停止解码，不再把 token 浪费在代码块之后的内容上
+            self.agent_obj.llm_chain.llm_kwargs = {"stop_on_action": True, "reasoning_budget": reasoning_budget}
+
+    def get_response(self, dialogue_list, on_token=None, control=None):
+        # on_token 只收到最终回答（Final Answer 的 action_input），不包括 action JSON 和中间的工具调用
+        # control: 可选 TurnControl；停止时当前 LLM 调用立即结束，agent 不再执行下一步
         latest_msg = dialogue_list[-1]["content"]
-        return self.agent_executor.run(latest_msg)
-    
+        control = (control or TurnControl()).begin(self.turn_timeout, self.turn_max_tokens)
+        metrics_handler = TurnMetricsHandler(self.llm.get_num_tokens)
+        prefix_cache.restore(self.llm, self.prefix_text)
+        stats_handler = GenerationStatsHandler()
+        callbacks = [metrics_handler, stats_handler, control] + ([FinalAnswerStreamHandler(on_token)] if on_token else [])
+        remaining = control.remaining_time()
+        tool_runtime.begin_turn(TURN_TOOL_TIMEOUT if remaining is None else min(TURN_TOOL_TIMEOUT, remaining))
+        route = self.intent_router.route(latest_msg) if self.intent_router is not None else None
+        output = self.answer_directly(route, latest_msg, callbacks, on_token) if route is not None else None
+        recall_stats = {}
+        if output is None:
+            route = None
+            recalled, recall_stats = self.recall(latest_msg)
+            try:
+                # 异步执行 agent，使同一步中的多个工具调用可以并发
+                result = asyncio.run(self.agent_executor.ainvoke({"input": latest_msg, "recalled": recalled},
+                                                                 config={"callbacks": callbacks}))
+                output = result["output"]
+            except Exception:
+                if not control.stopped:
+                    raise
+                # 停止时 agent 停在不完整的 action JSON 或两步之间：返回已生成的最终回答部分
+                output = partial_final_answer(control.last_text)
+                self.memory.save_context({"input": latest_msg}, {"output": output})
+            # 路由回答的时间、天气很快过时，不写入长期记忆
+            if self.long_term_memory is not None and output and not control.stopped:
+                self.long_term_memory.add(latest_msg, output, model=self.model_id)
+        self.last_turn_metrics = metrics_handler.summary(model=self.model_id, bot=BOT_TYPE, stopped=control.reason,
+                                                         routed=route.intent if route else None, **recall_stats,
+                                                         **stats_handler.stats)
+        metrics_log.write(self.last_turn_metrics)
+        return output
+
+    def recall(self, question):
+        """Long-term memory snippets relevant to `question` (prompt messages) and their metrics fields."""
+        if self.long_term_memory is None:
+            return [], {}
+        start = time.perf_counter()
+        # 仍在短期历史中的轮次不必重复注入
+        in_history = {message.content for message in self.memory.chat_memory.messages if message.type == "human"}
+        hits = self.long_term_memory.search(question, exclude_questions=in_history)
+        messages, count = recall_messages(hits, self.llm.get_num_tokens)
+        return messages, {"recalled": count, "recall_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+    def answer_directly(self, route, latest_msg, callbacks, on_token=None):
+        """Run the routed tool and answer from its template; None (use the agent) if that is not possible."""
+        tool = next(tool for tool in self.tools if tool.name == route.tool)
+        observation = tool.run(route.tool_input, callbacks=callbacks)
+        if observation.startswith("Error:"):
+            # 工具出错时交给 agent，由模型给出得体的回答
+            return None
+        output = route.format(observation)
+        if output is None:
+            return None
+        if on_token:
+            on_token(output)
+        # 与 agent 的回答一样写入记忆，后续轮次的上下文保持完整
+        self.memory.save_context({"input": latest_msg}, {"output": output})
+        return output
+
+    def reset_memory(self):
+        self.memory.clear()
+
     def exit(self):
         del self.agent_executor
         del self.llm
@@ -195,13 +297,13 @@ if __name__ == '__main__':
     from tools.get_time import GetTimeRun
 
     models_dir_prefix = "../models/"
-    model_info_str = "Available models:\n" + ", \n".join([
-        f"{i}: {model}" for i, model in enumerate(os.listdir(models_dir_prefix))
-    ])
+    model_info_str = "Available models:\n" + ", \n".join(ModelRegistry(models_dir_prefix).model_ids())
     print(model_info_str)
-    chosen_model = int(input("Please choose a model: "))
+    chosen_model = input("Please choose a model id: ").strip()
 
     chatbot = GPT4AllAgentbot(chosen_model)
+    # 命令行对话时在每轮之后打印性能指标
+    metrics_log.echo = True
     dialogue_list = []
 
     print("You can start chatting with Murph now. Type 'exit' to quit.")
@@ -216,7 +318,7 @@ if __name__ == '__main__':
 
             dialogue_list.append({"role": "user", "content": user_input})
             print("\nThinking...")
-            response = chatbot.get_response(dialogue_list)
+            response = chatbot.get_response(dialogue_list, on_token=lambda token: print(token, end="", flush=True))
             print(f"{GIVEN_NAME}: {response}")
             dialogue_list.append({"role": "assistant", "content": response})
 
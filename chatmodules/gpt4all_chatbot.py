@@ -1,22 +1,30 @@
 import os
 import re
+import time
 import warnings
 from langchain.chains.llm import LLMChain
-from langchain.memory import ConversationBufferMemory
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.prompts import (
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
     MessagesPlaceholder
 )
-from langchain.schema import AIMessage
 from langchain_community.llms.gpt4all import GPT4All
-from langchain_community.llms.llamacpp import LlamaCpp
+from chatmodules.controlled_llamacpp import DEFAULT_REASONING_BUDGET, ControlledLlamaCpp
+from chatmodules.model_registry import ModelRegistry
+from chatmodules.streaming import GenerationStatsHandler, TokenStreamHandler
+from chatmodules.turn_metrics import TurnMetricsHandler, metrics_log
+from chatmodules.prefix_cache import prefix_cache, system_prefix_text
+from chatmodules.token_budget_memory import TokenBudgetMemory, history_token_budget
+from chatmodules.long_term_memory import RECALL_TOKEN_BUDGET, recall_messages
+from chatmodules.turn_control import TurnControl
 
 warnings.filterwarnings("ignore")
 
 models_dir_prefix = "models/"
 use_gpu = True
+# 推测解码：None、"prompt-lookup"、"auto"（models/ 中最小的同分词器模型）或草稿模型 id
+SPECULATIVE = None
 
 # Define the system prompt
 GIVEN_NAME = "Murph"
@@ -46,35 +54,79 @@ Start by waiting for the user's input. Respond like a helpful AI assistant.
 system_prompt = SystemMessagePromptTemplate.from_template(PREFIX)
 # answer_prompt = GIVEN_NAME + ", please answer directly and helpfully:\n"
 answer_prompt = ", Answer:\n"
+BOT_TYPE = "chat"
+# 温度为 0 或固定 seed 时，相同的完整 prompt 直接返回缓存的回复（见 response_cache）
+USE_RESPONSE_CACHE = False
+# 每轮的墙钟时间（秒）和生成 token 数上限，超出后停止生成并保留已生成的部分；None 表示不限制
+TURN_TIMEOUT = None
+TURN_MAX_TOKENS = None
 
 prompt = ChatPromptTemplate.from_messages([
     system_prompt,
     MessagesPlaceholder(variable_name="chat_history"),
+    # 从长期记忆召回的片段放在历史之后：系统提示和历史仍是逐轮增长的前缀，KV 状态可以复用
+    MessagesPlaceholder(variable_name="recalled"),
     HumanMessagePromptTemplate.from_template("User: {question}\n\n" + answer_prompt)
 ])
 
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
-
 class GPT4AllChatbot:
-    def __init__(self, model_index):
-        model_list = os.listdir(models_dir_prefix)
-        model_name = model_list[model_index]
-        print("Loading model:", models_dir_prefix + model_name)
-
-        # self.llm = GPT4All(model=models_dir_prefix + model_name, device="gpu" if use_gpu else "cpu")
-        self.llm = LlamaCpp(model_path=models_dir_prefix + model_name, temperature=0.7, max_tokens=5120, n_ctx=131072, n_threads=6, verbose=False)
-        self.chain = LLMChain(llm=self.llm, prompt=prompt, memory=memory)
-
-    def get_response(self, dialogue_list):
-        result = self.chain.invoke({"question": dialogue_list[-1]["content"]})
-
-        # 从 memory 返回中提取 AI 回复
-        for msg in reversed(self.chain.memory.chat_memory.messages):
-            if isinstance(msg, AIMessage):
-                # return msg.content
-                return self.extract_clean_answer(msg.content)
-
-        return ""
+    def __init__(self, model_id, llm=None, reasoning_budget=DEFAULT_REASONING_BUDGET,
+                 use_response_cache=USE_RESPONSE_CACHE, speculative=SPECULATIVE, turn_timeout=TURN_TIMEOUT,
+                 turn_max_tokens=TURN_MAX_TOKENS, long_term_memory=None):
+        if llm is None:
+            # llm = GPT4All(model=ModelRegistry(models_dir_prefix).path(model_id), device="gpu" if use_gpu else "cpu")
+            # n_ctx / n_threads / n_batch 根据 GGUF 元数据和本机资源自动确定
+            llm = ModelRegistry(models_dir_prefix).create_llm(model_id, speculative=speculative)
+        # llm 可由 ModelPool 传入，多个 chatbot 实例共享同一个已加载模型
+        self.model_id = model_id
+        self.llm = llm
+        self.turn_timeout = turn_timeout
+        self.turn_max_tokens = turn_max_tokens
+        # 可选的 LongTermMemory（可在多个 chatbot 间共享）：每轮写入，并按相关性召回以前的轮次
+        self.long_term_memory = long_term_memory
+        self.prefix_text = system_prefix_text(prompt)
+        reserved_tokens = self.llm.get_num_tokens(self.prefix_text)
+        if long_term_memory is not None:
+            reserved_tokens += RECALL_TOKEN_BUDGET
+        # 对话历史按 token 预算截断，较早的轮次折叠为摘要
+        self.memory = TokenBudgetMemory(llm=self.llm, input_key="question", max_token_limit=history_token_budget(
+            self.llm, reserved_tokens=reserved_tokens))
+        self.chain = LLMChain(llm=self.llm, prompt=prompt, memory=self.memory)
+        if isinstance(self.llm, ControlledLlamaCpp):
+            # 推理模型的 <think> 最多占用 reasoning_budget 个 token，之后强制结束思考开始作答
+            self.chain.llm_kwargs = {"reasoning_budget": reasoning_budget, "use_response_cache": use_response_cache}
+        self.last_turn_metrics = {}
+
+    def get_response(self, dialogue_list, on_token=None, control=None):
+        # on_token: 可选回调，生成过程中逐个接收 token
+        # control: 可选 TurnControl，调用方可以用它从其他线程取消本轮；停止时返回已生成的部分
+        control = (control or TurnControl()).begin(self.turn_timeout, self.turn_max_tokens)
+        metrics_handler = TurnMetricsHandler(self.llm.get_num_tokens)
+        prefix_cache.restore(self.llm, self.prefix_text)
+        stats_handler = GenerationStatsHandler()
+        callbacks = [metrics_handler, stats_handler, control] + ([TokenStreamHandler(on_token)] if on_token else [])
+        question = dialogue_list[-1]["content"]
+        recalled, recall_stats = self.recall(question)
+        result = self.chain.invoke({"question": question, "recalled": recalled},
+                                   config={"callbacks": callbacks})
+        answer = self.extract_clean_answer(result[self.chain.output_key])
+        if self.long_term_memory is not None and answer and not control.stopped:
+            self.long_term_memory.add(question, answer, model=self.model_id)
+        self.last_turn_metrics = metrics_handler.summary(model=self.model_id, bot=BOT_TYPE, stopped=control.reason,
+                                                         **recall_stats, **stats_handler.stats)
+        metrics_log.write(self.last_turn_metrics)
+        return answer
+
+    def recall(self, question):
+        """Long-term memory snippets relevant to `question` (prompt messages) and their metrics fields."""
+        if self.long_term_memory is None:
+            return [], {}
+        start = time.perf_counter()
+        # 仍在短期历史中的轮次不必重复注入
+        in_history = {message.content for message in self.memory.chat_memory.messages if message.type == "human"}
+        hits = self.long_term_memory.search(question, exclude_questions=in_history)
+        messages, count = recall_messages(hits, self.llm.get_num_tokens)
+        return messages, {"recalled": count, "recall_ms": round((time.perf_counter() - start) * 1000, 2)}
 
     def extract_clean_answer(self, response: str) -> str:
         """
@@ -101,13 +153,13 @@ class GPT4AllChatbot:
 
 if __name__ == '__main__':
     models_dir_prefix = "../models/"
-    model_info_str = "Available models:\n" + ", \n".join([
-        f"{i}: {model}" for i, model in enumerate(os.listdir(models_dir_prefix))
-    ])
+    model_info_str = "Available models:\n" + ", \n".join(ModelRegistry(models_dir_prefix).model_ids())
     print(model_info_str)
-    chosen_model = int(input("Please choose a model: "))
+    chosen_model = input("Please choose a model id: ").strip()
 
     chatbot = GPT4AllChatbot(chosen_model)
+    # 命令行对话时在每轮之后打印性能指标
+    metrics_log.echo = True
     dialogue_list = []
 
     print("You can start chatting with Murph now. Type 'exit' to quit.")
@@ -120,6 +172,7 @@ if __name__ == '__main__':
             break
 
         dialogue_list.append({"role": "user", "content": user_input})
-        response = chatbot.get_response(dialogue_list)
-        print(f"{GIVEN_NAME}: {response}")
+        print(f"{GIVEN_NAME}: ", end="", flush=True)
+        response = chatbot.get_response(dialogue_list, on_token=lambda token: print(token, end="", flush=True))
+        print()
         dialogue_list.append({"role": "assistant", "content": response})
\ No newline at end of file
@@ -0,0 +1,356 @@
+"""Fast path in front of the agent: answer single-tool questions (time, current weather) without an LLM call."""
+import json
+import os
+import re
+import time
+from datetime import datetime
+
+from tools.get_time import GetTimeRun
+from tools.get_weather import GetWeatherRun
+
+INTENT_TIME = "time"
+INTENT_WEATHER = "weather"
+INTENT_AGENT = "agent"
+INTENT_TOOLS = {INTENT_TIME: GetTimeRun.name, INTENT_WEATHER: GetWeatherRun.name}
+INTENT_QUERIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_queries.jsonl")
+# 嵌入分类器：与最相近示例的余弦相似度至少为该值，且比最相近的 agent 示例高出 EMBEDDING_MARGIN 才直接路由
+EMBEDDING_THRESHOLD = 0.75
+EMBEDDING_MARGIN = 0.1
+
+RESPONSE_TEMPLATES = {
+    (INTENT_TIME, "en"): "{observation}",
+    (INTENT_TIME, "zh"): "当前时间：{observation}",
+    (INTENT_WEATHER, "en"): "Current weather in {city}: {observation}",
+    (INTENT_WEATHER, "zh"): "{city}当前天气：{observation}",
+}
+# 工具的输出按此解析后用提问的语言重新组织，解析不了则交给 agent
+# GetWeatherRun：天气类别和描述是 OpenWeatherMap 的英文，其余是中文
+WEATHER_OBSERVATION = re.compile(r"^(?P<main>[^,]*),(?P<description>[^,]*),体感温度(?P<feels_like>-?\d+)摄氏度,"
+                                 r"空气湿度(?P<humidity>\d+)%,风速(?P<wind>[\d.]+)米/秒$")
+# GetTimeRun：英文日期和时间
+TIME_OBSERVATION = re.compile(r"^Today is \w+, (?P<date>\w+ \d{1,2}, \d{4})\. The current time is (?P<time>[\d:]+)\.$")
+WEEKDAYS_ZH = "一二三四五六日"
+# OpenWeatherMap 的天气类别（weather.main）；描述（description）是自由文本，中文回答中不使用
+WEATHER_MAIN_ZH = {
+    "Clear": "晴", "Clouds": "多云", "Rain": "雨", "Drizzle": "毛毛雨", "Thunderstorm": "雷阵雨", "Snow": "雪",
+    "Mist": "薄雾", "Fog": "雾", "Haze": "霾", "Smoke": "烟雾", "Dust": "浮尘", "Sand": "沙尘", "Ash": "火山灰",
+    "Squall": "狂风", "Tornado": "龙卷风",
+}
+
+_END = r"\s*[?？.!。！]*\s*$"
+_POLITE_EN = r"^\s*(?:hey[,\s]+|hi[,\s]+)?(?:(?:please|can you|could you)\s+)?(?:tell me\s+)?"
+_NOW_EN = r"(?:\s+(?:now|right now|today|currently|at the moment))?"
+_CITY_EN = r"(?P<city>[a-z][a-z .'-]*?(?:,\s*[a-z]{2})?)"
+
+TIME_RULES = [
+    re.compile(_POLITE_EN + r"what(?:'s| is)?\s+(?:the\s+)?(?:current\s+)?time(?:\s+is\s+it)?" + _NOW_EN + _END),
+    re.compile(_POLITE_EN + r"(?:the\s+)?(?:current\s+)?time" + _NOW_EN + r"(?:,?\s*please)?" + _END),
+    re.compile(_POLITE_EN + r"what(?:'s| is)?\s+(?:today'?s|the)\s+date" + _NOW_EN + _END),
+    re.compile(_POLITE_EN + r"(?:what|which)\s+day\s+(?:is\s+(?:it|today)|of the week is it)" + _NOW_EN + _END),
+    re.compile(r"^\s*(?:请问)?(?:现在|当前|目前)?(?:是)?(?:几点了?|几点钟|什么时间|时间|北京时间)(?:是多少|了)?[吗呢啊]?" + _END),
+    re.compile(r"^\s*(?:请问)?今天(?:是)?(?:几号|几月几号|星期几|周几|礼拜几|什么日子)[了呢啊]?" + _END),
+]
+WEATHER_RULES = [
+    re.compile(_POLITE_EN + r"(?:what(?:'s| is)|how(?:'s| is))?\s*(?:the\s+)?(?:current\s+)?(?:weather|temperature)"
+               r"(?:\s+like)?\s+(?:in|at|for)\s+" + _CITY_EN + _NOW_EN + _END),
+    re.compile(_POLITE_EN + r"(?:current\s+)?weather\s+(?:in|at|for)\s+" + _CITY_EN + _NOW_EN + _END),
+    re.compile(_POLITE_EN + _CITY_EN + r"\s+weather" + _NOW_EN + _END),
+    re.compile(_POLITE_EN + r"is\s+it\s+(?:raining|sunny|cold|hot|windy|snowing)\s+in\s+" + _CITY_EN + _NOW_EN + _END),
+    re.compile(r"^\s*(?:请问)?(?:现在|今天)?(?P<city>[一-鿿]{2,6}?)(?:市)?(?:现在|今天|目前)?的?(?:天气|气温)"
+               r"(?:怎么样|如何|好吗|怎样|情况)?[吗呢啊]?" + _END),
+]
+# 工具只能回答当前本地时间 / 当前天气：出现这些词时交给 agent
+AGENT_ONLY_WORDS = re.compile(r"\b(?:tomorrow|yesterday|forecast|next|this week|weekend|tonight|later|will|should|umbrella|"
+                              r"timezone|time zone)\b|明天|后天|昨天|预报|下周|周末|今晚|会不会|要不要|带伞|时区")
+NOT_CITIES = {"the", "today", "now", "here", "there", "my", "your", "our", "this", "that", "it", "me", "us", "what",
+              "what's", "how", "how's", "is", "current", "outside", "local", "like", "weather", "good", "nice", "bad"}
+# 常见中文城市名 -> OpenWeatherMap 接受的 "City,CC"；不在表中的中文地名交给 agent 翻译
+CITY_NAMES = {
+    "北京": "Beijing,CN", "上海": "Shanghai,CN", "广州": "Guangzhou,CN", "深圳": "Shenzhen,CN", "杭州": "Hangzhou,CN",
+    "南京": "Nanjing,CN", "苏州": "Suzhou,CN", "成都": "Chengdu,CN", "重庆": "Chongqing,CN", "武汉": "Wuhan,CN",
+    "西安": "Xi'an,CN", "天津": "Tianjin,CN", "长沙": "Changsha,CN", "青岛": "Qingdao,CN", "厦门": "Xiamen,CN",
+    "香港": "Hong Kong,HK", "澳门": "Macau,MO", "台北": "Taipei,TW", "东京": "Tokyo,JP", "首尔": "Seoul,KR",
+    "新加坡": "Singapore,SG", "伦敦": "London,GB", "巴黎": "Paris,FR", "柏林": "Berlin,DE", "纽约": "New York,US",
+    "洛杉矶": "Los Angeles,US", "旧金山": "San Francisco,US", "悉尼": "Sydney,AU",
+}
+
+# 嵌入分类器的示例（规则没有命中时使用）；agent 类示例用于拉开与相似但需要推理的问题的距离
+INTENT_EXAMPLES = {
+    INTENT_TIME: ["what time is it", "current time please", "do you know what time it is", "what's today's date",
+                  "what day is it today", "time now", "现在几点", "现在几点了", "今天几号", "今天星期几"],
+    INTENT_WEATHER: ["what's the weather in London", "weather in Paris", "how is the weather in Tokyo",
+                     "is it raining in Berlin", "temperature in New York", "北京天气怎么样", "上海的天气", "伦敦现在天气如何"],
+    INTENT_AGENT: ["what time does the museum open", "how long until christmas", "will it rain tomorrow in London",
+                   "what should I wear today", "tell me a joke", "what is the capital of France", "write a poem about rain",
+                   "explain how weather forecasts work", "what time zone is Tokyo in", "明天会下雨吗", "给我讲个笑话",
+                   "天气预报是怎么做的"],
+}
+
+
+class Route(object):
+    """A decision to answer with one tool call: the tool name and input plus how to phrase the observation."""
+
+    def __init__(self, intent, tool_input="", city=None, lang="en", confidence=1.0, source="rule"):
+        self.intent = intent
+        self.tool = INTENT_TOOLS[intent]
+        self.tool_input = tool_input
+        self.city = city
+        self.lang = lang
+        self.confidence = confidence
+        self.source = source
+
+    def format(self, observation):
+        """The templated answer, or None if the observation cannot be put in the question's language."""
+        translate = OBSERVATION_FORMATS.get((self.intent, self.lang))
+        if translate is not None:
+            observation = translate(observation)
+            if observation is None:
+                return None
+        return RESPONSE_TEMPLATES[(self.intent, self.lang)].format(observation=observation, city=self.city)
+
+    def __repr__(self):
+        return f"Route({self.intent!r}, {self.tool_input!r}, confidence={self.confidence:.2f}, source={self.source!r})"
+
+
+def english_weather(observation):
+    """GetWeatherRun's observation in English, or None if it is not in the expected format."""
+    match = WEATHER_OBSERVATION.match(observation.strip())
+    if match is None:
+        return None
+    return (f"{match['main']} ({match['description']}), feels like {match['feels_like']}°C, "
+            f"humidity {match['humidity']}%, wind {match['wind']} m/s")
+
+
+def chinese_weather(observation):
+    """GetWeatherRun's observation with the weather category in Chinese, or None if it cannot be translated."""
+    match = WEATHER_OBSERVATION.match(observation.strip())
+    if match is None or match["main"] not in WEATHER_MAIN_ZH:
+        return None
+    return (f"{WEATHER_MAIN_ZH[match['main']]}，体感温度{match['feels_like']}摄氏度，空气湿度{match['humidity']}%，"
+            f"风速{match['wind']}米/秒")
+
+
+def chinese_time(observation):
+    """GetTimeRun's observation as a Chinese date and time, or None if it is not in the expected format."""
+    match = TIME_OBSERVATION.match(observation.strip())
+    if match is None:
+        return None
+    try:
+        # 与 GetTimeRun 的 strftime('%B %d, %Y') 对应
+        date = datetime.strptime(match["date"], "%B %d, %Y")
+    except ValueError:
+        return None
+    return f"{date.year}年{date.month}月{date.day}日 星期{WEEKDAYS_ZH[date.weekday()]} {match['time']}"
+
+
+# (intent, 语言) -> 把工具输出转换为该语言的函数；不在表中的直接使用原输出
+OBSERVATION_FORMATS = {
+    (INTENT_TIME, "zh"): chinese_time,
+    (INTENT_WEATHER, "en"): english_weather,
+    (INTENT_WEATHER, "zh"): chinese_weather,
+}
+
+
+def query_language(text):
+    return "zh" if re.search(r"[一-鿿]", text) else "en"
+
+
+def weather_input(city):
+    """Tool input for a city mentioned in a query ("london" -> "London", "北京" -> "Beijing,CN"), or None."""
+    city = city.strip(" .'-,")
+    if re.search(r"[一-鿿]", city):
+        return CITY_NAMES.get(city[:-1] if city.endswith("市") else city)
+    name, _, country = city.partition(",")
+    name = " ".join(name.split())
+    if not name or len(name.split()) > 3 or any(word in NOT_CITIES for word in name.casefold().split()):
+        return None
+    name = " ".join(part[:1].upper() + part[1:] for part in name.split())
+    return f"{name},{country.strip().upper()}" if country.strip() else name
+
+
+class IntentRouter(object):
+    """
+    Sends high-confidence single-tool questions straight to GetTimeRun / GetWeatherRun; returns None for the rest.
+
+    Stage one is anchored regex rules (whole query must match, English and Chinese). Stage two, when an `embedder`
+    (see chatmodules.embeddings) is given, compares the query with INTENT_EXAMPLES and routes only if the nearest
+    tool example is close enough and clearly closer than the nearest agent example; the city still has to be
+    found in the text. Questions about other times or places (forecasts, time zones) always go to the agent.
+    """
+
+    def __init__(self, embedder=None, threshold=EMBEDDING_THRESHOLD, margin=EMBEDDING_MARGIN, examples=None):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.margin = margin
+        self.examples = examples or INTENT_EXAMPLES
+        self._example_intents = []
+        self._example_vectors = None
+        if embedder is not None:
+            texts = []
+            for intent, phrases in self.examples.items():
+                texts += phrases
+                self._example_intents += [intent] * len(phrases)
+            self._example_vectors = embedder.embed(texts)
+
+    def route(self, text):
+        text = text.strip()
+        if not text or len(text) > 120 or AGENT_ONLY_WORDS.search(text.casefold()):
+            return None
+        return self._match_rules(text) or self._match_embedding(text)
+
+    def _match_rules(self, text):
+        lang = query_language(text)
+        lowered = text.casefold()
+        for rule in TIME_RULES:
+            if rule.match(lowered):
+                return Route(INTENT_TIME, lang=lang)
+        for rule in WEATHER_RULES:
+            match = rule.match(lowered)
+            if match:
+                tool_input = weather_input(match.group("city"))
+                if tool_input is not None:
+                    return Route(INTENT_WEATHER, tool_input, city=_display_city(match.group("city"), tool_input),
+                                 lang=lang)
+        return None
+
+    def _match_embedding(self, text):
+        if self.embedder is None:
+            return None
+        similarities = self._example_vectors @ self.embedder.embed([text])[0]
+        best = {}
+        for intent, similarity in zip(self._example_intents, similarities):
+            best[intent] = max(best.get(intent, -1.0), float(similarity))
+        intent = max((i for i in best if i != INTENT_AGENT), key=best.get)
+        if best[intent] < self.threshold or best[intent] - best.get(INTENT_AGENT, -1.0) < self.margin:
+            return None
+        lang = query_language(text)
+        if intent == INTENT_TIME:
+            return Route(INTENT_TIME, lang=lang, confidence=best[intent], source="embedding")
+        city = _find_city(text)
+        if city is None:
+            return None
+        return Route(INTENT_WEATHER, weather_input(city), city=_display_city(city, weather_input(city)), lang=lang,
+                     confidence=best[intent], source="embedding")
+
+
+def _find_city(text):
+    for name in CITY_NAMES:
+        if name in text:
+            return name
+    match = re.search(r"\b(?:in|at|for)\s+([A-Z][A-Za-z.'-]*(?:\s+[A-Z][A-Za-z.'-]*){0,2})", text)
+    if match and weather_input(match.group(1)) is not None:
+        return match.group(1)
+    return None
+
+
+def _display_city(city, tool_input):
+    city = city.strip(" .'-,")
+    return city if re.search(r"[一-鿿]", city) else tool_input.split(",")[0]
+
+
+def load_labeled_queries(path=INTENT_QUERIES_FILE):
+    """[{"query": ..., "intent": "time" | "weather" | "agent", "tool_input": optional expected input}, ...]"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def evaluate(router, rows):
+    """Routing accuracy on labeled queries; a routed query also needs the expected tool input to count as correct."""
+    confusion = {}
+    latencies = []
+    correct = routed = routed_correct = tool_queries = 0
+    mistakes = []
+    for row in rows:
+        start = time.perf_counter()
+        route = router.route(row["query"])
+        latencies.append(time.perf_counter() - start)
+        predicted = route.intent if route else INTENT_AGENT
+        ok = predicted == row["intent"]
+        if ok and route is not None and "tool_input" in row:
+            ok = route.tool_input.casefold() == row["tool_input"].casefold()
+        confusion.setdefault(row["intent"], {}).setdefault(predicted, 0)
+        confusion[row["intent"]][predicted] += 1
+        correct += ok
+        tool_queries += row["intent"] != INTENT_AGENT
+        if route is not None:
+            routed += 1
+            routed_correct += ok
+        if not ok:
+            mistakes.append({"query": row["query"], "expected": row["intent"], "route": repr(route)})
+    latencies.sort()
+    return {
+        "queries": len(rows),
+        "accuracy": round(correct / len(rows), 3) if rows else None,
+        # 直接路由的查询中答对的比例：错误路由会给出错误回答，这是最重要的指标
+        "routed_precision": round(routed_correct / routed, 3) if routed else None,
+        # 工具类查询中被直接回答的比例（其余仍走 agent，只是没有节省时间）
+        "tool_recall": round(routed_correct / tool_queries, 3) if tool_queries else None,
+        "route_ms_mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+        "route_ms_max": round(1000 * latencies[-1], 3) if latencies else None,
+        "confusion": confusion,
+        "mistakes": mistakes,
+    }
+
+
+def measure_latency_saved(model_id, rows, router, models_dir="models/"):
+    """
+    Run every correctly routed query through GPT4AllAgentbot twice, with and without the router, against the local
+    fake weather server; returns mean turn times and LLM calls for both paths.
+    """
+    from chatmodules.gpt4all_agentbot import GPT4AllAgentbot
+    from chatmodules.model_registry import ModelRegistry
+    from tools.fake_weather_server import start_fake_weather_server
+
+    server, base_url = start_fake_weather_server(latency=0.05)
+    llm = ModelRegistry(models_dir).create_llm(model_id)
+    bots = {"router": GPT4AllAgentbot(model_id, llm=llm, intent_router=router),
+            "agent": GPT4AllAgentbot(model_id, llm=llm, use_intent_router=False)}
+    results = {name: {"total_s": [], "llm_calls": []} for name in bots}
+    errors = {name: 0 for name in bots}
+    try:
+        for row in rows:
+            route = router.route(row["query"])
+            if route is None or route.intent != row["intent"]:
+                continue
+            for name, bot in bots.items():
+                bot.getweathertool.base_url = base_url
+                bot.reset_memory()
+                start = time.perf_counter()
+                try:
+                    bot.get_response([{"role": "user", "content": row["query"]}])
+                    results[name]["llm_calls"].append(bot.last_turn_metrics["llm_calls"])
+                except Exception as e:
+                    # 模型没有给出可解析的 action 时 agent 会失败；耗时照样计入
+                    print(f"{name} failed on {row['query']!r}: {e}")
+                    errors[name] += 1
+                results[name]["total_s"].append(time.perf_counter() - start)
+    finally:
+        server.shutdown()
+    summary = {name: {key: round(sum(values) / len(values), 3) if values else None for key, values in r.items()}
+               for name, r in results.items()}
+    for name in bots:
+        summary[name]["errors"] = errors[name]
+    summary["queries"] = len(results["router"]["total_s"])
+    if summary["queries"]:
+        summary["saved_s_per_query"] = round(summary["agent"]["total_s"] - summary["router"]["total_s"], 3)
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from chatmodules.embeddings import load_embedder
+
+    parser = argparse.ArgumentParser(description="Evaluate the intent router on a labeled query file")
+    parser.add_argument("--queries", default=INTENT_QUERIES_FILE, help="JSONL file with query / intent fields")
+    parser.add_argument("--embedder", default=None,
+                        help='enable the embedding stage: "hash", a GGUF embedding model or a sentence-transformers name')
+    parser.add_argument("--model", default=None,
+                        help="also measure the latency saved against the full agent with this model id")
+    args = parser.parse_args()
+
+    router = IntentRouter(embedder=load_embedder(args.embedder))
+    rows = load_labeled_queries(args.queries)
+    print(json.dumps(evaluate(router, rows), indent=2, ensure_ascii=False))
+    if args.model:
+        print(json.dumps(measure_latency_saved(args.model, rows, router), indent=2, ensure_ascii=False))
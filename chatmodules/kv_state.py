@@ -0,0 +1,47 @@
+"""Compact snapshots of a llama.cpp context: the evaluated tokens and the KV state, without the logits buffer."""
+import ctypes
+
+import numpy as np
+
+
+class KVState(object):
+    """
+    What is needed to continue from an evaluated prompt: its tokens and the llama.cpp state bytes.
+
+    `Llama.save_state` also copies the logits buffer (up to n_batch x n_vocab floats, hundreds of MB for large
+    vocabularies) and the whole n_ctx-sized token array; neither is needed because the next generation always
+    evaluates at least one new token before sampling.
+    """
+
+    def __init__(self, input_ids, data, seed=None):
+        self.input_ids = input_ids
+        self.data = data
+        self.seed = seed
+
+    @property
+    def n_tokens(self):
+        return len(self.input_ids)
+
+    @property
+    def nbytes(self):
+        return len(self.data) + self.input_ids.nbytes
+
+
+def save_kv_state(client):
+    import llama_cpp
+
+    size = llama_cpp.llama_get_state_size(client.ctx)
+    buffer = (ctypes.c_uint8 * int(size))()
+    n_bytes = llama_cpp.llama_copy_state_data(client.ctx, buffer)
+    return KVState(np.array(client.input_ids[:client.n_tokens], dtype=np.intc), bytes(buffer)[:int(n_bytes)],
+                   getattr(client, "_seed", None))
+
+
+def load_kv_state(client, state):
+    import llama_cpp
+
+    buffer = (ctypes.c_uint8 * len(state.data)).from_buffer_copy(state.data)
+    if llama_cpp.llama_set_state_data(client.ctx, buffer) != len(state.data):
+        raise RuntimeError("Failed to set llama state data")
+    client.input_ids[:state.n_tokens] = state.input_ids
+    client.n_tokens = state.n_tokens
@@ -0,0 +1,385 @@
+"""Persistent long-term memory: past turns embedded into a memory-mapped matrix and recalled by similarity search."""
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from langchain_core.messages import SystemMessage
+
+from chatmodules.embeddings import HASHING_EMBEDDER, load_embedder, normalize_rows
+
+LONG_TERM_DIR = "cache/long_term/"
+# 嵌入模型：HASHING_EMBEDDER（无需模型文件，按字面相似）、.gguf 嵌入模型路径或 sentence-transformers 模型名
+LONG_TERM_EMBEDDER = HASHING_EMBEDDER
+TOP_K = 3
+# 低于该余弦相似度的条目不注入（HashingEmbedder 的取值；语义嵌入模型通常需要更高的阈值）
+MIN_SCORE = 0.35
+# 注入 prompt 的召回内容的 token 上限，从历史预算中预留
+RECALL_TOKEN_BUDGET = 256
+SNIPPET_MAX_CHARS = 400
+# 条目向量 = 提问向量 * QUESTION_WEIGHT + 回答向量（再归一化）：新的提问通常与以前的提问最像，长回答不应把它冲淡
+QUESTION_WEIGHT = 2.0
+RECALL_HEADER = "Notes from earlier conversations with the user (use them only if they are relevant):"
+INITIAL_CAPACITY = 1024
+# embed_entries 的计算方式改变时加一，已有的向量会重新计算
+VECTORS_VERSION = 1
+# 条目数达到 ANN_MIN_ROWS 后建立 IVF 索引，之前直接做一次矩阵-向量乘法（几万条以内也只要几毫秒）
+ANN_MIN_ROWS = 10000
+N_PROBE = 16
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLES_PER_LIST = 32
+
+
+def entry_text(entry):
+    return f"User: {entry['question']}\nAssistant: {entry['answer']}"
+
+
+def embed_entries(embedder, entries):
+    questions = embedder.embed([entry["question"] for entry in entries])
+    answers = embedder.embed([entry["answer"][:SNIPPET_MAX_CHARS] for entry in entries])
+    return normalize_rows(QUESTION_WEIGHT * questions + answers)
+
+
+class IVFIndex(object):
+    """
+    Inverted-file index over unit vectors: k-means splits the rows into about sqrt(n) clusters and a query only
+    scores the rows of its `n_probe` nearest clusters. New rows join their nearest cluster without retraining.
+    """
+
+    def __init__(self, n_probe=N_PROBE, seed=0):
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self.trained_rows = 0
+
+    def train(self, vectors):
+        n = len(vectors)
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(self.seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, KMEANS_SAMPLES_PER_LIST * n_lists),
+                                                       replace=False))])
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        # 向量已归一化：用点积做球面 k-means
+        for _ in range(KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        self.centroids = centroids
+
+        assign = np.concatenate([np.argmax(np.asarray(vectors[start:start + 8192]) @ centroids.T, axis=1)
+                                 for start in range(0, n, 8192)])
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(n_lists)]
+        self.trained_rows = n
+
+    def add(self, rows, vectors):
+        for row, c in zip(rows, np.argmax(vectors @ self.centroids.T, axis=1)):
+            self.lists[c] = np.append(self.lists[c], row)
+
+    def search(self, vectors, query, k):
+        """(row ids, scores) of the best `k` rows among the probed clusters, best first."""
+        n_probe = min(self.n_probe, len(self.lists))
+        probe = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        rows = np.sort(np.concatenate([self.lists[c] for c in probe]))
+        # 按行号顺序读取，内存映射文件上的访问尽量连续
+        scores = vectors[rows] @ query
+        best = np.argsort(-scores)[:k]
+        return rows[best], scores[best]
+
+
+class LongTermMemory(object):
+    """
+    Every finished turn, embedded and kept on disk across sessions and restarts.
+
+    `store_dir` holds `entries.jsonl` (one turn per line), `vectors.f32` (a memory-mapped float32 matrix, one
+    L2-normalized row per entry, grown by doubling) and `meta.json` (which embedder wrote the vectors). Only pages
+    touched by a search are read into RAM. Up to `ann_min_rows` entries a search is one exact matrix-vector product;
+    past that an IVFIndex is built (and rebuilt whenever the store has doubled), so recall stays in the low
+    milliseconds with hundreds of thousands of turns. If the embedder changes, the stored turns are re-embedded.
+    """
+
+    def __init__(self, store_dir=LONG_TERM_DIR, embedder=LONG_TERM_EMBEDDER, ann_min_rows=ANN_MIN_ROWS,
+                 n_probe=N_PROBE):
+        self.store_dir = store_dir
+        self.embedder = load_embedder(embedder) if isinstance(embedder, str) else embedder
+        self.ann_min_rows = ann_min_rows
+        self.n_probe = n_probe
+        self.entries = []
+        self._vectors = None
+        self._index = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def _entries_path(self):
+        return os.path.join(self.store_dir, "entries.jsonl")
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.store_dir, "vectors.f32")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.store_dir, "meta.json")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        # 每个有效条目在 vectors.f32 中的行号，就是它在 entries.jsonl 中的行号
+        rows = []
+        lines = 0
+        if os.path.exists(self._entries_path):
+            with open(self._entries_path, "rb") as f:
+                for lines, line in enumerate(f, 1):
+                    try:
+                        # 最后一行可能因中途退出而不完整
+                        if not line.endswith(b"\n"):
+                            raise ValueError("unterminated line")
+                        entry = json.loads(line)
+                        if not isinstance(entry, dict) or "question" not in entry or "answer" not in entry:
+                            raise ValueError("not an entry")
+                        self.entries.append(entry)
+                    except ValueError:
+                        print(f"Long-term memory: skipping damaged entry on line {lines} of entries.jsonl")
+                        continue
+                    rows.append(lines - 1)
+        damaged = len(rows) < lines
+
+        dim = self.embedder.dim
+        row_bytes = dim * 4
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        current = (meta.get("version"), meta.get("embedder"), meta.get("dim")) == (VECTORS_VERSION, self.embedder.name,
+                                                                                   dim)
+        if current and size >= row_bytes * lines:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                      shape=(size // row_bytes, dim)) if size else None
+            if self._vectors is None:
+                self._ensure_capacity(INITIAL_CAPACITY)
+            elif damaged:
+                # 修复期间没有 meta.json：若中途退出，下次加载会重新计算向量，而不是使用错位的行
+                os.remove(self._meta_path)
+                self._vectors[:len(rows)] = self._vectors[rows]
+                self._vectors.flush()
+                self._rewrite_entries()
+                self._write_meta()
+        else:
+            if damaged:
+                self._rewrite_entries()
+            self._reembed()
+        self._maybe_train()
+
+    def _rewrite_entries(self):
+        # 去掉损坏的行：之后追加的条目不会接在残行后面，行号也重新与向量的行对应
+        tmp_path = self._entries_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in self.entries)
+        os.replace(tmp_path, self._entries_path)
+
+    def _reembed(self):
+        """(Re)write vectors.f32 and meta.json for the current embedder."""
+        if os.path.exists(self._vectors_path):
+            os.remove(self._vectors_path)
+        self._vectors = None
+        self._ensure_capacity(max(INITIAL_CAPACITY, len(self)))
+        if self.entries:
+            print(f"Embedding {len(self)} long-term memory entries with {self.embedder.name}...")
+        for start in range(0, len(self), 256):
+            batch = self.entries[start:start + 256]
+            self._vectors[start:start + len(batch)] = embed_entries(self.embedder, batch)
+        self._vectors.flush()
+        self._write_meta()
+        self._index = None
+
+    def _write_meta(self):
+        with open(self._meta_path, "w", encoding="utf-8") as f:
+            json.dump({"version": VECTORS_VERSION, "embedder": self.embedder.name, "dim": self.embedder.dim}, f)
+
+    def _ensure_capacity(self, rows):
+        capacity = len(self._vectors) if self._vectors is not None else 0
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, 2 * capacity)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        # 扩展文件而不是复制：已有的行原地保留
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.embedder.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(new_capacity, self.embedder.dim))
+
+    def _maybe_train(self):
+        n = len(self)
+        if n >= self.ann_min_rows and (self._index is None or n >= 2 * self._index.trained_rows):
+            start = time.perf_counter()
+            index = IVFIndex(n_probe=self.n_probe)
+            index.train(self._vectors[:n])
+            self._index = index
+            print(f"Long-term memory: built IVF index over {n} entries ({len(index.lists)} lists) "
+                  f"in {time.perf_counter() - start:.2f}s")
+
+    def add(self, question, answer, **fields):
+        """Store one turn; extra `fields` (model id, session id, ...) are saved with it. Returns the entry's row."""
+        entry = {"question": question, "answer": answer, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), **fields}
+        return self.add_many([entry])[0]
+
+    def add_many(self, entries, batch_size=256):
+        """Store entries (dicts with at least "question" and "answer"), embedding them in batches; returns rows."""
+        rows = []
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            vectors = embed_entries(self.embedder, batch)
+            with self._lock:
+                first = len(self)
+                self._ensure_capacity(first + len(batch))
+                # 先写向量再追加条目：中途退出时只会留下未使用的向量行
+                self._vectors[first:first + len(batch)] = vectors
+                self._vectors.flush()
+                with open(self._entries_path, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+                self.entries.extend(batch)
+                batch_rows = list(range(first, first + len(batch)))
+                if self._index is not None:
+                    self._index.add(batch_rows, vectors)
+                self._maybe_train()
+            rows.extend(batch_rows)
+        return rows
+
+    def search(self, query, k=TOP_K, min_score=MIN_SCORE, exclude_questions=()):
+        """Up to `k` (score, entry) pairs most similar to `query`, best first, skipping `exclude_questions`."""
+        query_vector = self.embedder.embed([query])[0]
+        with self._lock:
+            n = len(self)
+            if n == 0:
+                return []
+            candidates = k + len(exclude_questions)
+            if self._index is not None:
+                rows, scores = self._index.search(self._vectors, query_vector, candidates)
+            else:
+                scores = self._vectors[:n] @ query_vector
+                rows = np.argpartition(-scores, min(candidates, n) - 1)[:candidates]
+                rows = rows[np.argsort(-scores[rows])]
+                scores = scores[rows]
+            hits = []
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                if score < min_score or len(hits) == k:
+                    break
+                entry = self.entries[row]
+                if entry["question"] not in exclude_questions:
+                    hits.append((score, entry))
+        return hits
+
+    def clear(self):
+        with self._lock:
+            self._vectors = None
+            self._index = None
+            self.entries = []
+            for path in (self._entries_path, self._vectors_path, self._meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._reembed()
+
+    def stats(self):
+        return {"entries": len(self), "embedder": self.embedder.name, "dim": self.embedder.dim,
+                "ivf_lists": len(self._index.lists) if self._index is not None else None}
+
+
+def recall_messages(hits, count_tokens, token_budget=RECALL_TOKEN_BUDGET):
+    """
+    The recalled turns that fit in `token_budget` tokens as one system message, for a MessagesPlaceholder: returns
+    (messages, number of turns included); messages is empty if none fit.
+    """
+    lines = []
+    used = count_tokens(RECALL_HEADER)
+    for _, entry in hits:
+        snippet = entry_text(entry)
+        if len(snippet) > SNIPPET_MAX_CHARS:
+            snippet = snippet[:SNIPPET_MAX_CHARS] + "..."
+        line = "- " + snippet.replace("\n", " / ")
+        tokens = count_tokens(line)
+        if used + tokens > token_budget:
+            break
+        lines.append(line)
+        used += tokens
+    if not lines:
+        return [], 0
+    return [SystemMessage(content=RECALL_HEADER + "\n" + "\n".join(lines))], len(lines)
+
+
+def benchmark(n, queries=200, embedder=LONG_TERM_EMBEDDER, k=TOP_K):
+    """Add `n` synthetic turns to a scratch store, then time exact and IVF search and measure IVF recall@k."""
+    import random
+    import tempfile
+
+    from chatmodules.synthetic_llm import WORDS
+
+    rng = random.Random(0)
+    # 对话按话题聚集：每条文本取自一个话题的词表，再夹杂一些通用词
+    topics = [[f"t{t}w{i}" for i in range(40)] for t in range(max(1, n // 500))]
+    texts = []
+    for _ in range(n):
+        topic = rng.choice(topics)
+        texts.append(" ".join(rng.choice(topic) if rng.random() < 0.7 else rng.choice(WORDS)
+                              for _ in range(rng.randint(6, 20))))
+    store_dir = tempfile.mkdtemp(prefix="long_term_bench_")
+    try:
+        memory = LongTermMemory(store_dir, embedder=embedder, ann_min_rows=n + 1)
+        start = time.perf_counter()
+        memory.add_many([{"question": text, "answer": f"answer {i}"} for i, text in enumerate(texts)])
+        add_s = time.perf_counter() - start
+
+        query_texts = [texts[rng.randrange(n)].rsplit(" ", 2)[0] for _ in range(queries)]
+        timings = {}
+        results = {}
+        for name in ("exact", "ivf"):
+            if name == "ivf":
+                memory.ann_min_rows = 1
+                memory._maybe_train()
+            elapsed = []
+            results[name] = []
+            for query in query_texts:
+                start = time.perf_counter()
+                hits = memory.search(query, k=k, min_score=-1.0)
+                elapsed.append(time.perf_counter() - start)
+                results[name].append({entry["question"] for _, entry in hits})
+            elapsed.sort()
+            timings[name] = {"p50_ms": round(elapsed[len(elapsed) // 2] * 1000, 3),
+                             "p95_ms": round(elapsed[int(len(elapsed) * 0.95)] * 1000, 3)}
+        recall = sum(len(a & b) for a, b in zip(results["exact"], results["ivf"])) / (k * queries)
+        return {"entries": n, "add_many_ms_per_entry": round(add_s / n * 1000, 3), "search": timings,
+                f"ivf_recall_at_{k}": round(recall, 3), **memory.stats()}
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Search the long-term memory store, or benchmark it.")
+    parser.add_argument("query", nargs="?", help="text to recall past turns for")
+    parser.add_argument("--store", default=LONG_TERM_DIR)
+    parser.add_argument("--embedder", default=LONG_TERM_EMBEDDER)
+    parser.add_argument("-k", type=int, default=TOP_K)
+    parser.add_argument("--bench", type=int, default=None, metavar="N", help="benchmark with N synthetic entries")
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(benchmark(args.bench, embedder=args.embedder, k=args.k), indent=2))
+    else:
+        memory = LongTermMemory(args.store, embedder=args.embedder)
+        print(memory.stats())
+        if args.query:
+            for score, entry in memory.search(args.query, k=args.k):
+                print(f"{score:.3f}  [{entry['time']}] {entry_text(entry)}")
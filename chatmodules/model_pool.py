@@ -0,0 +1,138 @@
+"""Keeps several loaded LlamaCpp models resident under a memory budget, with LRU eviction and background preload."""
+import gc
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from chatmodules.model_registry import (draft_model_info, estimate_memory_bytes, load_llamacpp, plan_load_settings,
+                                        read_model_info, speculative_ctx)
+
+
+def estimate_model_bytes(model_path, speculative=None):
+    # 权重 + 按规划的 n_ctx 计算的 KV cache（来自 GGUF 元数据）；推测解码时再加上草稿模型（与目标模型同样的 n_ctx）
+    info = read_model_info(model_path)
+    n_ctx = plan_load_settings(info).n_ctx
+    if not speculative:
+        return estimate_memory_bytes(info, n_ctx)
+    n_ctx = speculative_ctx(info, n_ctx)
+    draft_info = draft_model_info(info, speculative)
+    draft_bytes = estimate_memory_bytes(draft_info, n_ctx) if draft_info is not None else 0
+    return estimate_memory_bytes(info, n_ctx) + draft_bytes
+
+
+def total_memory_bytes():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class ModelPool(object):
+    """
+    Loaded models keyed by model path.
+
+    At most `max_models` models and `memory_budget` bytes (default: 70% of physical RAM) stay resident; the least
+    recently used model is evicted first, but the most recently used one is never evicted to make room for a load,
+    so it stays usable while the next model loads on the background thread.
+
+    `size_estimator` must match `loader`: a loader with speculative decoding needs
+    `partial(estimate_model_bytes, speculative=...)` so each model's draft model is counted in the budget.
+    """
+
+    def __init__(self, max_models=2, memory_budget=None, loader=load_llamacpp, size_estimator=estimate_model_bytes):
+        if memory_budget is None:
+            total = total_memory_bytes()
+            memory_budget = int(total * 0.7) if total else None
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self.loader = loader
+        self.size_estimator = size_estimator
+
+        self._models = OrderedDict()  # model_path -> (llm, estimated bytes)，按最近使用排序
+        self._loading = {}  # model_path -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-preload")
+
+    def get(self, model_path):
+        """Return the loaded model, waiting for (or starting) its load if needed."""
+        return self.preload(model_path).result()
+
+    def preload(self, model_path):
+        """Start loading `model_path` in the background and return a Future for the model."""
+        with self._lock:
+            if model_path in self._models:
+                self._models.move_to_end(model_path)
+                future = Future()
+                future.set_result(self._models[model_path][0])
+                return future
+            future = self._loading.get(model_path)
+            if future is None:
+                future = self._executor.submit(self._load, model_path)
+                self._loading[model_path] = future
+            return future
+
+    def is_loaded(self, model_path):
+        with self._lock:
+            return model_path in self._models
+
+    def loaded_models(self):
+        with self._lock:
+            return list(self._models.keys())
+
+    def evict(self, model_path):
+        with self._lock:
+            entry = self._models.pop(model_path, None)
+        del entry
+        gc.collect()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            self._models.clear()
+        gc.collect()
+
+    def _load(self, model_path):
+        try:
+            # 估算也可能失败（如指定的草稿模型不存在）：同样要移除 _loading 中的记录，之后可以重试
+            size = self.size_estimator(model_path)
+            self._make_room(size)
+            llm = self.loader(model_path)
+        except BaseException:
+            with self._lock:
+                self._loading.pop(model_path, None)
+            raise
+
+        with self._lock:
+            self._models[model_path] = (llm, size)
+            self._loading.pop(model_path, None)
+            evicted = self._pop_over_limit()
+        del evicted
+        gc.collect()
+        return llm
+
+    def _make_room(self, incoming_size):
+        # 加载前先按 LRU 释放内存，但保留最近使用的模型，保证其在加载期间仍可用
+        with self._lock:
+            evicted = []
+            while len(self._models) > 1 and (len(self._models) >= self.max_models
+                                             or self._over_budget(incoming_size)):
+                evicted.append(self._models.popitem(last=False))
+        if evicted:
+            print("Evicted models:", ", ".join(path for path, _ in evicted))
+        del evicted
+        gc.collect()
+
+    def _pop_over_limit(self):
+        # 新加载的模型在末尾，永远不会被淘汰
+        evicted = []
+        while len(self._models) > 1 and (len(self._models) > self.max_models or self._over_budget(0)):
+            evicted.append(self._models.popitem(last=False))
+        return evicted
+
+    def _over_budget(self, extra):
+        if self.memory_budget is None:
+            return False
+        used = sum(size for _, size in self._models.values())
+        return used + extra > self.memory_budget
+
@@ -0,0 +1,379 @@
+"""Model registry: stable model IDs, GGUF header metadata and resource-aware load settings."""
+import json
+import os
+import struct
+import time
+from dataclasses import dataclass, asdict
+from typing import Optional
+
+GGUF_MAGIC = b"GGUF"
+MIN_CTX = 2048
+DEFAULT_MAX_CTX = 16384
+DEFAULT_N_BATCH = 512
+AUTOTUNE_FILE = "cache/autotune.json"
+
+# GGUF metadata value types
+_SCALAR_FORMATS = {0: "<B", 1: "<b", 2: "<H", 3: "<h", 4: "<I", 5: "<i", 6: "<f", 7: "<?", 10: "<Q", 11: "<q", 12: "<d"}
+_STRING, _ARRAY = 8, 9
+# 长数组（如词表）只记录长度，不读入内容
+_MAX_ARRAY_ITEMS = 64
+
+# general.file_type -> 量化类型名称
+FILE_TYPES = {
+    0: "F32", 1: "F16", 2: "Q4_0", 3: "Q4_1", 7: "Q8_0", 8: "Q5_0", 9: "Q5_1", 10: "Q2_K", 11: "Q3_K_S",
+    12: "Q3_K_M", 13: "Q3_K_L", 14: "Q4_K_S", 15: "Q4_K_M", 16: "Q5_K_S", 17: "Q5_K_M", 18: "Q6_K",
+    19: "IQ2_XXS", 20: "IQ2_XS", 21: "Q2_K_S", 22: "IQ3_XS", 23: "IQ3_XXS", 24: "IQ1_S", 25: "IQ4_NL",
+    26: "IQ3_S", 27: "IQ3_M", 28: "IQ2_S", 29: "IQ2_M", 30: "IQ4_XS", 31: "IQ1_M", 32: "BF16",
+}
+
+
+class GGUFArray(object):
+    """Placeholder for a metadata array too long to be worth reading (tokenizer vocab, merges, ...)."""
+
+    def __init__(self, item_type, length):
+        self.item_type = item_type
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return f"GGUFArray(type={self.item_type}, length={self.length})"
+
+
+def read_gguf_metadata(model_path):
+    """Read the key/value metadata from a GGUF header without touching the tensor data."""
+    with open(model_path, "rb") as f:
+        if f.read(4) != GGUF_MAGIC:
+            raise ValueError(f"{model_path} is not a GGUF file")
+        version, = struct.unpack("<I", f.read(4))
+        if version < 2:
+            raise ValueError(f"GGUF version {version} is not supported")
+        tensor_count, kv_count = struct.unpack("<QQ", f.read(16))
+
+        metadata = {"GGUF.version": version, "GGUF.tensor_count": tensor_count}
+        for _ in range(kv_count):
+            key = _read_string(f)
+            value_type, = struct.unpack("<I", f.read(4))
+            metadata[key] = _read_value(f, value_type)
+    return metadata
+
+
+def _read_string(f):
+    length, = struct.unpack("<Q", f.read(8))
+    return f.read(length).decode("utf-8", errors="replace")
+
+
+def _read_value(f, value_type):
+    if value_type in _SCALAR_FORMATS:
+        fmt = _SCALAR_FORMATS[value_type]
+        return struct.unpack(fmt, f.read(struct.calcsize(fmt)))[0]
+    if value_type == _STRING:
+        return _read_string(f)
+    if value_type == _ARRAY:
+        item_type, length = struct.unpack("<IQ", f.read(12))
+        if length <= _MAX_ARRAY_ITEMS:
+            return [_read_value(f, item_type) for _ in range(length)]
+        if item_type in _SCALAR_FORMATS:
+            f.seek(length * struct.calcsize(_SCALAR_FORMATS[item_type]), os.SEEK_CUR)
+        else:
+            for _ in range(length):
+                _skip_value(f, item_type)
+        return GGUFArray(item_type, length)
+    raise ValueError(f"Unknown GGUF value type {value_type}")
+
+
+def _skip_value(f, value_type):
+    if value_type in _SCALAR_FORMATS:
+        f.seek(struct.calcsize(_SCALAR_FORMATS[value_type]), os.SEEK_CUR)
+    elif value_type == _STRING:
+        length, = struct.unpack("<Q", f.read(8))
+        f.seek(length, os.SEEK_CUR)
+    elif value_type == _ARRAY:
+        item_type, length = struct.unpack("<IQ", f.read(12))
+        for _ in range(length):
+            _skip_value(f, item_type)
+    else:
+        raise ValueError(f"Unknown GGUF value type {value_type}")
+
+
+@dataclass
+class ModelInfo:
+    model_id: str
+    path: str
+    file_size: int
+    architecture: Optional[str] = None
+    name: Optional[str] = None
+    quantization: Optional[str] = None
+    context_length: Optional[int] = None
+    block_count: Optional[int] = None
+    embedding_length: Optional[int] = None
+    head_count: Optional[int] = None
+    head_count_kv: Optional[int] = None
+    vocab_size: Optional[int] = None
+    tokenizer_model: Optional[str] = None
+
+    def kv_bytes_per_token(self, kv_type_bytes=2):
+        """Size of the K and V cache entries for one token (f16 cache by default)."""
+        if not (self.block_count and self.embedding_length and self.head_count):
+            # 缺少元数据时按 8B 级别模型（32 层、8 个 KV 头、头维度 128）估算
+            return 2 * 32 * 8 * 128 * kv_type_bytes
+        head_dim = self.embedding_length // self.head_count
+        return 2 * self.block_count * (self.head_count_kv or self.head_count) * head_dim * kv_type_bytes
+
+
+@dataclass
+class LoadSettings:
+    n_ctx: int
+    n_threads: int
+    n_batch: int
+
+
+_info_cache = {}
+
+
+def read_model_info(model_path):
+    stat = os.stat(model_path)
+    memo_key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime)
+    if memo_key in _info_cache:
+        return _info_cache[memo_key]
+
+    model_id = os.path.splitext(os.path.basename(model_path))[0]
+    info = ModelInfo(model_id=model_id, path=model_path, file_size=stat.st_size)
+    try:
+        metadata = read_gguf_metadata(model_path)
+    except (ValueError, struct.error, OSError) as e:
+        print("Failed to read GGUF metadata:", model_path, e)
+        metadata = {}
+
+    arch = metadata.get("general.architecture")
+    info.architecture = arch
+    info.name = metadata.get("general.name")
+    info.quantization = FILE_TYPES.get(metadata.get("general.file_type"))
+    if arch:
+        info.context_length = metadata.get(f"{arch}.context_length")
+        info.block_count = metadata.get(f"{arch}.block_count")
+        info.embedding_length = metadata.get(f"{arch}.embedding_length")
+        info.head_count = metadata.get(f"{arch}.attention.head_count")
+        info.head_count_kv = metadata.get(f"{arch}.attention.head_count_kv")
+    tokens = metadata.get("tokenizer.ggml.tokens")
+    info.vocab_size = len(tokens) if tokens is not None else None
+    info.tokenizer_model = metadata.get("tokenizer.ggml.model")
+
+    _info_cache[memo_key] = info
+    return info
+
+
+def available_memory_bytes():
+    """MemAvailable on Linux, otherwise 70% of physical RAM; None if neither can be determined."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.7)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def physical_core_count():
+    """Physical cores usable by this process (hyper-threads do not speed up llama.cpp decoding)."""
+    try:
+        usable = len(os.sched_getaffinity(0))
+    except AttributeError:
+        usable = os.cpu_count() or 1
+
+    physical = None
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False)
+    except ImportError:
+        try:
+            cores = set()
+            with open("/proc/cpuinfo") as f:
+                package = None
+                for line in f:
+                    if line.startswith("physical id"):
+                        package = line.split(":")[1].strip()
+                    elif line.startswith("core id"):
+                        cores.add((package, line.split(":")[1].strip()))
+            physical = len(cores) or None
+        except OSError:
+            pass
+    if not physical:
+        physical = max(1, (os.cpu_count() or 2) // 2)
+    return max(1, min(physical, usable))
+
+
+def estimate_memory_bytes(info, n_ctx):
+    # 权重（mmap）+ KV cache + 计算缓冲区等固定开销
+    return info.file_size + info.kv_bytes_per_token() * n_ctx + 256 * 1024 * 1024
+
+
+def plan_load_settings(info, memory_budget=None, max_ctx=DEFAULT_MAX_CTX, n_threads=None):
+    """Pick the largest n_ctx (up to `max_ctx` and the trained context) whose KV cache fits next to the weights."""
+    if memory_budget is None:
+        memory_budget = available_memory_bytes()
+
+    n_ctx = min(max_ctx, info.context_length or max_ctx)
+    if memory_budget:
+        free_for_kv = memory_budget - estimate_memory_bytes(info, 0)
+        n_ctx = min(n_ctx, max(0, free_for_kv) // info.kv_bytes_per_token())
+    n_ctx = max(MIN_CTX, n_ctx // 256 * 256)
+
+    if n_threads is None:
+        n_threads = tuned_threads(info) or physical_core_count()
+    return LoadSettings(n_ctx=n_ctx, n_threads=n_threads, n_batch=min(DEFAULT_N_BATCH, n_ctx))
+
+
+def load_llamacpp(model_path, speculative=None, **kwargs):
+    """
+    Load a GGUF model with settings sized for this host.
+
+    speculative: None, "prompt-lookup", "auto" (smallest compatible model next to the target, falling back to
+    prompt lookup) or the id/path of a draft model.
+    """
+    info = read_model_info(model_path)
+    settings = plan_load_settings(info)
+    params = dict(temperature=0.7, max_tokens=5120, n_ctx=settings.n_ctx, n_threads=settings.n_threads,
+                  n_batch=settings.n_batch, verbose=False)
+    params.update(kwargs)
+    draft_note = ""
+    if speculative:
+        params["n_ctx"] = speculative_ctx(info, params["n_ctx"])
+        draft = make_draft_model(info, speculative, params["n_ctx"], params["n_threads"])
+        params["model_kwargs"] = {**params.get("model_kwargs", {}), "draft_model": draft}
+        draft_note = f", draft={getattr(draft, 'model_path', speculative)}"
+    print(f"Loading model: {model_path} (n_ctx={params['n_ctx']}, n_threads={params['n_threads']}, "
+          f"n_batch={params['n_batch']}{draft_note})")
+    # 延迟导入：只读取模型信息（如 GUI 启动时列出模型）时不需要加载 langchain / llama.cpp
+    from chatmodules.controlled_llamacpp import ControlledLlamaCpp
+    return ControlledLlamaCpp(model_path=model_path, **params)
+
+
+def speculative_ctx(info, n_ctx):
+    # 推测解码需要完整 logits，n_ctx 受 SCORES_MEMORY_BUDGET 限制
+    from chatmodules.speculative import max_speculative_ctx
+    return min(n_ctx, max(MIN_CTX, max_speculative_ctx(info) // 256 * 256))
+
+
+def draft_model_info(target_info, speculative):
+    """ModelInfo of the draft model `speculative` selects for the target, or None for prompt lookup."""
+    from chatmodules.speculative import AUTO_DRAFT, PROMPT_LOOKUP, compatible_draft, pick_draft_model
+
+    if speculative == PROMPT_LOOKUP:
+        return None
+    models_dir = os.path.dirname(target_info.path)
+    if speculative == AUTO_DRAFT:
+        return pick_draft_model(target_info, ModelRegistry(models_dir).models())
+    draft_path = speculative if os.path.exists(speculative) else os.path.join(models_dir, speculative + ".gguf")
+    draft_info = read_model_info(draft_path)
+    if not compatible_draft(target_info, draft_info):
+        raise ValueError(f"{draft_info.model_id} cannot draft for {target_info.model_id}: "
+                         f"it must be smaller and use the same tokenizer")
+    return draft_info
+
+
+def make_draft_model(target_info, speculative, n_ctx, n_threads):
+    from chatmodules.speculative import AUTO_DRAFT, PromptLookupDraft, SmallModelDraft
+
+    draft_info = draft_model_info(target_info, speculative)
+    if draft_info is None:
+        if speculative == AUTO_DRAFT:
+            print(f"No compatible draft model for {target_info.model_id}, using prompt lookup")
+        return PromptLookupDraft()
+    return SmallModelDraft(draft_info.path, n_ctx=n_ctx, n_threads=n_threads)
+
+
+def _autotune_key(info):
+    return f"{info.model_id}:{info.file_size}:{os.cpu_count()}"
+
+
+def tuned_threads(info, autotune_file=AUTOTUNE_FILE):
+    try:
+        with open(autotune_file) as f:
+            return json.load(f).get(_autotune_key(info), {}).get("n_threads")
+    except (OSError, ValueError):
+        return None
+
+
+def autotune_threads(info, candidates=None, n_tokens=32, autotune_file=AUTOTUNE_FILE):
+    """
+    Measure decode tokens/s for a few thread counts and remember the fastest one for `plan_load_settings`.
+
+    Each candidate reloads the model with a small context; after the first load the weights come from the page
+    cache, so a run takes roughly `len(candidates)` short generations.
+    """
+    from llama_cpp import Llama
+
+    if candidates is None:
+        cores = physical_core_count()
+        candidates = sorted({max(1, cores // 2), max(1, cores - 1), cores, os.cpu_count() or cores})
+
+    results = {}
+    for n_threads in candidates:
+        llm = Llama(model_path=info.path, n_ctx=512, n_threads=n_threads, verbose=False)
+        start = time.perf_counter()
+        output = llm("The quick brown fox", max_tokens=n_tokens, temperature=0)
+        elapsed = time.perf_counter() - start
+        results[n_threads] = output["usage"]["completion_tokens"] / elapsed
+        print(f"n_threads={n_threads}: {results[n_threads]:.2f} tokens/s")
+        del llm
+
+    best = max(results, key=results.get)
+    try:
+        with open(autotune_file) as f:
+            tuned = json.load(f)
+    except (OSError, ValueError):
+        tuned = {}
+    tuned[_autotune_key(info)] = {"n_threads": best, "tokens_per_second": results}
+    os.makedirs(os.path.dirname(autotune_file) or ".", exist_ok=True)
+    with open(autotune_file, "w") as f:
+        json.dump(tuned, f, indent=2)
+    return best
+
+
+class ModelRegistry(object):
+    """GGUF models in `models_dir`, addressed by stable IDs (the file name without `.gguf`)."""
+
+    def __init__(self, models_dir):
+        self.models_dir = models_dir
+
+    def model_files(self):
+        return sorted(f for f in os.listdir(self.models_dir) if f.lower().endswith(".gguf"))
+
+    def models(self):
+        return [read_model_info(os.path.join(self.models_dir, f)) for f in self.model_files()]
+
+    def model_ids(self):
+        # id 就是文件名：列出模型（GUI 启动时）不读取 GGUF 元数据，元数据在选择或加载模型时才读取
+        return [os.path.splitext(f)[0] for f in self.model_files()]
+
+    def path(self, model_id):
+        path = os.path.join(self.models_dir, model_id + ".gguf")
+        if os.path.exists(path):
+            return path
+        for f in self.model_files():
+            if os.path.splitext(f)[0] == model_id:
+                return os.path.join(self.models_dir, f)
+        raise KeyError(f"Unknown model id: {model_id}")
+
+    def get(self, model_id):
+        return read_model_info(self.path(model_id))
+
+    def create_llm(self, model_id, **kwargs):
+        return load_llamacpp(self.path(model_id), **kwargs)
+
+
+if __name__ == '__main__':
+    import sys
+
+    registry = ModelRegistry(sys.argv[1] if len(sys.argv) > 1 else "models/")
+    for model_info in registry.models():
+        print(json.dumps(asdict(model_info), ensure_ascii=False, indent=2))
+        print("load settings:", asdict(plan_load_settings(model_info)))
+        if "--autotune" in sys.argv:
+            print("best n_threads:", autotune_threads(model_info))
@@ -0,0 +1,121 @@
+"""Evaluate the fixed system-prompt prefix once per model and reuse its llama.cpp state, in memory and on disk."""
+import hashlib
+import os
+import pickle
+import threading
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from chatmodules.kv_state import load_kv_state, save_kv_state
+
+PREFIX_CACHE_DIR = "cache/prefix/"
+
+_fingerprints = {}
+
+
+def model_fingerprint(model_path, sample_bytes=16 * 1024 * 1024):
+    """
+    Cheap content hash of a GGUF file: its size plus the first and last `sample_bytes`.
+
+    Hashing a multi-GB model in full would cost more than the prefix evaluation it is meant to save. The header
+    (metadata, tokenizer) and the tail of the tensor data are enough to tell quantizations and re-exports apart.
+    """
+    stat = os.stat(model_path)
+    memo_key = (os.path.abspath(model_path), stat.st_size, stat.st_mtime)
+    if memo_key not in _fingerprints:
+        digest = hashlib.sha256(str(stat.st_size).encode("utf-8"))
+        with open(model_path, "rb") as f:
+            digest.update(f.read(sample_bytes))
+            if stat.st_size > sample_bytes:
+                f.seek(max(sample_bytes, stat.st_size - sample_bytes))
+                digest.update(f.read(sample_bytes))
+        _fingerprints[memo_key] = digest.hexdigest()
+    return _fingerprints[memo_key]
+
+
+def system_prefix_text(chat_prompt):
+    """Render only the leading system message of `chat_prompt`, exactly as it appears in the full prompt string."""
+    text = ChatPromptTemplate.from_messages([chat_prompt.messages[0]]).format()
+    # 结尾的空白在完整 prompt 中会和后续换行合并成不同的 token，去掉以保证前缀 token 一致
+    return text.rstrip()
+
+
+class PrefixCache(object):
+    """
+    Snapshots of the llama.cpp state right after the system prefix has been evaluated.
+
+    `restore` is called before each turn: if the model's KV cache does not already start with the prefix (first
+    turn, another bot or session used the model in between, memory was reset), the snapshot is loaded instead of
+    re-evaluating the prefix. Snapshots are keyed by model fingerprint, prefix hash and n_ctx and written to
+    `cache_dir`, so a cold start only has to read the file.
+    """
+
+    def __init__(self, cache_dir=PREFIX_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self._states = {}  # key -> KVState
+        self._tokens = {}  # (model_path, prefix_text) -> prefix tokens
+        self._lock = threading.Lock()
+
+    def key(self, model_path, prefix_text, n_ctx):
+        # 快照中的 KV cache 布局依赖 n_ctx，因此也作为键的一部分
+        prefix_hash = hashlib.sha256(prefix_text.encode("utf-8")).hexdigest()
+        return f"{model_fingerprint(model_path)[:16]}_{prefix_hash[:16]}_{n_ctx}"
+
+    def restore(self, llm, prefix_text):
+        client = getattr(llm, "client", None)
+        if client is None:
+            # 不是 llama.cpp 后端（如 SyntheticLLM）：没有可复用的状态
+            return
+        tokens = self._prefix_tokens(llm, prefix_text)
+        if client._input_ids[:len(tokens)].tolist() == tokens:
+            return
+
+        with self._lock:
+            key = self.key(llm.model_path, prefix_text, client.n_ctx())
+            state = self._states.get(key)
+            if state is None:
+                state = self._load(key)
+            if state is None:
+                # 第一次见到该前缀：完整评估一次并保存快照
+                client.reset()
+                client.eval(tokens)
+                state = save_kv_state(client)
+                self._save(key, state)
+            self._states[key] = state
+        load_kv_state(client, state)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._tokens.clear()
+
+    def _prefix_tokens(self, llm, prefix_text):
+        token_key = (llm.model_path, prefix_text)
+        if token_key not in self._tokens:
+            # 与 llama_cpp 的 create_completion 相同的分词方式（含 BOS 与特殊 token）
+            self._tokens[token_key] = llm.client.tokenize(prefix_text.encode("utf-8"), special=True)
+        return self._tokens[token_key]
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".kv")
+
+    def _load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            print("Failed to load prefix state:", path, e)
+            return None
+
+    def _save(self, key, state):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+
+prefix_cache = PrefixCache()
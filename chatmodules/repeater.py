@@ -5,4 +5,4 @@ def repeater_get_response(dialogue_list):
     # Simulate a delay
     time.sleep(2)
 
-    return " - ".join(dialogue_list)
+    return " - ".join(message["content"] for message in dialogue_list)
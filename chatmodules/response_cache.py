@@ -0,0 +1,136 @@
+"""On-disk cache of complete LLM responses for deterministic generations (greedy sampling or a fixed seed)."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+RESPONSE_CACHE_FILE = "cache/responses.sqlite3"
+DEFAULT_MAX_BYTES = 64 * 2 ** 20
+
+
+class ResponseCache(object):
+    """
+    SQLite store of generated text keyed by model fingerprint, the fully rendered prompt and the sampling settings.
+
+    Entries are evicted least-recently-used first once their total size exceeds `max_bytes`, and can be dropped per
+    model with `invalidate_model`. Only deterministic generations may be stored; ControlledLlamaCpp checks that
+    before using the cache.
+    """
+
+    def __init__(self, db_path=RESPONSE_CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        # 第一次使用时才创建数据库文件
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_model ON responses (model)")
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def key(model_hash, prompt, params):
+        payload = json.dumps([model_hash, prompt, params], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the stored (text, stats) for `key`, or None."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            self.hits += 1
+        value = json.loads(row[0])
+        return value["text"], value.get("stats", {})
+
+    def put(self, key, model_hash, text, stats=None):
+        value = json.dumps({"text": text, "stats": stats or {}}, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO responses (key, model, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                         (key, model_hash, value, size, time.time()))
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn):
+        total, = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_bytes:
+            return
+        # 按最近使用时间从旧到新删除，直到总大小回到上限以内
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def invalidate_model(self, model_hash):
+        """Drop every cached response of one model; returns the number of entries removed."""
+        with self._lock:
+            conn = self._connect()
+            removed = conn.execute("DELETE FROM responses WHERE model = ?", (model_hash,)).rowcount
+            conn.commit()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+response_cache = ResponseCache()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from chatmodules.prefix_cache import model_fingerprint
+
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the LLM response cache")
+    parser.add_argument("--invalidate", metavar="MODEL_PATH", help="drop all cached responses of this GGUF file")
+    parser.add_argument("--clear", action="store_true", help="drop every cached response")
+    args = parser.parse_args()
+
+    if args.invalidate:
+        print("Removed", response_cache.invalidate_model(model_fingerprint(args.invalidate)), "entries")
+    elif args.clear:
+        response_cache.clear()
+    print(response_cache.stats())
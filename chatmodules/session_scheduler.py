@@ -0,0 +1,231 @@
+"""Per-session chatbots sharing one loaded model, with a bounded request queue in front of it."""
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from chatmodules.turn_control import TurnControl
+
+
+class QueueFullError(Exception):
+    """Raised when a request is refused because the scheduler queue is at capacity."""
+
+
+class SessionBusyError(Exception):
+    """Raised when a session already has a request queued or running."""
+
+
+class UnknownSessionError(KeyError):
+    """Raised when a session does not exist (never created, closed, or expired without a store to park it in)."""
+
+
+class Session(object):
+    def __init__(self, session_id, chatbot):
+        self.session_id = session_id
+        self.chatbot = chatbot
+        self.dialogue_list = []
+        self.busy = False
+        self.control = None  # 排队中或正在执行的请求的 TurnControl
+        self.last_active = time.monotonic()
+
+
+class _Job(object):
+    def __init__(self, session, message, on_token, future, control):
+        self.session = session
+        self.message = message
+        self.on_token = on_token
+        self.future = future
+        self.control = control
+        self.enqueued_at = time.monotonic()
+
+
+class SessionScheduler(object):
+    """
+    Serves many sessions from a single loaded model.
+
+    Every session gets its own chatbot (and therefore its own memory) built around the shared `llm`. A llama.cpp
+    context can only decode one sequence at a time through LlamaCpp, so requests are queued and run one by one on a
+    dedicated decode thread. Admission control: at most `max_queue` requests wait in the queue, at most
+    `max_sessions` sessions exist, and a session may only have one request in flight; anything beyond that is
+    rejected immediately so callers can back off instead of piling up latency.
+
+    With a `store` (SessionStore), switching the model's context to another session first parks the current one
+    together with its KV state, and the next session's own KV state is restored if it has one, so returning to a
+    conversation does not re-evaluate its history. Idle sessions are parked instead of deleted and come back on
+    their next request, even after a restart.
+    """
+
+    def __init__(self, llm, chatbot_factory, max_queue=16, max_sessions=64, session_ttl=3600, store=None):
+        self.llm = llm
+        self.chatbot_factory = chatbot_factory
+        self.max_queue = max_queue
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.store = store
+
+        self.sessions = {}
+        # 当前 KV cache 属于哪个会话；只在解码线程中读写
+        self._kv_owner = None
+        self._queue = None
+        self._worker = None
+        # llama.cpp 上下文不是线程安全的：所有生成都在同一个线程中执行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="decode")
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        for session in self.sessions.values():
+            if session.control is not None:
+                session.control.cancel()
+        if self.store is not None:
+            # 在解码线程中保存：正在进行的一轮结束之后才会读取模型的 KV 状态
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._park_all)
+        self._executor.shutdown(wait=True)
+
+    def create_session(self):
+        self.expire_idle_sessions()
+        if len(self.sessions) >= self.max_sessions:
+            self.rejected += 1
+            raise QueueFullError("Too many sessions")
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = Session(session_id, self.chatbot_factory(self.llm))
+        return session_id
+
+    def close_session(self, session_id):
+        self.sessions.pop(session_id, None)
+        if self.store is not None:
+            self.store.drop(session_id)
+
+    def has_session(self, session_id):
+        return session_id in self.sessions or (self.store is not None and self.store.has(session_id))
+
+    def expire_idle_sessions(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if not session.busy and now - session.last_active > self.session_ttl:
+                del self.sessions[session_id]
+                if self.store is not None:
+                    # 先保存对话历史（保留之前存下的 KV 快照）；若 KV cache 仍属于该会话，再由解码线程补存 KV 状态
+                    self.store.park(session_id, session.chatbot, session.dialogue_list, include_kv=False)
+                    self._executor.submit(self._park_kv_if_owner, session)
+
+    def _get_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None and self.store is not None and self.store.has(session_id):
+            if len(self.sessions) >= self.max_sessions:
+                self.expire_idle_sessions()
+            if len(self.sessions) >= self.max_sessions:
+                self.rejected += 1
+                raise QueueFullError("Too many sessions")
+            session = Session(session_id, self.chatbot_factory(self.llm))
+            # KV 状态在轮到该会话生成时才加载，避免覆盖正在使用的上下文
+            session.dialogue_list = self.store.resume(session_id, session.chatbot, restore_kv=False)
+            self.sessions[session_id] = session
+        if session is None:
+            raise UnknownSessionError(session_id)
+        return session
+
+    async def submit(self, session_id, message, on_token=None, control=None):
+        """
+        Queue `message` for the session and wait for the reply. `on_token` is called from the decode thread.
+
+        If the caller stops waiting (e.g. the client disconnected), the turn is cancelled so the model is free for the
+        next request instead of decoding an answer nobody will read.
+        """
+        session = self._get_session(session_id)
+        if session.busy:
+            raise SessionBusyError(session_id)
+        control = control or TurnControl()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait(_Job(session, message, on_token, future, control))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError("Request queue is full")
+        session.busy = True
+        session.control = control
+        try:
+            return await future
+        except asyncio.CancelledError:
+            control.cancel()
+            raise
+
+    def cancel(self, session_id):
+        """Stop the session's queued or running turn; the partial answer is kept. Returns False if it is idle."""
+        session = self.sessions.get(session_id)
+        if session is None or not session.busy or session.control is None:
+            return False
+        session.control.cancel()
+        return True
+
+    def status(self):
+        return {
+            "sessions": len(self.sessions),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            **({"store": self.store.stats()} if self.store is not None else {}),
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            session = job.session
+            try:
+                if job.future.cancelled():
+                    continue
+                if job.control.stopped:
+                    # 排队期间已被取消：不再占用模型
+                    job.future.set_result("")
+                    continue
+                session.dialogue_list.append({"role": "user", "content": job.message})
+                response = await loop.run_in_executor(self._executor, self._run_turn, session, job.on_token,
+                                                      job.control)
+                session.dialogue_list.append({"role": "assistant", "content": response})
+                self.completed += 1
+                if not job.future.cancelled():
+                    job.future.set_result(response)
+            except Exception as e:
+                if not job.future.cancelled():
+                    job.future.set_exception(e)
+            finally:
+                session.busy = False
+                session.control = None
+                session.last_active = time.monotonic()
+                self._queue.task_done()
+
+    def _park_kv_if_owner(self, session):
+        # 在解码线程中执行。会话若已重新载入（新的 Session 对象），上下文仍属于它，不再保存旧对象；已关闭的会话也不再保存
+        session_id = session.session_id
+        if self._kv_owner == session_id and session_id not in self.sessions and self.store.has(session_id):
+            self.store.park(session.session_id, session.chatbot, session.dialogue_list)
+            self._kv_owner = None
+
+    def _park_all(self):
+        # 在解码线程中执行
+        for session in list(self.sessions.values()):
+            self.store.park(session.session_id, session.chatbot, session.dialogue_list,
+                            include_kv=self._kv_owner == session.session_id)
+        self.store.flush()
+
+    def _run_turn(self, session, on_token, control):
+        if self.store is not None and self._kv_owner != session.session_id:
+            owner = self.sessions.get(self._kv_owner)
+            if owner is not None:
+                # 只复制内存中的 KV 状态（未变化时直接复用上一份）；换出到磁盘由 SessionStore 的后台线程完成
+                self.store.park(owner.session_id, owner.chatbot, owner.dialogue_list)
+            self.store.restore_kv(session.session_id, session.chatbot)
+        self._kv_owner = session.session_id
+        return self._generate(session, on_token, control)
+
+    @staticmethod
+    def _generate(session, on_token, control):
+        return session.chatbot.get_response(session.dialogue_list, on_token=on_token, control=control)
@@ -0,0 +1,202 @@
+"""Park conversations (history + llama.cpp KV state) in RAM or on disk and resume them without re-prefill."""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from chatmodules.kv_state import load_kv_state, save_kv_state
+from chatmodules.prefix_cache import model_fingerprint
+
+SESSION_DIR = "cache/sessions/"
+SNAPSHOT_VERSION = 1
+
+
+class SessionStore(object):
+    """
+    Snapshots of chat sessions: the chatbot's memory, the dialogue list and (optionally) the model's KV state.
+
+    At most `max_resident` snapshots are kept in RAM, least recently used first out; the others are written to
+    `store_dir` by a background thread (so parking never waits for the disk) and read back on demand, so memory use
+    is bounded however many conversations are open. A snapshot's KV state is only loaded into a context of the same
+    model file and n_ctx; llama.cpp's prefix matching then only evaluates what was added after the snapshot was taken.
+    """
+
+    def __init__(self, store_dir=SESSION_DIR, max_resident=4):
+        self.store_dir = store_dir
+        self.max_resident = max_resident
+        self._resident = OrderedDict()  # session_id -> snapshot
+        self._writing = {}  # session_id -> 已换出、尚未写完的快照
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-writer")
+        self._lock = threading.Lock()
+        self.swapped_out = 0
+        self.swapped_in = 0
+
+    def park(self, session_id, chatbot, dialogue_list, include_kv=True):
+        """
+        Snapshot `chatbot`'s session. Pass include_kv=False when the model's context currently holds another
+        session; the KV state of an earlier snapshot of this session is then kept, since it is still a valid prefix.
+        If the context still holds exactly the tokens of the previous snapshot, its KV state is reused as well.
+        """
+        llm = chatbot.llm
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "session_id": session_id,
+            "model": model_fingerprint(llm.model_path),
+            "n_ctx": llm.client.n_ctx(),
+            "memory": chatbot.memory.to_dict(),
+            "dialogue_list": list(dialogue_list),
+            "kv": None,
+            "saved_at": time.time(),
+        }
+        with self._lock:
+            # 要保存 KV 时只看内存中的旧快照：不为了比较而从磁盘读回几 MB 的状态
+            previous = self._peek(session_id) if include_kv else self._get(session_id)
+        if previous is not None and (previous["model"], previous["n_ctx"]) == (snapshot["model"], snapshot["n_ctx"]):
+            snapshot["kv"] = previous["kv"]
+        if include_kv and not _same_tokens(snapshot["kv"], llm.client):
+            snapshot["kv"] = save_kv_state(llm.client)
+        with self._lock:
+            self._resident[session_id] = snapshot
+            self._resident.move_to_end(session_id)
+            self._swap_out_idle()
+        return snapshot
+
+    def resume(self, session_id, chatbot, restore_kv=True):
+        """Restore memory (and KV state, if taken with the same model) into `chatbot`; returns the dialogue list."""
+        with self._lock:
+            snapshot = self._get(session_id)
+        if snapshot is None:
+            raise KeyError(f"Unknown session: {session_id}")
+
+        llm = chatbot.llm
+        same_model = (snapshot["model"], snapshot["n_ctx"]) == (model_fingerprint(llm.model_path), llm.client.n_ctx())
+        # 其他模型保存的会话：按当前模型的分词器重新计算 token
+        chatbot.memory.load_dict(snapshot["memory"], recount=not same_model)
+        if restore_kv:
+            self.restore_kv(snapshot, chatbot)
+        return list(snapshot["dialogue_list"])
+
+    def restore_kv(self, snapshot_or_id, chatbot):
+        """Load the snapshot's KV state into the chatbot's model if it was taken with the same model; returns bool."""
+        snapshot = snapshot_or_id
+        if not isinstance(snapshot, dict):
+            with self._lock:
+                snapshot = self._get(snapshot_or_id)
+        llm = chatbot.llm
+        if snapshot is None or snapshot["kv"] is None:
+            return False
+        if (snapshot["model"], snapshot["n_ctx"]) != (model_fingerprint(llm.model_path), llm.client.n_ctx()):
+            return False
+        load_kv_state(llm.client, snapshot["kv"])
+        return True
+
+    def has(self, session_id):
+        with self._lock:
+            return (session_id in self._resident or session_id in self._writing
+                    or os.path.exists(self._path(session_id)))
+
+    def drop(self, session_id):
+        with self._lock:
+            self._resident.pop(session_id, None)
+            self._writing.pop(session_id, None)
+            try:
+                os.remove(self._path(session_id))
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        """Write every resident snapshot to disk (after the pending background writes), e.g. before shutting down."""
+        self._writer.submit(self._save_resident).result()
+
+    def _save_resident(self):
+        with self._lock:
+            snapshots = list(self._resident.values())
+        for snapshot in snapshots:
+            self._save(snapshot)
+
+    def resident_ids(self):
+        with self._lock:
+            return list(self._resident)
+
+    def stats(self):
+        with self._lock:
+            resident_bytes = sum(s["kv"].nbytes for s in self._resident.values() if s["kv"] is not None)
+            return {
+                "resident": len(self._resident),
+                "resident_kv_bytes": resident_bytes,
+                "swapped_out": self.swapped_out,
+                "swapped_in": self.swapped_in,
+            }
+
+    def _peek(self, session_id):
+        return self._resident.get(session_id) or self._writing.get(session_id)
+
+    def _get(self, session_id):
+        snapshot = self._resident.get(session_id)
+        if snapshot is not None:
+            self._resident.move_to_end(session_id)
+            return snapshot
+        snapshot = self._writing.pop(session_id, None) or self._load(session_id)
+        if snapshot is not None:
+            self.swapped_in += 1
+            self._resident[session_id] = snapshot
+            self._swap_out_idle()
+        return snapshot
+
+    def _swap_out_idle(self):
+        while len(self._resident) > self.max_resident:
+            session_id, snapshot = self._resident.popitem(last=False)
+            # 写盘（pickle 几 MB 的 KV 状态）交给后台线程，调用方（通常是解码线程）不必等待
+            self._writing[session_id] = snapshot
+            self._writer.submit(self._write_swapped_out, session_id, snapshot)
+            self.swapped_out += 1
+
+    def _write_swapped_out(self, session_id, snapshot):
+        with self._lock:
+            if self._writing.get(session_id) is not snapshot:
+                # 写盘之前已被重新载入或删除
+                return
+        self._save(snapshot)
+        with self._lock:
+            if self._writing.get(session_id) is snapshot:
+                del self._writing[session_id]
+            elif session_id not in self._resident and session_id not in self._writing:
+                # 写盘期间被 drop：删掉刚写出的文件
+                try:
+                    os.remove(self._path(session_id))
+                except FileNotFoundError:
+                    pass
+
+    def _path(self, session_id):
+        return os.path.join(self.store_dir, session_id + ".session")
+
+    def _load(self, session_id):
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except Exception as e:
+            print("Failed to load session:", path, e)
+            return None
+        return snapshot if snapshot.get("version") == SNAPSHOT_VERSION else None
+
+    def _save(self, snapshot):
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self._path(snapshot["session_id"])
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+def _same_tokens(kv, client):
+    """Whether `kv` was taken from exactly the tokens the context holds now (so it need not be copied again)."""
+    return (kv is not None and kv.n_tokens == client.n_tokens
+            and np.array_equal(kv.input_ids, client.input_ids[:client.n_tokens]))
+
@@ -0,0 +1,117 @@
+"""Draft models for llama.cpp speculative decoding, with acceptance-rate bookkeeping."""
+import numpy as np
+from llama_cpp import Llama, llama_get_logits
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+PROMPT_LOOKUP = "prompt-lookup"
+AUTO_DRAFT = "auto"
+DRAFT_TOKENS = 8
+# 开启推测解码时 llama-cpp-python 会为整个上下文保存 logits（n_ctx × n_vocab × 4 字节），据此限制 n_ctx
+SCORES_MEMORY_BUDGET = 2 * 2 ** 30
+
+
+class DraftStatsMixin(object):
+    """
+    Counts drafted tokens and how many of them the target model accepted.
+
+    Llama.generate calls the draft model with the tokens accepted so far, so the previous proposal is checked
+    against the current input: its leading tokens that reappear there were accepted. The last proposal of a
+    generation is never checked and is not counted.
+    """
+
+    def reset_stats(self):
+        self.proposed = 0
+        self.accepted = 0
+        self._pending = None
+
+    def _check_pending(self, input_ids):
+        if self._pending is None:
+            return
+        start, draft = self._pending
+        self._pending = None
+        actual = input_ids[start:start + len(draft)]
+        accepted = 0
+        for a, b in zip(actual, draft):
+            if a != b:
+                break
+            accepted += 1
+        self.proposed += len(draft)
+        self.accepted += accepted
+
+    def _record(self, input_ids, draft):
+        if len(draft):
+            self._pending = (len(input_ids), np.array(draft, dtype=np.intc))
+        return np.asarray(draft, dtype=np.intc)
+
+    def stats(self):
+        return {"draft_proposed": self.proposed, "draft_accepted": self.accepted}
+
+
+class PromptLookupDraft(DraftStatsMixin, LlamaPromptLookupDecoding):
+    """Drafts by copying the continuation of the latest n-gram's earlier occurrence in the context; needs no model."""
+
+    def __init__(self, max_ngram_size=3, num_pred_tokens=DRAFT_TOKENS):
+        super().__init__(max_ngram_size=max_ngram_size, num_pred_tokens=num_pred_tokens)
+        self.reset_stats()
+
+    def __call__(self, input_ids, /, **kwargs):
+        self._check_pending(input_ids)
+        return self._record(input_ids, super().__call__(input_ids, **kwargs))
+
+
+class SmallModelDraft(DraftStatsMixin, LlamaDraftModel):
+    """
+    Drafts `num_pred_tokens` greedy tokens with a smaller GGUF model that shares the target's tokenizer.
+
+    The draft model keeps its own KV cache; each call only evaluates the tokens that differ from the previous call,
+    so accepted draft tokens are not decoded twice.
+    """
+
+    def __init__(self, model_path, n_ctx, n_threads, num_pred_tokens=DRAFT_TOKENS, **kwargs):
+        self.model_path = model_path
+        self.model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, n_batch=min(512, n_ctx),
+                           verbose=False, **kwargs)
+        self.num_pred_tokens = num_pred_tokens
+        self.reset_stats()
+
+    def __call__(self, input_ids, /, **kwargs):
+        self._check_pending(input_ids)
+        model = self.model
+        limit = min(model.n_tokens, len(input_ids) - 1)
+        prefix = 0
+        while prefix < limit and model.input_ids[prefix] == input_ids[prefix]:
+            prefix += 1
+        model.n_tokens = prefix
+        model.eval(input_ids[prefix:].tolist())
+
+        draft = []
+        n_vocab = model.n_vocab()
+        for i in range(min(self.num_pred_tokens, model.n_ctx() - model.n_tokens - 1)):
+            logits = np.ctypeslib.as_array(llama_get_logits(model.ctx), shape=(n_vocab,))
+            token = int(logits.argmax())
+            if token == model.token_eos():
+                break
+            draft.append(token)
+            if i < self.num_pred_tokens - 1:
+                model.eval([token])
+        return self._record(input_ids, draft)
+
+
+def compatible_draft(target_info, draft_info):
+    """A draft model must tokenize exactly like the target and be smaller than it."""
+    return (draft_info.path != target_info.path
+            and draft_info.file_size < target_info.file_size
+            and draft_info.tokenizer_model == target_info.tokenizer_model
+            and draft_info.vocab_size is not None
+            and draft_info.vocab_size == target_info.vocab_size)
+
+
+def pick_draft_model(target_info, candidates):
+    """The smallest compatible model among `candidates` (ModelInfo list), or None."""
+    drafts = [info for info in candidates if compatible_draft(target_info, info)]
+    return min(drafts, key=lambda info: info.file_size) if drafts else None
+
+
+def max_speculative_ctx(info):
+    """Largest n_ctx whose full logits buffer fits in SCORES_MEMORY_BUDGET."""
+    return SCORES_MEMORY_BUDGET // (4 * (info.vocab_size or 152064))
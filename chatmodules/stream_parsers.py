@@ -0,0 +1,224 @@
+"""Incremental parsers for streamed model output."""
+import json
+import re
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def is_action(value):
+    """An agent action object ({"action": ..., "action_input": ...}) or a non-empty list of them."""
+    if isinstance(value, dict):
+        return "action" in value and "action_input" in value
+    if isinstance(value, list):
+        return bool(value) and all(isinstance(item, dict) and is_action(item) for item in value)
+    return False
+
+
+def match_think_tag(text, pos, final=False):
+    """
+    The think tag starting at `text[pos]` ("<"): the tag itself, "" if there is none, or None if the text ends in
+    what may be the first part of a tag (only while more text can still arrive, i.e. not `final`).
+    """
+    rest = text[pos:pos + len(THINK_CLOSE)].lower()
+    for tag in (THINK_OPEN, THINK_CLOSE):
+        if rest.startswith(tag):
+            return tag
+    if not final and pos + len(rest) == len(text) and any(tag.startswith(rest) for tag in (THINK_OPEN, THINK_CLOSE)):
+        return None
+    return ""
+
+
+class ThinkFilter(object):
+    """
+    Separates a reasoning model's hidden `<think>...</think>` block from its answer while tokens stream in.
+
+    `feed` takes one streamed token and returns the part of it that is answer text (possibly ""); tags split across
+    tokens are held back until they can be recognized. Tokens are counted as thinking or answer as they go. An orphan
+    `</think>` means the model was thinking from the start, so everything counted as answer until then is moved to
+    thinking (text already returned by `feed` cannot be taken back; the cleaned final answer replaces it).
+    """
+
+    def __init__(self, in_think=False):
+        # in_think：提示词已以 <think> 结尾（部分聊天模板会预先打开思考块）
+        self.in_think = in_think
+        self.thinking_tokens = 0
+        self.answer_tokens = 0
+        self._pending = ""
+        self._answer_started = False
+
+    def feed(self, token):
+        text = self._pending + token
+        self._pending = ""
+        thinking = self.in_think
+        visible = []
+        pos = 0
+        while pos < len(text):
+            i = text.find("<", pos)
+            if i < 0:
+                i = len(text)
+            if not self.in_think:
+                visible.append(text[pos:i])
+            if i == len(text):
+                break
+            tag = match_think_tag(text, i)
+            if tag is None:
+                self._pending = text[i:]
+                break
+            if not tag:
+                if not self.in_think:
+                    visible.append("<")
+                pos = i + 1
+                continue
+            thinking = True
+            if tag == THINK_OPEN:
+                self.in_think = True
+            elif self.in_think:
+                self.in_think = False
+            else:
+                self.thinking_tokens += self.answer_tokens
+                self.answer_tokens = 0
+                self._answer_started = False
+                visible = []
+            pos = i + len(tag)
+
+        if thinking:
+            self.thinking_tokens += 1
+        else:
+            self.answer_tokens += 1
+        return self._visible("".join(visible))
+
+    def flush(self):
+        """Return any held-back text once the stream has ended."""
+        text, self._pending = self._pending, ""
+        return "" if self.in_think else self._visible(text)
+
+    def _visible(self, text):
+        # 思考块之后的空行不输出
+        if not self._answer_started:
+            text = text.lstrip()
+            self._answer_started = bool(text)
+        return text
+
+    def stats(self):
+        return {"thinking_tokens": self.thinking_tokens, "answer_tokens": self.answer_tokens}
+
+
+class ActionStreamParser(object):
+    """
+    Finds the agent's action JSON in model output while it is being generated.
+
+    Text is fed chunk by chunk and scanned once: `<think>...</think>` blocks are skipped (an orphan `</think>`
+    discards everything before it, as the old regex cleanup did), and brackets outside strings are matched on a
+    stack, so an action object is recognized the moment its closing brace arrives, whether or not it sits in a
+    ```json fence. `feed` returns True as soon as a complete, valid action is available, which is the signal to stop
+    decoding.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._in_think = False
+        self._in_string = False
+        self._escape = False
+        self._stack = []  # [(开括号, 起始位置)]
+        self.actions = []
+        # 位于未闭合的 "[" 内的 action 对象：可能是多 action 列表的一项，等列表结束再决定
+        self._nested = []
+
+    @property
+    def complete(self):
+        return bool(self.actions)
+
+    def feed(self, chunk):
+        self._text += chunk
+        self._scan(final=False)
+        return self.complete
+
+    def feed_all(self, text):
+        """Parse a complete output in one go; returns the last action found (or None)."""
+        self.feed(text)
+        return self.finish()
+
+    def finish(self):
+        """Scan whatever is left and return the last action found (or None)."""
+        self._scan(final=True)
+        if self.actions:
+            return self.actions[-1]
+        return self._nested[-1] if self._nested else None
+
+    def _scan(self, final):
+        text = self._text
+        while self._pos < len(text):
+            ch = text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                self._pos += 1
+                continue
+
+            if ch == "<":
+                tag = match_think_tag(text, self._pos, final)
+                if tag is None:
+                    # 可能是被切断的标签，等待后续文本
+                    return
+                if tag:
+                    self._handle_tag(tag)
+                    self._pos += len(tag)
+                    continue
+
+            if not self._in_think:
+                if ch in "{[":
+                    self._stack.append((ch, self._pos))
+                elif ch in "}]" and self._stack:
+                    opener, start = self._stack.pop()
+                    if (opener == "{") == (ch == "}"):
+                        self._accept(text[start:self._pos + 1])
+                    else:
+                        self._stack.clear()
+                elif ch == '"' and self._stack:
+                    self._in_string = True
+            self._pos += 1
+
+    def _handle_tag(self, tag):
+        self._stack.clear()
+        if tag == THINK_OPEN:
+            self._in_think = True
+        elif self._in_think:
+            self._in_think = False
+        else:
+            # 孤立的 </think>：之前的内容都属于思考过程
+            self.actions.clear()
+            self._nested.clear()
+
+    def _accept(self, candidate):
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            return
+        if not is_action(value):
+            return
+        if isinstance(value, dict) and any(opener == "[" for opener, _ in self._stack):
+            self._nested.append(value)
+        else:
+            self.actions.append(value)
+
+
+def partial_final_answer(text):
+    """The (possibly unfinished) action_input of a Final Answer in agent output cut off mid-JSON, or ""."""
+    match = re.search(r'"action"\s*:\s*"Final Answer"\s*,\s*"action_input"\s*:\s*"((?:[^"\\]|\\.)*)', text)
+    if match is None:
+        return ""
+    raw = match.group(1)
+    # 截断处可能是不完整的转义序列
+    for end in range(len(raw), max(-1, len(raw) - 6), -1):
+        try:
+            return json.loads(f'"{raw[:end]}"', strict=False)
+        except ValueError:
+            continue
+    return raw
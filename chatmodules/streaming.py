@@ -0,0 +1,97 @@
+"""Callback plumbing for streaming LlamaCpp tokens out of LangChain chains."""
+from typing import Any, Callable
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from chatmodules.stream_parsers import THINK_OPEN, ActionStreamParser, ThinkFilter, partial_final_answer
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """
+    Forward every new token produced by the LLM to `on_token`.
+
+    LlamaCpp streams by default, so any chain/agent invoked with this handler in
+    its callbacks reports tokens as soon as they are decoded. With `hide_thinking`,
+    a reasoning model's `<think>` block is filtered out as it streams.
+    """
+
+    def __init__(self, on_token: Callable[[str], Any], hide_thinking: bool = True):
+        self.on_token = on_token
+        self.hide_thinking = hide_thinking
+        self.think_filter = ThinkFilter()
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        # agent 每一步都是一次新的生成
+        self.think_filter = ThinkFilter(in_think=bool(prompts) and prompts[0].rstrip().lower().endswith(THINK_OPEN))
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if self.hide_thinking:
+            token = self.think_filter.feed(token)
+        if token:
+            self.on_token(token)
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        if self.hide_thinking:
+            rest = self.think_filter.flush()
+            if rest:
+                self.on_token(rest)
+
+
+class FinalAnswerStreamHandler(BaseCallbackHandler):
+    """
+    Forward only the agent's reply to `on_token`: the action_input of its "Final Answer" action, as it is decoded.
+
+    Tool actions, the JSON around the answer and `<think>` blocks are never forwarded. If the answer could not be
+    followed while it streamed (e.g. "action_input" came before "action"), the complete answer found by
+    ActionStreamParser is sent when the call ends.
+    """
+
+    def __init__(self, on_token: Callable[[str], Any]):
+        self.on_token = on_token
+        self._reset()
+
+    def _reset(self, in_think=False):
+        self.think_filter = ThinkFilter(in_think=in_think)
+        self.text = ""
+        self.sent = ""
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        self._reset(in_think=bool(prompts) and prompts[0].rstrip().lower().endswith(THINK_OPEN))
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.text += self.think_filter.feed(token)
+        self._send(partial_final_answer(self.text))
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self.text += self.think_filter.flush()
+        action = ActionStreamParser().feed_all(self.text)
+        if isinstance(action, dict) and action.get("action") == "Final Answer":
+            self._send(str(action["action_input"]))
+
+    def _send(self, answer):
+        # 只发送新增的部分；与已发送内容不一致（无法撤回）时不再发送
+        if len(answer) > len(self.sent) and answer.startswith(self.sent):
+            self.on_token(answer[len(self.sent):])
+            self.sent = answer
+
+
+class GenerationStatsHandler(BaseCallbackHandler):
+    """
+    Add up the per-call counters that ControlledLlamaCpp reports in `generation_info` over every LLM call of a turn:
+    thinking/answer tokens, speculative draft tokens proposed/accepted, reasoning-budget hits and cache hits.
+    """
+
+    COUNTERS = ("thinking_tokens", "answer_tokens", "draft_proposed", "draft_accepted")
+
+    def __init__(self):
+        self.stats = {"thinking_tokens": 0, "answer_tokens": 0, "budget_hit": False, "cached_calls": 0}
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                for key in self.COUNTERS:
+                    if key in info:
+                        self.stats[key] = self.stats.get(key, 0) + info[key]
+                self.stats["budget_hit"] = self.stats["budget_hit"] or bool(info.get("budget_hit"))
+                self.stats["cached_calls"] += bool(info.get("cached"))
@@ -0,0 +1,184 @@
+"""Fake LLM backend for load-testing the dialogue pipeline (memory, agent parser, streaming, server) without models."""
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import Generation, LLMResult
+from langchain_core.runnables.config import run_in_executor
+from pydantic import PrivateAttr
+
+from chatmodules.gpt4all_chatbot import GPT4AllChatbot
+from chatmodules.stream_parsers import THINK_CLOSE, THINK_OPEN
+from chatmodules.turn_control import find_turn_control
+
+SYNTHETIC_MODEL_ID = "synthetic"
+LENGTH_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+WORDS = ("the", "model", "answer", "is", "a", "short", "reply", "about", "your", "question", "and", "it", "uses",
+         "plain", "words", "to", "keep", "going", "for", "as", "long", "needed", "with", "some", "numbers", "like",
+         "42", "or", "3.14", "in", "between")
+# get_num_tokens 的计数方式：单词或单个标点算一个 token
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# 流式输出的切分方式：每个片段带上前面的空白
+TOKEN_PIECES = re.compile(r"\s*\S+")
+# 注入的错误中发生在 prompt 评估阶段（第一个 token 之前）的比例，其余发生在流式输出中途
+PROMPT_FAILURE_SHARE = 0.2
+
+
+class SyntheticLLMError(RuntimeError):
+    """Injected failure of a SyntheticLLM call."""
+
+
+class SyntheticLLM(LLM):
+    """
+    LLM that sleeps like a local model instead of running one.
+
+    A call waits `prompt_eval_delay` seconds plus one second per `prompt_eval_tps` prompt tokens, then streams a
+    random answer at `tokens_per_second` through the callbacks, exactly like ControlledLlamaCpp does. Answer lengths
+    follow `length_distribution` around `mean_tokens` (capped at `max_tokens`); `mean_think_tokens` > 0 prefixes a
+    `<think>` block. With probability `error_rate` a call raises SyntheticLLMError, during prompt evaluation
+    (PROMPT_FAILURE_SHARE of the failures) or partway through the stream. Prompts that carry the agent's action-JSON
+    format instructions get a "Final Answer" action JSON, so GPT4AllAgentbot's parser is exercised too.
+    `get_num_tokens` counts words and punctuation marks.
+    """
+
+    prompt_eval_delay: float = 0.05
+    prompt_eval_tps: float = 500.0
+    tokens_per_second: float = 20.0
+    mean_tokens: int = 64
+    length_distribution: str = "lognormal"
+    max_tokens: int = 512
+    mean_think_tokens: int = 0
+    error_rate: float = 0.0
+    n_ctx: int = 4096
+    seed: Optional[int] = None
+
+    _rng: random.Random = PrivateAttr(default=None)
+    _rng_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def model_post_init(self, __context: Any) -> None:
+        if self.length_distribution not in LENGTH_DISTRIBUTIONS:
+            raise ValueError(f"length_distribution must be one of {LENGTH_DISTRIBUTIONS}")
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "synthetic"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"prompt_eval_delay": self.prompt_eval_delay, "prompt_eval_tps": self.prompt_eval_tps,
+                "tokens_per_second": self.tokens_per_second, "mean_tokens": self.mean_tokens,
+                "length_distribution": self.length_distribution, "error_rate": self.error_rate}
+
+    def get_num_tokens(self, text: str) -> int:
+        return len(TOKEN_PATTERN.findall(text))
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        generations = []
+        for prompt in prompts:
+            text, stats = self._stream(prompt, run_manager)
+            generations.append([Generation(text=text, generation_info=stats)])
+        return LLMResult(generations=generations)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        # 与 ControlledLlamaCpp 相同：异步调用（agent 的 ainvoke）也要带上 generation_info 中的统计
+        return await run_in_executor(None, self._generate, prompts, stop,
+                                     run_manager.get_sync() if run_manager else None, **kwargs)
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return self._stream(prompt, run_manager)[0]
+
+    def _stream(self, prompt, run_manager):
+        # ControlledLlamaCpp 的 llm_kwargs（stop_on_action 等）对这里没有意义，直接忽略
+        with self._rng_lock:
+            n_answer = self._sample_length(self.mean_tokens, self.max_tokens)
+            n_think = self._sample_length(self.mean_think_tokens, self.max_tokens) if self.mean_think_tokens else 0
+            fail_at = self._rng.random() if self._rng.random() < self.error_rate else None
+            words = [self._rng.choice(WORDS) for _ in range(n_think + n_answer)]
+
+        time.sleep(self.prompt_eval_delay + self.get_num_tokens(prompt) / self.prompt_eval_tps)
+        if fail_at is not None and fail_at < PROMPT_FAILURE_SHARE:
+            raise SyntheticLLMError("Injected failure during prompt evaluation")
+
+        answer = " ".join(words[n_think:]).capitalize() + "."
+        if "action_input" in prompt:
+            # agent 提示词：按 FORMAT_INSTRUCTIONS 的格式给出最终回答
+            answer = "```json\n" + json.dumps({"action": "Final Answer", "action_input": answer}, indent=4) + "\n```"
+        if n_think:
+            answer = f"{THINK_OPEN} {' '.join(words[:n_think])} {THINK_CLOSE}\n\n{answer}"
+        pieces = TOKEN_PIECES.findall(answer)
+        fail_index = (int((fail_at - PROMPT_FAILURE_SHARE) / (1 - PROMPT_FAILURE_SHARE) * len(pieces))
+                      if fail_at is not None else None)
+
+        control = find_turn_control(run_manager)
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        next_at = time.perf_counter()
+        stats = {"thinking_tokens": n_think, "answer_tokens": len(pieces) - (n_think + 2 if n_think else 0)}
+        for i, piece in enumerate(pieces):
+            if i == fail_index:
+                raise SyntheticLLMError(f"Injected failure after {i} tokens")
+            # 按绝对时间排期，sleep 的误差不会逐个 token 累积
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if run_manager:
+                run_manager.on_llm_new_token(token=piece, verbose=self.verbose)
+            if control is not None and control.stop_reason():
+                # 与 ControlledLlamaCpp 一样，停止时返回已生成的部分
+                think_pieces = n_think + 2 if n_think else 0
+                stats = {"thinking_tokens": min(n_think, i + 1), "answer_tokens": max(0, i + 1 - think_pieces),
+                         "stopped": control.stop_reason()}
+                return "".join(pieces[:i + 1]), stats
+        return "".join(pieces), stats
+
+    def _sample_length(self, mean, cap):
+        if self.length_distribution == "fixed":
+            n = mean
+        elif self.length_distribution == "uniform":
+            n = self._rng.randint(1, 2 * mean - 1) if mean > 1 else mean
+        else:
+            # 对数正态：大多数回答较短，少数很长，接近真实对话的长度分布
+            sigma = 0.6
+            n = round(self._rng.lognormvariate(math.log(max(mean, 1)) - sigma ** 2 / 2, sigma))
+        return max(1, min(cap, n))
+
+
+class SyntheticChatbot(GPT4AllChatbot):
+    """GPT4AllChatbot (same prompt, memory, streaming and metrics) on top of a SyntheticLLM."""
+
+    def __init__(self, model_id=SYNTHETIC_MODEL_ID, llm=None, **llm_params):
+        super().__init__(model_id, llm=llm if llm is not None else SyntheticLLM(**llm_params))
+
+
+if __name__ == '__main__':
+    from chatmodules.turn_metrics import metrics_log
+
+    metrics_log.echo = True
+    bot = SyntheticChatbot(tokens_per_second=50, mean_think_tokens=8, seed=0)
+    dialogue = [{"role": "user", "content": "Hello, who are you?"}]
+    print(bot.get_response(dialogue, on_token=lambda token: print(token, end="", flush=True)))
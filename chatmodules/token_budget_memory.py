@@ -0,0 +1,142 @@
+"""Conversation memory that keeps the chat-history slot of the prompt under a fixed token budget."""
+import re
+from typing import Any, Dict, List
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.summary import SummarizerMixin
+from langchain_core.messages import BaseMessage, get_buffer_string, messages_from_dict, messages_to_dict
+from pydantic import Field
+
+HISTORY_TOKEN_BUDGET = 2048
+# 历史预算的下限：max_tokens 接近 n_ctx 时预算会算成 0，每轮都会裁剪掉全部历史并对空内容做摘要
+MIN_HISTORY_TOKEN_BUDGET = 512
+
+
+def history_token_budget(llm, reserved_tokens=0, cap=HISTORY_TOKEN_BUDGET, minimum=MIN_HISTORY_TOKEN_BUDGET):
+    """
+    Tokens left for chat history once the system prefix (`reserved_tokens`) and the answer are accounted for, but
+    never less than `minimum` (a warning is printed when the context leaves less room than that).
+    """
+    n_ctx = getattr(llm, "n_ctx", None)
+    max_tokens = getattr(llm, "max_tokens", None) or 0
+    if not n_ctx:
+        return cap
+    budget = min(cap, n_ctx - max_tokens - reserved_tokens)
+    if budget < minimum:
+        print(f"Only {max(0, budget)} tokens left for chat history (n_ctx={n_ctx}, max_tokens={max_tokens}, "
+              f"reserved={reserved_tokens}); using {min(cap, minimum)}. Lower max_tokens to leave room for history.")
+        return min(cap, minimum)
+    return budget
+
+
+class TokenBudgetMemory(BaseChatMemory, SummarizerMixin):
+    """
+    Recent turns verbatim, older turns folded into a rolling summary, all within `max_token_limit` tokens.
+
+    Token counts are measured with the model's own tokenizer once per message and cached, so budgeting a turn only
+    tokenizes the two new messages instead of the whole history. When the budget is exceeded the oldest messages are
+    pruned down to `prune_ratio` of the budget in one go and summarized incrementally, so the (history-invalidating)
+    summary update happens every few turns rather than on every turn.
+    """
+    max_token_limit: int = HISTORY_TOKEN_BUDGET
+    prune_ratio: float = 0.75
+    summarize: bool = True
+    memory_key: str = "chat_history"
+    return_messages: bool = True
+
+    moving_summary_buffer: str = ""
+    summary_token_count: int = 0
+    token_counts: List[int] = Field(default_factory=list)
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def buffer_token_count(self) -> int:
+        return self.summary_token_count + sum(self.token_counts)
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = list(self.chat_memory.messages)
+        if self.moving_summary_buffer:
+            messages = [self.summary_message_cls(content=self.moving_summary_buffer)] + messages
+        if self.return_messages:
+            return {self.memory_key: messages}
+        return {self.memory_key: get_buffer_string(messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        if not self._get_input_output(inputs, outputs)[1].strip():
+            # 还没生成任何内容就被停止的一轮不写入历史，否则空的回复会留在之后每一轮的 prompt 中
+            return
+        super().save_context(inputs, outputs)
+        self.token_counts.extend(self._count(msg) for msg in self.chat_memory.messages[-2:])
+        self.prune()
+
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        """Append existing messages (e.g. carried over from another model), counting them with this model's tokenizer."""
+        self.chat_memory.add_messages(messages)
+        self.token_counts.extend(self._count(msg) for msg in messages)
+        self.prune()
+
+    def copy_from(self, other: "TokenBudgetMemory") -> None:
+        self.clear()
+        self._set_summary(other.moving_summary_buffer)
+        self.add_messages(list(other.chat_memory.messages))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """History, summary and cached token counts, e.g. for parking a session on disk."""
+        return {
+            "messages": messages_to_dict(self.chat_memory.messages),
+            "summary": self.moving_summary_buffer,
+            "summary_token_count": self.summary_token_count,
+            "token_counts": list(self.token_counts),
+        }
+
+    def load_dict(self, data: Dict[str, Any], recount: bool = False) -> None:
+        """Restore `to_dict` output; `recount` re-measures tokens when it was saved with another model's tokenizer."""
+        if recount:
+            self.clear()
+            self._set_summary(data["summary"])
+            self.add_messages(messages_from_dict(data["messages"]))
+            return
+        super().clear()
+        self.chat_memory.add_messages(messages_from_dict(data["messages"]))
+        self.moving_summary_buffer = data["summary"]
+        self.summary_token_count = data["summary_token_count"]
+        self.token_counts = list(data["token_counts"])
+
+    def prune(self) -> None:
+        if self.buffer_token_count <= self.max_token_limit:
+            return
+
+        buffer = self.chat_memory.messages
+        target = int(self.max_token_limit * self.prune_ratio)
+        pruned = []
+        # 至少保留最近一轮（用户提问 + 回复）
+        while len(buffer) > 2 and self.buffer_token_count > target:
+            pruned.append(buffer.pop(0))
+            self.token_counts.pop(0)
+            # 按整轮裁剪，不在历史开头留下没有提问的回复
+            if len(buffer) > 2 and buffer[0].type == "ai":
+                pruned.append(buffer.pop(0))
+                self.token_counts.pop(0)
+
+        if pruned and self.summarize:
+            summary = self.predict_new_summary(pruned, self.moving_summary_buffer)
+            self._set_summary(summary)
+
+    def clear(self) -> None:
+        super().clear()
+        self.token_counts = []
+        self.moving_summary_buffer = ""
+        self.summary_token_count = 0
+
+    def _set_summary(self, summary: str) -> None:
+        # 推理模型会在摘要前输出 <think>...</think>，摘要中只保留结论
+        summary = re.sub(r"<think>[\s\S]*?</think>", "", summary, flags=re.IGNORECASE).strip()
+        self.moving_summary_buffer = summary
+        self.summary_token_count = self._count(self.summary_message_cls(content=summary)) if summary else 0
+
+    def _count(self, message: BaseMessage) -> int:
+        return self.llm.get_num_tokens(get_buffer_string([message], human_prefix=self.human_prefix,
+                                                         ai_prefix=self.ai_prefix))
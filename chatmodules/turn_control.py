@@ -0,0 +1,89 @@
+"""Cooperative cancellation and per-turn wall-clock / token deadlines for chat turns."""
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+STOP_CANCELLED = "cancelled"
+STOP_TIMEOUT = "timeout"
+STOP_MAX_TOKENS = "max_tokens"
+
+
+class TurnStopped(Exception):
+    """Raised between agent steps once the turn has been cancelled or ran out of time/tokens."""
+
+
+class TurnControl(BaseCallbackHandler):
+    """
+    Stop signal for one chat turn, passed along with the turn's callbacks.
+
+    `cancel()` may be called from any thread (e.g. the GUI's Stop button). ControlledLlamaCpp checks `stop_reason()`
+    after every streamed token and ends the generation there, keeping the text produced so far; the agent loop is
+    stopped before its next action. Token generation is the only thing that is interrupted: a prompt-evaluation
+    batch or a running tool call finishes first (tools are bounded by the turn deadline through ToolRuntime).
+    """
+
+    # 让 on_agent_action 中抛出的 TurnStopped 中断 AgentExecutor，而不是被回调管理器吞掉
+    raise_error = True
+
+    def __init__(self, timeout: Optional[float] = None, max_tokens: Optional[int] = None,
+                 cancel_event: Optional[threading.Event] = None):
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self.deadline = None
+        self.tokens = 0
+        self.reason = None
+        self.last_text = ""  # 当前（最近一次）LLM 调用已生成的文本
+        # 可传入调用方自己的 Event（如 GUI 在导入 langchain 之前就创建好的）
+        self._cancelled = cancel_event or threading.Event()
+
+    def begin(self, timeout: Optional[float] = None, max_tokens: Optional[int] = None) -> "TurnControl":
+        """Start the turn clock. Limits given to the constructor take precedence over these (the bot's defaults)."""
+        if self.timeout is None:
+            self.timeout = timeout
+        if self.max_tokens is None:
+            self.max_tokens = max_tokens
+        self.deadline = time.monotonic() + self.timeout if self.timeout else None
+        return self
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def remaining_time(self) -> Optional[float]:
+        return max(0.0, self.deadline - time.monotonic()) if self.deadline is not None else None
+
+    def stop_reason(self) -> Optional[str]:
+        """Why the turn must stop now, or None; the first reason found sticks."""
+        if self.reason is None:
+            if self._cancelled.is_set():
+                self.reason = STOP_CANCELLED
+            elif self.deadline is not None and time.monotonic() >= self.deadline:
+                self.reason = STOP_TIMEOUT
+            elif self.max_tokens is not None and self.tokens >= self.max_tokens:
+                self.reason = STOP_MAX_TOKENS
+        return self.reason
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop_reason() is not None
+
+    def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+        self.last_text = ""
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens += 1
+        self.last_text += token
+
+    def on_agent_action(self, action: Any, **kwargs: Any) -> None:
+        reason = self.stop_reason()
+        if reason is not None:
+            raise TurnStopped(reason)
+
+
+def find_turn_control(run_manager) -> Optional[TurnControl]:
+    """The TurnControl among the callbacks of an LLM run, if the caller passed one."""
+    for handler in getattr(run_manager, "handlers", None) or []:
+        if isinstance(handler, TurnControl):
+            return handler
+    return None
@@ -0,0 +1,208 @@
+"""Per-turn performance metrics: collected from LangChain callbacks, appended to a rotating JSONL log."""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from typing import Any, Callable, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+METRICS_LOG_FILE = "logs/turn_metrics.jsonl"
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None if the platform does not report it."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 为单位，macOS 以字节为单位
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except ImportError:
+        return None
+
+
+class TurnMetricsHandler(BaseCallbackHandler):
+    """
+    Times one chat turn from the callbacks of every LLM call and tool call made while answering it.
+
+    Prompt-eval time is the time from each LLM call's start to its first token; decode speed is the tokens generated
+    after the first one over the time spent generating them. Tool time is wall-clock time with at least one tool
+    running, so concurrent calls are not double counted.
+    """
+
+    def __init__(self, count_tokens: Optional[Callable[[str], int]] = None):
+        self.count_tokens = count_tokens
+        self.turn_start = time.perf_counter()
+        self.first_token_at = None
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.generated_tokens = 0
+        self.prompt_eval_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.tool_calls = 0
+        self.tool_seconds = 0.0
+        self._lock = threading.Lock()
+        self._llm_runs = {}  # run_id -> [start, first token time, tokens]
+        self._tools_running = 0
+        self._tools_busy_since = None
+
+    def on_llm_start(self, serialized: Any, prompts: Any, *, run_id: Any = None, **kwargs: Any) -> None:
+        with self._lock:
+            self.llm_calls += 1
+            self._llm_runs[run_id] = [time.perf_counter(), None, 0]
+        if self.count_tokens:
+            tokens = sum(self.count_tokens(prompt) for prompt in prompts)
+            with self._lock:
+                self.prompt_tokens += tokens
+
+    def on_llm_new_token(self, token: str, *, run_id: Any = None, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            run = self._llm_runs.get(run_id)
+            if run is None:
+                return
+            if run[1] is None:
+                run[1] = now
+                if self.first_token_at is None:
+                    self.first_token_at = now
+            run[2] += 1
+
+    def on_llm_end(self, response: Any, *, run_id: Any = None, **kwargs: Any) -> None:
+        self._finish_llm_run(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any = None, **kwargs: Any) -> None:
+        self._finish_llm_run(run_id)
+
+    def _finish_llm_run(self, run_id):
+        now = time.perf_counter()
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+            if run is None:
+                return
+            start, first_token, tokens = run
+            self.generated_tokens += tokens
+            if first_token is None:
+                self.prompt_eval_seconds += now - start
+            else:
+                self.prompt_eval_seconds += first_token - start
+                self.decode_seconds += now - first_token
+
+    def on_tool_start(self, serialized: Any, input_str: str, **kwargs: Any) -> None:
+        with self._lock:
+            self.tool_calls += 1
+            if self._tools_running == 0:
+                self._tools_busy_since = time.perf_counter()
+            self._tools_running += 1
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self._finish_tool()
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._finish_tool()
+
+    def _finish_tool(self):
+        with self._lock:
+            self._tools_running = max(0, self._tools_running - 1)
+            if self._tools_running == 0 and self._tools_busy_since is not None:
+                self.tool_seconds += time.perf_counter() - self._tools_busy_since
+                self._tools_busy_since = None
+
+    def summary(self, **extra):
+        """The turn's metrics as a flat dict; `extra` fields (model id, bot type, ...) are added as-is."""
+        with self._lock:
+            decode_tokens = max(0, self.generated_tokens - self.llm_calls)
+            peak_rss = peak_rss_bytes()
+            record = {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                **extra,
+                "llm_calls": self.llm_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "generated_tokens": self.generated_tokens,
+                "prompt_eval_s": round(self.prompt_eval_seconds, 3),
+                "ttft_s": round(self.first_token_at - self.turn_start, 3) if self.first_token_at else None,
+                "decode_tps": (round(decode_tokens / self.decode_seconds, 2)
+                               if decode_tokens and self.decode_seconds > 0 else None),
+                "tool_calls": self.tool_calls,
+                "tool_s": round(self.tool_seconds, 3),
+                "total_s": round(time.perf_counter() - self.turn_start, 3),
+                "peak_rss_mb": round(peak_rss / 2 ** 20, 1) if peak_rss else None,
+            }
+        if record.get("draft_proposed"):
+            record["draft_acceptance"] = round(record["draft_accepted"] / record["draft_proposed"], 3)
+        return record
+
+
+def format_metrics(record):
+    """One-line summary for the status bar / console."""
+    parts = [f"prompt {record['prompt_tokens']} tok", f"gen {record['generated_tokens']} tok"]
+    if record.get("thinking_tokens"):
+        parts.append(f"think {record['thinking_tokens']} tok")
+    if record.get("ttft_s") is not None:
+        parts.append(f"TTFT {record['ttft_s']:.2f}s")
+    parts.append(f"prompt eval {record['prompt_eval_s']:.2f}s")
+    if record.get("decode_tps") is not None:
+        parts.append(f"{record['decode_tps']:.1f} tok/s")
+    if record.get("cached_calls"):
+        parts.append("cached")
+    if record.get("draft_acceptance") is not None:
+        parts.append(f"draft {record['draft_acceptance'] * 100:.0f}% accepted")
+    if record.get("tool_calls"):
+        parts.append(f"tools {record['tool_calls']} ({record['tool_s']:.2f}s)")
+    if record.get("recalled"):
+        parts.append(f"recalled {record['recalled']}")
+    if record.get("routed"):
+        parts.append(f"routed ({record['routed']})")
+    if record.get("stopped"):
+        parts.append(f"stopped ({record['stopped']})")
+    parts.append(f"total {record['total_s']:.2f}s")
+    if record.get("peak_rss_mb") is not None:
+        parts.append(f"peak RSS {record['peak_rss_mb']:.0f} MB")
+    return " | ".join(parts)
+
+
+class MetricsLog(object):
+    """Appends one JSON object per turn to a size-rotated log file; with `echo`, also prints a one-line summary."""
+
+    def __init__(self, path=METRICS_LOG_FILE, max_bytes=5 * 2 ** 20, backup_count=5, echo=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        # 默认不打印：server / loadgen 每秒可能有很多轮，GUI 在状态栏中显示
+        self.echo = echo
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def _get_logger(self):
+        # 第一次写入时才创建日志文件
+        if self._logger is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes, backupCount=self.backup_count,
+                                          encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger(f"turn_metrics.{os.path.abspath(self.path)}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def write(self, record):
+        with self._lock:
+            try:
+                self._get_logger().info(json.dumps(record, ensure_ascii=False))
+            except OSError as e:
+                print("Failed to write turn metrics:", e)
+        if self.echo:
+            print("Turn metrics:", format_metrics(record))
+
+
+metrics_log = MetricsLog()
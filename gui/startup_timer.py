@@ -0,0 +1,24 @@
+"""Wall-clock marks for GUI startup, printed as one report line."""
+import time
+
+
+class StartupTimer(object):
+    """Records named milestones relative to `start` (a time.perf_counter() value taken as early as possible)."""
+
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.marks = []
+
+    def mark(self, name):
+        elapsed = time.perf_counter() - self.start
+        self.marks.append((name, elapsed))
+        return elapsed
+
+    def get(self, name):
+        for mark_name, elapsed in self.marks:
+            if mark_name == name:
+                return elapsed
+        return None
+
+    def report(self):
+        return "Startup timing: " + " | ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.marks)
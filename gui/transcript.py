@@ -0,0 +1,97 @@
+"""Append-only, bounded rendering of the conversation into a QTextEdit."""
+from collections import deque
+
+from PyQt5.QtGui import QTextCursor
+
+
+class Transcript(object):
+    """
+    Keeps the dialogue view in sync with the conversation without ever rebuilding the whole document.
+
+    New messages are appended at the end, streaming tokens only touch the last message block, and once more
+    than `max_messages` blocks are shown the oldest ones are cut from the top, so layout work and document
+    memory stay bounded no matter how long the session runs.
+    """
+    ROLE_LABELS = {"user": "User", "assistant": "Bot", "system": "System"}
+    SEPARATOR = "\n\n"
+
+    def __init__(self, text_edit, max_messages=1000):
+        self.text_edit = text_edit
+        self.document = text_edit.document()
+        # 只追加的文档不需要撤销栈，否则每次编辑都会额外占用内存
+        self.document.setUndoRedoEnabled(False)
+        self.max_messages = max_messages
+
+        # 每条消息在文档中占用的长度（Qt position 单位，含前置分隔符）
+        self._lengths = deque()
+        # 最后一条消息正文的起始位置
+        self._last_start = 0
+
+    def append(self, role, content=""):
+        at_bottom = self._is_at_bottom()
+        cursor = self._end_cursor()
+        start = cursor.position()
+        if self._lengths:
+            cursor.insertText(self.SEPARATOR)
+        cursor.insertText(f"{self.ROLE_LABELS.get(role, role)}: ")
+        self._last_start = cursor.position()
+        cursor.insertText(content)
+        self._lengths.append(cursor.position() - start)
+
+        self._trim()
+        if at_bottom:
+            self._scroll_to_bottom()
+
+    def append_to_last(self, text):
+        if not self._lengths:
+            return self.append("assistant", text)
+        at_bottom = self._is_at_bottom()
+        cursor = self._end_cursor()
+        start = cursor.position()
+        cursor.insertText(text)
+        self._lengths[-1] += cursor.position() - start
+        if at_bottom:
+            self._scroll_to_bottom()
+
+    def replace_last(self, content):
+        if not self._lengths:
+            return self.append("assistant", content)
+        at_bottom = self._is_at_bottom()
+        cursor = QTextCursor(self.document)
+        cursor.setPosition(self._last_start)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        removed = cursor.selectionEnd() - cursor.selectionStart()
+        cursor.insertText(content)
+        self._lengths[-1] += cursor.position() - self._last_start - removed
+        if at_bottom:
+            self._scroll_to_bottom()
+
+    def clear(self):
+        self.document.clear()
+        self._lengths.clear()
+        self._last_start = 0
+
+    def _trim(self):
+        separator_length = len(self.SEPARATOR)
+        while len(self._lengths) > self.max_messages:
+            # 删除最旧的一条消息以及下一条消息前面的分隔符
+            removed = self._lengths.popleft() + separator_length
+            self._lengths[0] -= separator_length
+            cursor = QTextCursor(self.document)
+            cursor.setPosition(0)
+            cursor.setPosition(removed, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+            self._last_start -= removed
+
+    def _end_cursor(self):
+        cursor = QTextCursor(self.document)
+        cursor.movePosition(QTextCursor.End)
+        return cursor
+
+    def _is_at_bottom(self):
+        scrollbar = self.text_edit.verticalScrollBar()
+        return scrollbar.value() >= scrollbar.maximum() - 4
+
+    def _scroll_to_bottom(self):
+        scrollbar = self.text_edit.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
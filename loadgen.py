@@ -0,0 +1,256 @@
+"""Load generator: simulated users chatting concurrently with an in-process SessionScheduler or a running server.py."""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from chatmodules.synthetic_llm import LENGTH_DISTRIBUTIONS, WORDS, SyntheticLLM
+
+models_dir = "models/"
+SEED = 42
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of `values` (q in 0-100), or None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class Result(object):
+    def __init__(self, outcome, latency, ttft=None, tokens=0, error=None):
+        self.outcome = outcome  # ok / rejected / busy / error
+        self.latency = latency
+        self.ttft = ttft
+        self.tokens = tokens
+        self.error = error
+
+
+class InProcessTarget(object):
+    """Drives a SessionScheduler directly: no network, but the same queueing, memory and chatbot code as server.py."""
+
+    def __init__(self, llm, chatbot_factory, max_queue=16, max_sessions=64):
+        from chatmodules.session_scheduler import SessionScheduler
+
+        self.scheduler = SessionScheduler(llm, chatbot_factory, max_queue=max_queue, max_sessions=max_sessions)
+
+    async def start(self):
+        self.scheduler.start()
+
+    async def stop(self):
+        await self.scheduler.stop()
+
+    async def create_session(self):
+        return self.scheduler.create_session()
+
+    async def chat(self, session_id, message):
+        from chatmodules.session_scheduler import QueueFullError, SessionBusyError
+
+        start = time.perf_counter()
+        first_token = []
+        tokens = []
+
+        def on_token(token):
+            # 由解码线程调用
+            if not first_token:
+                first_token.append(time.perf_counter())
+            tokens.append(token)
+
+        try:
+            await self.scheduler.submit(session_id, message, on_token=on_token)
+        except QueueFullError:
+            return Result("rejected", time.perf_counter() - start)
+        except SessionBusyError:
+            return Result("busy", time.perf_counter() - start)
+        except Exception as e:
+            return Result("error", time.perf_counter() - start, error=f"{type(e).__name__}: {e}")
+        ttft = first_token[0] - start if first_token else None
+        return Result("ok", time.perf_counter() - start, ttft, len(tokens))
+
+    def status(self):
+        return self.scheduler.status()
+
+
+class HttpTarget(object):
+    """Talks to server.py over its WebSocket endpoint, so time to first token is measured on the client side."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.http = None
+        self.sockets = {}
+
+    async def start(self):
+        import aiohttp
+
+        self.http = aiohttp.ClientSession()
+
+    async def stop(self):
+        for ws in self.sockets.values():
+            await ws.close()
+        await self.http.close()
+
+    async def create_session(self):
+        async with self.http.post(self.url + "/sessions") as response:
+            if response.status != 201:
+                return None
+            session_id = (await response.json())["session_id"]
+        self.sockets[session_id] = await self.http.ws_connect(f"{self.url}/sessions/{session_id}/ws")
+        return session_id
+
+    async def chat(self, session_id, message):
+        ws = self.sockets[session_id]
+        start = time.perf_counter()
+        ttft = None
+        tokens = 0
+        await ws.send_json({"content": message})
+        while True:
+            data = await ws.receive_json()
+            if data["type"] == "token":
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                tokens += 1
+            elif data["type"] == "done":
+                return Result("ok", time.perf_counter() - start, ttft, tokens)
+            else:
+                outcome = "rejected" if "retry_after" in data else "busy" if "in progress" in data["error"] else "error"
+                return Result(outcome, time.perf_counter() - start, error=data["error"])
+
+    def status(self):
+        return None
+
+
+async def simulate_user(target, user_index, turns, message_words, think_time, rng, results):
+    session_id = None
+    # 会话数已满时稍后重试
+    for _ in range(10):
+        try:
+            session_id = await target.create_session()
+        except Exception as e:
+            results.append(Result("error", 0.0, error=f"create_session: {type(e).__name__}: {e}"))
+            return
+        if session_id is not None:
+            break
+        await asyncio.sleep(1.0)
+    if session_id is None:
+        results.append(Result("rejected", 0.0, error="no session"))
+        return
+
+    for turn in range(turns):
+        n_words = max(1, round(rng.expovariate(1 / message_words)))
+        message = f"User {user_index} turn {turn}: " + " ".join(rng.choice(WORDS) for _ in range(n_words)) + "?"
+        result = await target.chat(session_id, message)
+        results.append(result)
+        if result.outcome == "rejected":
+            await asyncio.sleep(1.0)
+        if think_time > 0:
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r.outcome == "ok"]
+    latencies = [r.latency for r in ok]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    errors = {}
+    for r in results:
+        if r.error:
+            errors[r.error] = errors.get(r.error, 0) + 1
+
+    def rounded(value):
+        return round(value, 3) if value is not None else None
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "rejected": sum(r.outcome == "rejected" for r in results),
+        "busy": sum(r.outcome == "busy" for r in results),
+        "errors": sum(r.outcome == "error" for r in results),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        "tokens_per_s": round(sum(r.tokens for r in ok) / elapsed, 1) if elapsed > 0 else None,
+        "latency_p50_s": rounded(percentile(latencies, 50)),
+        "latency_p95_s": rounded(percentile(latencies, 95)),
+        "latency_p99_s": rounded(percentile(latencies, 99)),
+        "ttft_p50_s": rounded(percentile(ttfts, 50)),
+        "ttft_p95_s": rounded(percentile(ttfts, 95)),
+        "error_messages": errors,
+    }
+
+
+async def run(target, users, turns, message_words, think_time, seed=SEED, ramp_up=0.0):
+    results = []
+    await target.start()
+    start = time.perf_counter()
+    try:
+        tasks = []
+        for i in range(users):
+            rng = random.Random(seed * 1000 + i)
+            tasks.append(asyncio.create_task(simulate_user(target, i, turns, message_words, think_time, rng, results)))
+            if ramp_up > 0:
+                await asyncio.sleep(ramp_up / users)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+        summary = summarize(results, elapsed)
+        status = target.status()
+        if status:
+            summary["scheduler"] = status
+    finally:
+        await target.stop()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default=None, help="load-test a running server.py (e.g. http://127.0.0.1:8080) "
+                                                    "instead of an in-process scheduler")
+    parser.add_argument("--model", default=None, help="in-process: real model id instead of the synthetic backend")
+    parser.add_argument("--agent", action="store_true", help="in-process: GPT4AllAgentbot instead of GPT4AllChatbot")
+    parser.add_argument("-u", "--users", type=int, default=8, help="concurrent simulated users")
+    parser.add_argument("-t", "--turns", type=int, default=5, help="turns per user")
+    parser.add_argument("--message-words", type=float, default=12, help="mean words per user message")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean pause between a user's turns (s)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which users join")
+    parser.add_argument("--max-queue", type=int, default=16)
+    parser.add_argument("--max-sessions", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", default=None, help="also write the summary to this JSON file")
+    synthetic = parser.add_argument_group("synthetic backend (in-process, without --model)")
+    synthetic.add_argument("--prompt-eval-delay", type=float, default=0.05, help="fixed delay before the first token")
+    synthetic.add_argument("--prompt-eval-tps", type=float, default=500.0, help="prompt tokens evaluated per second")
+    synthetic.add_argument("--tps", type=float, default=20.0, help="generated tokens per second")
+    synthetic.add_argument("--mean-tokens", type=int, default=64, help="mean answer length in tokens")
+    synthetic.add_argument("--length-distribution", choices=LENGTH_DISTRIBUTIONS, default="lognormal")
+    synthetic.add_argument("--think-tokens", type=int, default=0, help="mean <think> length (0: no thinking)")
+    synthetic.add_argument("--error-rate", type=float, default=0.0, help="probability that an LLM call fails")
+    args = parser.parse_args()
+
+    if args.url:
+        target = HttpTarget(args.url)
+    else:
+        if args.agent:
+            from chatmodules.gpt4all_agentbot import GPT4AllAgentbot as chatbot_cls
+        else:
+            from chatmodules.gpt4all_chatbot import GPT4AllChatbot as chatbot_cls
+        if args.model:
+            from chatmodules.model_registry import ModelRegistry
+            llm = ModelRegistry(models_dir).create_llm(args.model)
+        else:
+            llm = SyntheticLLM(prompt_eval_delay=args.prompt_eval_delay, prompt_eval_tps=args.prompt_eval_tps,
+                               tokens_per_second=args.tps, mean_tokens=args.mean_tokens,
+                               length_distribution=args.length_distribution, mean_think_tokens=args.think_tokens,
+                               error_rate=args.error_rate, seed=args.seed)
+        model_id = args.model or "synthetic"
+        target = InProcessTarget(llm, lambda shared_llm: chatbot_cls(model_id, llm=shared_llm),
+                                 max_queue=args.max_queue, max_sessions=args.max_sessions)
+
+    summary = asyncio.run(run(target, args.users, args.turns, args.message_words, args.think_time,
+                              seed=args.seed, ramp_up=args.ramp_up))
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,62 +1,135 @@
+import time
+STARTUP_START = time.perf_counter()
+
+import importlib
 import os
 import sys
+import threading
 import traceback
+from functools import partial
 
 import qdarkstyle
 from PyQt5 import QtWidgets, QtCore, uic
 from PyQt5.QtCore import QThread, pyqtSignal
 from qdarkstyle import LightPalette
 
+# 这里只导入轻量模块；langchain / llama.cpp 和聊天模块由 WarmUpThread 在窗口显示后加载
 from chatmodules.repeater import repeater_get_response
-from chatmodules.gpt4all_chatbot import GPT4AllChatbot
-from chatmodules.gpt4all_agentbot import GPT4AllAgentbot
+from chatmodules.model_pool import ModelPool, estimate_model_bytes
+from chatmodules.model_registry import ModelRegistry, load_llamacpp
+from gui.startup_timer import StartupTimer
+from gui.transcript import Transcript
 
 import warnings
 warnings.filterwarnings("ignore")
 
 models_dir = "models/"
+# 聊天后端：(模块, 类名)
+chatbot_backend = ("chatmodules.gpt4all_chatbot", "GPT4AllChatbot")
+# chatbot_backend = ("chatmodules.gpt4all_agentbot", "GPT4AllAgentbot")
+# 推测解码：None、"prompt-lookup"、"auto" 或草稿模型 id（见 load_llamacpp）
+speculative = None
+# 长期记忆目录：每轮对话写入，之后的对话（包括清空、重启之后）按相关性召回；None 表示不使用
+long_term_memory_dir = "cache/long_term/"
 
 class WorkThread(QThread):
     trigger = pyqtSignal(str)
+    token_trigger = pyqtSignal(str)  # 流式输出：每个新 token 触发一次
 
-    def __init__(self, dialogue_list, func):
+    def __init__(self, dialogue_list, func, stream=False):
         super(WorkThread, self).__init__()
         self.dialogue_list = dialogue_list
         self.func = func
+        self.stream = stream
 
     def run(self):
         try:
-            response = self.func(self.dialogue_list)
+            if self.stream:
+                response = self.func(self.dialogue_list, on_token=self.token_trigger.emit)
+            else:
+                response = self.func(self.dialogue_list)
             self.trigger.emit(response)
         except Exception as e:
             traceback.print_exc()
             self.trigger.emit("Error: " + str(e))
 
 
+_backend_lock = threading.Lock()
+
+
+def load_chat_backend():
+    """Import the chat backend (and with it langchain) on first use; returns the chatbot class."""
+    with _backend_lock:
+        module_name, class_name = chatbot_backend
+        return getattr(importlib.import_module(module_name), class_name)
+
+
+class WarmUpThread(QThread):
+    """Loads the heavy dependencies in the background after the window is shown, reporting each step."""
+    progress = pyqtSignal(str)
+    done = pyqtSignal(object)  # chatbot 类；失败时为 None
+
+    def __init__(self, steps):
+        super(WarmUpThread, self).__init__()
+        self.steps = steps  # [(说明, 函数)]，最后一步的返回值为 chatbot 类
+
+    def run(self):
+        result = None
+        try:
+            for label, func in self.steps:
+                self.progress.emit(label)
+                result = func()
+        except Exception as e:
+            traceback.print_exc()
+            self.progress.emit("Warm-up failed: " + str(e))
+            result = None
+        self.done.emit(result)
+
+
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, startup_timer=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.startup_timer = startup_timer or StartupTimer()
         ui_path = os.path.dirname(os.path.abspath(__file__))
         uic.loadUi(os.path.join(ui_path, "gui/main.ui"), self)
 
         self.sendPushButton.clicked.connect(self.send_message)
         self.clearPushButton.clicked.connect(self.clear_all)
+        self.stopPushButton.clicked.connect(self.stop_generation)
 
         self.inputPlainTextEdit.installEventFilter(self)
+        self.transcript = Transcript(self.dialogueTextEdit)
 
         # Add models to modelComboBox
-        models_list = os.listdir(models_dir)
-        self.repeater_model_name = f"{len(models_list)}: Repeater"
-        for i, model_file in enumerate(models_list):
-            self.modelComboBox.addItem(f"{i}: " + model_file)
+        # 使用稳定的模型 ID（文件名去掉 .gguf），不再依赖 os.listdir 的顺序
+        self.model_registry = ModelRegistry(models_dir)
+        self.repeater_model_name = "Repeater"
+        # 不需要模型文件的假后端（SyntheticLLM），用于测试界面和对话流程
+        self.synthetic_model_name = "Synthetic"
+        for model_id in self.model_registry.model_ids():
+            self.modelComboBox.addItem(model_id)
         self.modelComboBox.addItem(self.repeater_model_name)
+        self.modelComboBox.addItem(self.synthetic_model_name)
+
+        # 已加载的模型保存在 ModelPool 中，切换模型时不再重新加载 GGUF 文件
+        # 推测解码的草稿模型与目标模型一起计入内存预算
+        self.model_pool = ModelPool(max_models=2, loader=partial(load_llamacpp, speculative=speculative),
+                                    size_estimator=partial(estimate_model_bytes, speculative=speculative))
+        # 聊天后端在 warm_up 中后台导入，第一次使用时若尚未完成则在工作线程中等待
+        self.chatbot_cls = None
+        self.warm_up_thread = None
+        self.session_store = None
+        self.long_term_memory = None
+        self.synthetic_llm = None
+        self.modelComboBox.currentTextChanged.connect(self.preload_model)
 
         self.current_model_name = self.repeater_model_name
-        self.current_model = GPT4AllChatbot(0)
-        # self.current_model = GPT4AllAgentbot(0)
+        self.current_model = None
 
         self.dialogue_list = []  # 使用结构化对话列表 [{"role": "user"/"assistant", "content": "..."}]
         self.work = None
+        self.stop_event = None  # 当前回复的取消信号，由 Stop 按钮设置
+        self.stream_started = False  # 当前回复是否已收到第一个 token
 
     def eventFilter(self, obj, event):
         if event.type() == QtCore.QEvent.KeyPress and obj is self.inputPlainTextEdit:
@@ -65,18 +138,79 @@ class MainWindow(QtWidgets.QMainWindow):
                 return True
         return super().eventFilter(obj, event)
 
+    def warm_up(self):
+        # 窗口显示之后调用：在后台导入 langchain / llama.cpp 和聊天模块，进度显示在状态栏
+        self.startup_timer.mark("window visible")
+        self.warm_up_thread = WarmUpThread([
+            ("Loading langchain...", lambda: importlib.import_module("langchain.chains.llm")),
+            ("Loading llama.cpp...", lambda: importlib.import_module("llama_cpp")),
+            ("Loading chat modules...", load_chat_backend),
+        ])
+        self.warm_up_thread.progress.connect(self.statusbar.showMessage)
+        self.warm_up_thread.done.connect(self.handle_warm_up_done)
+        self.warm_up_thread.start()
+
+    def handle_warm_up_done(self, chatbot_cls):
+        if chatbot_cls is None:
+            return
+        self.chatbot_cls = chatbot_cls
+        elapsed = self.startup_timer.mark("backend ready")
+        print(self.startup_timer.report())
+        self.statusbar.showMessage(f"Ready (window {self.startup_timer.get('window visible'):.2f}s, "
+                                   f"chat backend {elapsed:.2f}s)")
+
+    def preload_model(self, model_name):
+        # 选中即开始在后台加载，当前模型在加载完成前仍可继续使用
+        if model_name and model_name not in (self.repeater_model_name, self.synthetic_model_name):
+            self.model_pool.preload(self.model_registry.path(model_name))
+
+    def model_get_response(self, model_name, dialogue_list, on_token=None, stop_event=None):
+        # 在 WorkThread 中执行：若模型仍在后台加载，只阻塞工作线程而不是 GUI
+        if self.chatbot_cls is None:
+            self.chatbot_cls = load_chat_backend()
+        if model_name == self.synthetic_model_name:
+            if self.synthetic_llm is None:
+                from chatmodules.synthetic_llm import SyntheticLLM
+                self.synthetic_llm = SyntheticLLM()
+            llm = self.synthetic_llm
+        else:
+            llm = self.model_pool.get(self.model_registry.path(model_name))
+        if self.current_model is None or self.current_model.llm is not llm:
+            if self.session_store is None:
+                from chatmodules.session_store import SessionStore
+                self.session_store = SessionStore(max_resident=2)
+            if self.long_term_memory is None and long_term_memory_dir:
+                from chatmodules.long_term_memory import LongTermMemory
+                self.long_term_memory = LongTermMemory(long_term_memory_dir)
+            previous_model = self.current_model
+            # 假后端的回答没有意义，不写入长期记忆
+            self.current_model = self.chatbot_cls(
+                model_name, llm=llm, long_term_memory=self.long_term_memory if llm is not self.synthetic_llm else None)
+            if previous_model is not None:
+                if previous_model.llm is not self.synthetic_llm:
+                    # 切走前保存旧模型的 KV 状态：即使它被 ModelPool 换出，切回来时也不必重新评估整段历史
+                    self.session_store.park(f"gui-{previous_model.model_id}", previous_model, dialogue_list)
+                # 切换模型后保留对话上下文（按新模型的分词器重新计算 token 预算）
+                self.current_model.memory.copy_from(previous_model.memory)
+            if llm is not self.synthetic_llm:
+                self.session_store.restore_kv(f"gui-{model_name}", self.current_model)
+        if stop_event is not None and stop_event.is_set():
+            # 模型加载期间已点击 Stop
+            return ""
+        from chatmodules.turn_control import TurnControl
+        return self.current_model.get_response(dialogue_list, on_token=on_token,
+                                               control=TurnControl(cancel_event=stop_event))
+
     def send_message(self):
         chosen_model = self.modelComboBox.currentText()
-        old_text = self.dialogueTextEdit.toPlainText()
 
         if self.current_model_name != chosen_model:
-            self.dialogueTextEdit.setPlainText(old_text + f"Chosen model changed to: {chosen_model}. Loading...\n\n")
+            if (chosen_model not in (self.repeater_model_name, self.synthetic_model_name)
+                    and not self.model_pool.is_loaded(self.model_registry.path(chosen_model))):
+                self.transcript.append("system", f"Chosen model changed to: {chosen_model}. Loading...")
+            else:
+                self.transcript.append("system", f"Chosen model changed to: {chosen_model}.")
             self.current_model_name = chosen_model
-            if chosen_model != self.repeater_model_name:
-                self.current_model.exit()
-                self.current_model = GPT4AllChatbot(int(chosen_model.split(":")[0]))
-                # self.current_model = GPT4AllAgentbot(int(chosen_model.split(":")[0]))
-
 
         message = self.inputPlainTextEdit.toPlainText().strip()
         if not message:
@@ -85,29 +219,61 @@ class MainWindow(QtWidgets.QMainWindow):
         self.dialogue_list.append({"role": "user", "content": message})
 
         # 显示用户输入 + Thinking...
-        updated_text = self.render_dialogue(self.dialogue_list + [{"role": "assistant", "content": "Thinking..."}])
-        self.dialogueTextEdit.setPlainText(updated_text)
+        self.transcript.append("user", message)
+        self.transcript.append("assistant", "Thinking...")
 
         if chosen_model == self.repeater_model_name:
             work_func = repeater_get_response
+            stream = False
+            self.stop_event = None
         else:
-            work_func = self.current_model.get_response
+            self.stop_event = threading.Event()
+            work_func = partial(self.model_get_response, chosen_model, stop_event=self.stop_event)
+            stream = True
 
         self.inputPlainTextEdit.clear()
         self.inputPlainTextEdit.setReadOnly(True)
         self.sendPushButton.setEnabled(False)
         self.clearPushButton.setEnabled(False)
+        self.stopPushButton.setEnabled(self.stop_event is not None)
 
-        self.work = WorkThread(self.dialogue_list, work_func)
+        self.stream_started = False
+        self.work = WorkThread(self.dialogue_list, work_func, stream=stream)
         self.work.trigger.connect(self.handle_response)
+        self.work.token_trigger.connect(self.handle_token)
         self.work.start()
 
+    def handle_token(self, token: str):
+        if not self.stream_started:
+            # 第一个 token 到达：替换掉 "Thinking..."
+            self.stream_started = True
+            self.transcript.replace_last(token)
+        else:
+            self.transcript.append_to_last(token)
+
+    def stop_generation(self):
+        # 生成在下一个 token 处结束，已生成的部分作为本轮回复
+        if self.stop_event is not None:
+            self.stop_event.set()
+            self.stopPushButton.setEnabled(False)
+            self.statusbar.showMessage("Stopping...")
+
     def handle_response(self, response: str):
+        self.stream_started = False
+        stopped = self.stop_event is not None and self.stop_event.is_set()
+        self.stop_event = None
+        self.stopPushButton.setEnabled(False)
         self.dialogue_list.append({"role": "assistant", "content": response})
 
-        # 重绘完整对话历史
-        updated_text = self.render_dialogue(self.dialogue_list)
-        self.dialogueTextEdit.setPlainText(updated_text)
+        # 只替换最后一条消息，用清洗后的完整回复覆盖流式内容
+        self.transcript.replace_last(response or ("(Stopped)" if stopped else ""))
+
+        # 状态栏显示本轮的性能指标（完整记录写入 logs/turn_metrics.jsonl）
+        if self.current_model_name != self.repeater_model_name and self.current_model is not None:
+            metrics = getattr(self.current_model, "last_turn_metrics", None)
+            if metrics:
+                from chatmodules.turn_metrics import format_metrics
+                self.statusbar.showMessage(format_metrics(metrics))
 
         self.inputPlainTextEdit.setReadOnly(False)
         self.sendPushButton.setEnabled(True)
@@ -115,18 +281,16 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def clear_all(self):
         self.dialogue_list = []
-        self.dialogueTextEdit.clear()
+        self.transcript.clear()
         self.inputPlainTextEdit.clear()
 
-        chosen_model = self.modelComboBox.currentText()
-        if chosen_model != self.repeater_model_name:
+        if self.current_model is not None:
             self.current_model.reset_memory()
-
-    def render_dialogue(self, dialogue_list):
-        return "\n\n".join(
-            f"{'User' if msg['role'] == 'user' else 'Bot'}: {msg['content']}"
-            for msg in dialogue_list
-        )
+        if self.session_store is not None:
+            # 切换模型时保存的 gui-<model id> 快照，无论在内存中还是已换出到磁盘
+            session_ids = {f"gui-{model_id}" for model_id in self.model_registry.model_ids()}
+            for session_id in session_ids.union(self.session_store.resident_ids()):
+                self.session_store.drop(session_id)
 
 
 if __name__ == '__main__':
@@ -136,6 +300,11 @@ if __name__ == '__main__':
 
     app = QtWidgets.QApplication(sys.argv)
     app.setStyleSheet(qdarkstyle.load_stylesheet(palette=LightPalette))
-    main_window = MainWindow()
+    startup_timer = StartupTimer(STARTUP_START)
+    startup_timer.mark("imports")
+    main_window = MainWindow(startup_timer=startup_timer)
+    startup_timer.mark("window created")
     main_window.show()
+    # 事件循环开始、窗口完成首次绘制后再开始后台预热
+    QtCore.QTimer.singleShot(0, main_window.warm_up)
     sys.exit(app.exec_())
@@ -0,0 +1,191 @@
+"""Headless HTTP/WebSocket chat server: many isolated sessions served from one model kept in RAM."""
+import argparse
+import asyncio
+import json
+import traceback
+
+from aiohttp import web, WSMsgType
+
+from chatmodules.gpt4all_agentbot import GPT4AllAgentbot
+from chatmodules.gpt4all_chatbot import GPT4AllChatbot
+from chatmodules.model_registry import ModelRegistry
+from chatmodules.session_scheduler import QueueFullError, SessionBusyError, SessionScheduler, UnknownSessionError
+from chatmodules.session_store import SESSION_DIR, SessionStore
+
+import warnings
+warnings.filterwarnings("ignore")
+
+models_dir = "models/"
+
+
+def json_error(status, message, **headers):
+    return web.json_response({"error": message}, status=status, headers=headers)
+
+
+async def create_session(request):
+    scheduler = request.app["scheduler"]
+    try:
+        session_id = scheduler.create_session()
+    except QueueFullError as e:
+        return json_error(503, str(e), **{"Retry-After": "30"})
+    return web.json_response({"session_id": session_id}, status=201)
+
+
+async def delete_session(request):
+    request.app["scheduler"].close_session(request.match_info["session_id"])
+    return web.Response(status=204)
+
+
+async def cancel_turn(request):
+    """Stop the session's running (or queued) turn; its request returns the partial answer."""
+    cancelled = request.app["scheduler"].cancel(request.match_info["session_id"])
+    return web.json_response({"cancelled": cancelled})
+
+
+async def post_message(request):
+    scheduler = request.app["scheduler"]
+    session_id = request.match_info["session_id"]
+    if not scheduler.has_session(session_id):
+        return json_error(404, "Unknown session")
+    try:
+        body = await request.json()
+        content = body["content"].strip()
+    except (ValueError, KeyError, AttributeError):
+        return json_error(400, "Expected a JSON body with a 'content' string")
+
+    try:
+        response = await scheduler.submit(session_id, content)
+    except QueueFullError as e:
+        return json_error(429, str(e), **{"Retry-After": "5"})
+    except SessionBusyError:
+        return json_error(409, "Session already has a request in progress")
+    except UnknownSessionError:
+        # 检查之后、提交之前会话已过期或被关闭
+        return json_error(404, "Unknown session")
+    except Exception as e:
+        traceback.print_exc()
+        return json_error(500, str(e))
+    return web.json_response({"response": response})
+
+
+async def session_websocket(request):
+    """
+    Streaming chat over a WebSocket.
+
+    The client sends {"content": "..."}; the server answers with {"type": "token", "token": "..."} messages while the
+    reply is decoded, then {"type": "done", "response": "..."} (or {"type": "error", ...}).
+    """
+    scheduler = request.app["scheduler"]
+    session_id = request.match_info["session_id"]
+    if not scheduler.has_session(session_id):
+        return json_error(404, "Unknown session")
+
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    loop = asyncio.get_running_loop()
+
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+        try:
+            content = json.loads(msg.data)["content"].strip()
+        except (ValueError, KeyError, AttributeError):
+            await ws.send_json({"type": "error", "error": "Expected {\"content\": \"...\"}"})
+            continue
+
+        tokens = asyncio.Queue()
+
+        def on_token(token):
+            # 由解码线程调用，转交给事件循环
+            loop.call_soon_threadsafe(tokens.put_nowait, token)
+
+        async def forward_tokens():
+            while True:
+                token = await tokens.get()
+                if token is None:
+                    break
+                await ws.send_json({"type": "token", "token": token})
+
+        forwarder = loop.create_task(forward_tokens())
+        try:
+            response = await scheduler.submit(session_id, content, on_token=on_token)
+            result = {"type": "done", "response": response}
+        except QueueFullError as e:
+            result = {"type": "error", "error": str(e), "retry_after": 5}
+        except SessionBusyError:
+            result = {"type": "error", "error": "Session already has a request in progress"}
+        except UnknownSessionError:
+            result = {"type": "error", "error": "Unknown session"}
+        except Exception as e:
+            traceback.print_exc()
+            result = {"type": "error", "error": str(e)}
+        loop.call_soon_threadsafe(tokens.put_nowait, None)
+        await forwarder
+        await ws.send_json(result)
+
+    return ws
+
+
+async def status(request):
+    return web.json_response(request.app["scheduler"].status())
+
+
+def create_app(scheduler):
+    app = web.Application()
+    app["scheduler"] = scheduler
+
+    async def on_startup(app):
+        scheduler.start()
+
+    async def on_cleanup(app):
+        await scheduler.stop()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/sessions", create_session)
+    app.router.add_delete("/sessions/{session_id}", delete_session)
+    app.router.add_post("/sessions/{session_id}/messages", post_message)
+    app.router.add_post("/sessions/{session_id}/cancel", cancel_turn)
+    app.router.add_get("/sessions/{session_id}/ws", session_websocket)
+    app.router.add_get("/status", status)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default=None, help="model id (file name in models/ without .gguf)")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="serve a SyntheticLLM instead of a model (load tests without GGUF files)")
+    parser.add_argument("--agent", action="store_true", help="serve GPT4AllAgentbot (with tools) instead of GPT4AllChatbot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-queue", type=int, default=16, help="requests allowed to wait for the model")
+    parser.add_argument("--max-sessions", type=int, default=64)
+    parser.add_argument("--turn-timeout", type=float, default=None,
+                        help="seconds a turn may take before generation stops and the partial answer is returned")
+    parser.add_argument("--turn-max-tokens", type=int, default=None, help="tokens a turn may generate")
+    parser.add_argument("--speculative", default=None,
+                        help='speculative decoding: "prompt-lookup", "auto" or a draft model id')
+    parser.add_argument("--session-dir", default=SESSION_DIR, help="where idle sessions are parked")
+    parser.add_argument("--resident-sessions", type=int, default=4,
+                        help="parked sessions (with their KV state) kept in RAM before swapping to disk")
+    args = parser.parse_args()
+
+    if not args.model and not args.synthetic:
+        parser.error("--model is required unless --synthetic is given")
+
+    chatbot_cls = GPT4AllAgentbot if args.agent else GPT4AllChatbot
+    if args.synthetic:
+        from chatmodules.synthetic_llm import SYNTHETIC_MODEL_ID, SyntheticLLM
+        model_id = SYNTHETIC_MODEL_ID
+        shared_llm = SyntheticLLM()
+        # SyntheticLLM 没有 KV 状态可保存
+        store = None
+    else:
+        model_id = args.model
+        shared_llm = ModelRegistry(models_dir).create_llm(args.model, speculative=args.speculative)
+        store = SessionStore(args.session_dir, max_resident=args.resident_sessions)
+    scheduler = SessionScheduler(shared_llm, lambda llm: chatbot_cls(model_id, llm=llm, turn_timeout=args.turn_timeout,
+                                                                     turn_max_tokens=args.turn_max_tokens),
+                                 max_queue=args.max_queue, max_sessions=args.max_sessions, store=store)
+    web.run_app(create_app(scheduler), host=args.host, port=args.port)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与各模块的 __main__ 一样按仓库根目录导入 tools.* / chatmodules.*
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
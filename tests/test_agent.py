@@ -0,0 +1,32 @@
+"""GPT4AllAgentbot turns driven by the synthetic LLM (no model files needed)."""
+import pytest
+
+from chatmodules.gpt4all_agentbot import GPT4AllAgentbot
+from chatmodules.synthetic_llm import SyntheticLLM
+
+
+@pytest.fixture
+def agentbot(tmp_path, monkeypatch):
+    # 指标日志等写到 cache/ 下，放在临时目录中
+    monkeypatch.chdir(tmp_path)
+    llm = SyntheticLLM(prompt_eval_delay=0.0, prompt_eval_tps=1e9, tokens_per_second=0, mean_tokens=8,
+                       mean_think_tokens=6, seed=1)
+    return GPT4AllAgentbot("synthetic", llm=llm, use_intent_router=False)
+
+
+def test_agent_turn_reports_generation_stats(agentbot):
+    output = agentbot.get_response([{"role": "user", "content": "Tell me something."}])
+
+    assert output
+    metrics = agentbot.last_turn_metrics
+    assert metrics["llm_calls"] == 1
+    assert metrics["thinking_tokens"] > 0
+    assert metrics["answer_tokens"] > 0
+
+
+def test_agent_streams_only_the_final_answer(agentbot):
+    tokens = []
+    output = agentbot.get_response([{"role": "user", "content": "Tell me something."}], on_token=tokens.append)
+
+    assert "".join(tokens) == output
+    assert "action" not in "".join(tokens)
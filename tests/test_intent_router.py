@@ -0,0 +1,52 @@
+"""Routed (tool-only) answers come back in the language of the question."""
+import re
+
+import pytest
+import requests
+
+from chatmodules.intent_router import IntentRouter, chinese_time
+from tools.fake_weather_server import start_fake_weather_server
+from tools.get_time import GetTimeRun
+from tools.get_weather import GetWeatherRun
+
+CJK = re.compile(r"[一-鿿]")
+LATIN_WORD = re.compile(r"[A-Za-z]{2,}")
+
+
+@pytest.fixture(scope="module")
+def weather():
+    server, base_url = start_fake_weather_server(latency=0.0)
+    session = requests.Session()
+    yield GetWeatherRun(base_url=base_url, session=session)
+    session.close()
+    server.shutdown()
+    server.server_close()
+
+
+def routed_answer(question, weather):
+    route = IntentRouter().route(question)
+    assert route is not None
+    tool = weather if route.tool == GetWeatherRun.name else GetTimeRun()
+    return route.format(tool.run(route.tool_input))
+
+
+@pytest.mark.parametrize("question", ["现在几点了？", "今天星期几", "北京天气怎么样", "伦敦现在天气如何"])
+def test_chinese_questions_get_chinese_answers(question, weather):
+    answer = routed_answer(question, weather)
+
+    assert CJK.search(answer)
+    assert not LATIN_WORD.search(answer), answer
+
+
+@pytest.mark.parametrize("question", ["What time is it?", "what's the weather in London"])
+def test_english_questions_get_english_answers(question, weather):
+    answer = routed_answer(question, weather)
+
+    assert not CJK.search(answer), answer
+
+
+def test_chinese_time_keeps_date_and_time():
+    observation = "Today is Friday, October 16, 2026. The current time is 23:37:14."
+
+    assert chinese_time(observation) == "2026年10月16日 星期五 23:37:14"
+    assert chinese_time("It is late.") is None
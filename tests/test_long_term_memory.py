@@ -0,0 +1,48 @@
+"""LongTermMemory recovery from a damaged entries.jsonl."""
+import json
+
+import pytest
+
+from chatmodules.long_term_memory import LongTermMemory
+
+TURNS = [
+    ("What is the capital of France?", "Paris."),
+    ("How many legs does a spider have?", "Eight."),
+    ("Which planet is known as the red planet?", "Mars."),
+    ("Who wrote Pride and Prejudice?", "Jane Austen."),
+    ("What is the boiling point of water?", "100 degrees Celsius at sea level."),
+]
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    memory = LongTermMemory(str(tmp_path))
+    for question, answer in TURNS:
+        memory.add(question, answer)
+    return tmp_path
+
+
+def damage(store_dir, bad_line):
+    path = store_dir / "entries.jsonl"
+    lines = path.read_bytes().splitlines(keepends=True)
+    lines[bad_line] = b'{"question": "Who wrote\n'
+    # 最后一行写到一半
+    lines[-1] = lines[-1][:20]
+    path.write_bytes(b"".join(lines))
+
+
+def test_damaged_lines_are_skipped_not_the_rest(store_dir):
+    damage(store_dir, bad_line=1)
+    memory = LongTermMemory(str(store_dir))
+
+    assert [entry["question"] for entry in memory.entries] == [TURNS[0][0], TURNS[2][0], TURNS[3][0]]
+    # 向量仍与条目一一对应
+    for question, answer in (TURNS[0], TURNS[2], TURNS[3]):
+        assert memory.search(question)[0][1]["answer"] == answer
+
+    memory.add("What colour is the sky?", "Blue.")
+    reloaded = LongTermMemory(str(store_dir))
+    assert len(reloaded) == 4
+    assert reloaded.search("What colour is the sky?")[0][1]["answer"] == "Blue."
+    assert reloaded.search(TURNS[3][0])[0][1]["answer"] == TURNS[3][1]
+    assert all(json.loads(line) for line in (store_dir / "entries.jsonl").read_text(encoding="utf-8").splitlines())
@@ -0,0 +1,23 @@
+"""ModelPool loading and retries, with a fake loader instead of GGUF files."""
+import pytest
+
+from chatmodules.model_pool import ModelPool
+
+
+def test_failed_size_estimate_can_be_retried():
+    attempts = []
+
+    def size_estimator(model_path):
+        attempts.append(model_path)
+        if len(attempts) == 1:
+            raise ValueError("draft model not found")
+        return 1
+
+    pool = ModelPool(loader=lambda model_path: f"llm:{model_path}", size_estimator=size_estimator, memory_budget=10)
+    try:
+        with pytest.raises(ValueError):
+            pool.get("a.gguf")
+        assert not pool.is_loaded("a.gguf")
+        assert pool.get("a.gguf") == "llm:a.gguf"
+    finally:
+        pool.shutdown()
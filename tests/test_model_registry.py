@@ -0,0 +1,22 @@
+"""ModelRegistry lists models by file name and reads GGUF metadata only when a model is used."""
+import pytest
+
+import chatmodules.model_registry as model_registry
+from chatmodules.model_registry import ModelRegistry
+
+
+def test_listing_models_does_not_read_metadata(tmp_path, monkeypatch):
+    for name in ("b-model.gguf", "a-model.GGUF", "notes.txt"):
+        (tmp_path / name).write_bytes(b"not really a gguf file")
+    read = []
+    monkeypatch.setattr(model_registry, "read_gguf_metadata", lambda path: read.append(path) or {})
+    registry = ModelRegistry(str(tmp_path))
+
+    assert registry.model_ids() == ["a-model", "b-model"]
+    assert registry.path("a-model") == str(tmp_path / "a-model.GGUF")
+    assert read == []
+
+    assert registry.get("b-model").model_id == "b-model"
+    assert read == [str(tmp_path / "b-model.gguf")]
+    with pytest.raises(KeyError):
+        registry.path("c-model")
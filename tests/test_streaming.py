@@ -0,0 +1,36 @@
+"""Agent output streaming: only the Final Answer text reaches the client."""
+import json
+
+from chatmodules.streaming import FinalAnswerStreamHandler
+
+
+def stream_call(handler, text, piece=3):
+    handler.on_llm_start({}, ["prompt"])
+    for i in range(0, len(text), piece):
+        handler.on_llm_new_token(text[i:i + piece])
+    handler.on_llm_end(None)
+
+
+def action(name, action_input):
+    return "```json\n" + json.dumps({"action": name, "action_input": action_input}, ensure_ascii=False) + "\n```"
+
+
+def test_tool_steps_are_not_streamed():
+    tokens = []
+    handler = FinalAnswerStreamHandler(tokens.append)
+
+    stream_call(handler, action("Get Weather", "London,GB"))
+    assert tokens == []
+
+    answer = '伦敦现在多云，"体感" 12°C。\nBring a coat.'
+    stream_call(handler, "<think>I could say Final Answer here.</think>\n\n" + action("Final Answer", answer))
+    assert len(tokens) > 1
+    assert "".join(tokens) == answer
+
+
+def test_answer_before_action_key_is_sent_at_the_end():
+    tokens = []
+    handler = FinalAnswerStreamHandler(tokens.append)
+
+    stream_call(handler, '```json\n{"action_input": "Hello there.", "action": "Final Answer"}\n```')
+    assert tokens == ["Hello there."]
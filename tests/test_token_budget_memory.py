@@ -0,0 +1,19 @@
+"""History token budget sizing."""
+from types import SimpleNamespace
+
+from chatmodules.token_budget_memory import HISTORY_TOKEN_BUDGET, MIN_HISTORY_TOKEN_BUDGET, history_token_budget
+
+
+def test_budget_is_what_the_context_leaves():
+    llm = SimpleNamespace(n_ctx=4096, max_tokens=2048)
+
+    assert history_token_budget(llm, reserved_tokens=1000) == 1048
+    assert history_token_budget(SimpleNamespace(n_ctx=32768, max_tokens=512)) == HISTORY_TOKEN_BUDGET
+
+
+def test_budget_never_drops_to_zero(capsys):
+    # load_llamacpp 的默认 max_tokens 大于最小的 n_ctx
+    llm = SimpleNamespace(n_ctx=2048, max_tokens=5120)
+
+    assert history_token_budget(llm, reserved_tokens=600) == MIN_HISTORY_TOKEN_BUDGET
+    assert "Lower max_tokens" in capsys.readouterr().out
@@ -0,0 +1,110 @@
+"""Agent tool runtime, connection reuse and result cache, checked against the local fake weather server."""
+import time
+
+import pytest
+import requests
+
+from tools.cache import CachedTool, TTLCache
+from tools.fake_weather_server import start_fake_weather_server
+from tools.get_weather import GetWeatherRun
+from tools.runtime import ToolRuntime
+
+
+@pytest.fixture
+def weather_server():
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_fake_weather_server(**kwargs)
+        servers.append(server)
+        return server, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def runtime():
+    runtime = ToolRuntime()
+    yield runtime
+    runtime.shutdown()
+
+
+def test_slow_tool_returns_error_observation(weather_server, runtime):
+    _, base_url = weather_server(latency=1.0)
+    weather = GetWeatherRun(base_url=base_url)
+    weather.timeout = 0.2
+
+    start = time.monotonic()
+    observation = runtime.run(weather, "London,GB")
+
+    assert observation.startswith("Error:")
+    assert "did not respond" in observation
+    assert time.monotonic() - start < 0.8
+    assert runtime.timeouts == 1
+
+
+def test_turn_deadline_bounds_tool_calls(weather_server, runtime):
+    _, base_url = weather_server(latency=1.0)
+    weather = GetWeatherRun(base_url=base_url)
+
+    runtime.begin_turn(0.2)
+    observations = runtime.run_many([(weather, "London,GB"), (weather, "Paris,FR")])
+    runtime.begin_turn(None)
+
+    assert all(observation.startswith("Error:") for observation in observations)
+    assert runtime.timeouts == 2
+
+
+def test_weather_calls_reuse_one_connection(weather_server):
+    server, base_url = weather_server(latency=0.0)
+    session = requests.Session()
+    weather = GetWeatherRun(base_url=base_url, session=session)
+
+    observations = [weather.run(city) for city in ("London,GB", "Paris,FR", "Tokyo,JP", "London,GB")]
+
+    assert all(observation.startswith("Clouds,scattered clouds") for observation in observations)
+    assert server.requests == 4
+    assert server.connections == 1
+    session.close()
+
+
+def test_shared_session_keeps_connection_alive(weather_server):
+    server, base_url = weather_server(latency=0.0)
+    weather = GetWeatherRun(base_url=base_url)  # tools.http_pool 的共享 session
+
+    for _ in range(3):
+        weather.run("London,GB")
+
+    assert server.requests == 3
+    assert server.connections == 1
+
+
+def test_cached_tool_serves_repeats_until_ttl_expires(weather_server):
+    server, base_url = weather_server(latency=0.0)
+    cache = TTLCache()
+    weather = CachedTool(GetWeatherRun(base_url=base_url), cache, ttl=0.3)
+
+    first = weather.run("London,GB")
+    # 规范化后相同的输入命中缓存
+    assert weather.run("london, gb") == first
+    assert server.requests == 1
+    assert cache.stats()["hits"] == 1
+
+    time.sleep(0.4)
+    assert weather.run("London,GB") == first
+    assert server.requests == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_failed_calls_are_not_cached(weather_server, runtime):
+    server, base_url = weather_server(latency=0.0, error_rate=1.0)
+    cache = TTLCache()
+    weather = CachedTool(GetWeatherRun(base_url=base_url, session=requests.Session()), cache)
+
+    assert runtime.run(weather, "London,GB").startswith("Error:")
+    assert runtime.run(weather, "London,GB").startswith("Error:")
+    assert cache.stats()["entries"] == 0
+    assert server.requests == 2
@@ -0,0 +1,91 @@
+"""TTL + LRU result cache for agent tools."""
+import threading
+import time
+from collections import OrderedDict
+
+
+def default_normalize(tool_input):
+    # 忽略大小写和多余空白
+    return " ".join(str(tool_input).split()).casefold()
+
+
+class TTLCache(object):
+    """Size-bounded LRU cache whose entries also expire after a per-entry TTL."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (True, value) on a fresh hit, (False, None) otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, ttl):
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+class CachedTool(object):
+    """
+    Wraps a tool with the same name/description/run interface and serves repeated calls from a TTLCache.
+
+    The key is the tool name plus the normalized input: the tool's own `normalize_input` if it has one, otherwise
+    case- and whitespace-insensitive. The TTL comes from the tool's `cache_ttl` (seconds). Failed calls raise and are
+    never cached.
+    """
+
+    def __init__(self, tool, cache, ttl=None):
+        self.tool = tool
+        self.cache = cache
+        self.ttl = ttl if ttl is not None else getattr(tool, "cache_ttl", 60)
+        self.name = tool.name
+        self.description = tool.description
+        self.timeout = getattr(tool, "timeout", None)
+
+    def normalize(self, tool_input):
+        normalize = getattr(self.tool, "normalize_input", None) or default_normalize
+        return normalize(tool_input)
+
+    def run(self, tool_input):
+        normalized = self.normalize(tool_input)
+        key = (self.name, normalized)
+        found, value = self.cache.get(key)
+        if found:
+            return value
+        value = self.tool.run(tool_input)
+        self.cache.set(key, value, self.ttl)
+        return value
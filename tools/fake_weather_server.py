@@ -0,0 +1,108 @@
+"""Local stand-in for the OpenWeatherMap API, for measuring tool-call latency offline."""
+import json
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeWeatherHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，与真实 API 一致
+    wbufsize = 64 * 1024  # 响应头和正文一次写出，避免 Nagle/延迟 ACK 带来的额外延迟
+
+    def setup(self):
+        super().setup()
+        with self.server.counter_lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path != "/data/2.5/weather":
+            self.send_error(404)
+            return
+        with server.counter_lock:
+            server.requests += 1
+
+        # 延迟：基础延迟 + 一定概率的长尾
+        delay = server.latency
+        if random.random() < server.tail_probability:
+            delay += server.tail_latency
+        time.sleep(delay)
+
+        if random.random() < server.error_rate:
+            self.send_error(503)
+            return
+
+        city = parse_qs(url.query).get("q", ["London,GB"])[0]
+        body = json.dumps({
+            "name": city.split(",")[0],
+            "main": {"temp": 288.15, "feels_like": 287.0, "pressure": 1012, "humidity": 70},
+            "weather": [{"main": "Clouds", "description": "scattered clouds"}],
+            "wind": {"speed": 3.6},
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_weather_server(port=0, latency=0.05, tail_latency=2.0, tail_probability=0.0, error_rate=0.0):
+    """
+    Start the server on a background thread; returns (server, base_url). Call server.shutdown() to stop it.
+
+    `server.connections` and `server.requests` count accepted TCP connections and weather requests.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeWeatherHandler)
+    server.daemon_threads = True
+    server.counter_lock = threading.Lock()
+    server.connections = 0
+    server.requests = 0
+    server.latency = latency
+    server.tail_latency = tail_latency
+    server.tail_probability = tail_probability
+    server.error_rate = error_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _report(label, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else latencies[-1]
+    print(f"{label}: n={len(latencies)} p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p95={p95 * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms")
+
+
+if __name__ == '__main__':
+    from tools.get_weather import GetWeatherRun
+    from tools.runtime import ToolRuntime
+
+    server, base_url = start_fake_weather_server(latency=0.05, tail_latency=3.0, tail_probability=0.05)
+    weather = GetWeatherRun(base_url=base_url)
+    weather.timeout = 1.0
+    runtime = ToolRuntime()
+
+    latencies = []
+    for _ in range(100):
+        start = time.perf_counter()
+        runtime.run(weather, "London,GB")
+        latencies.append(time.perf_counter() - start)
+    _report("sequential calls", latencies)
+
+    latencies = []
+    for _ in range(20):
+        start = time.perf_counter()
+        runtime.run_many([(weather, "London,GB"), (weather, "Paris,FR"), (weather, "Tokyo,JP")])
+        latencies.append(time.perf_counter() - start)
+    _report("3 concurrent calls", latencies)
+    print(f"calls={runtime.calls} timeouts={runtime.timeouts} errors={runtime.errors} "
+          f"connections={server.connections} requests={server.requests}")
+
+    runtime.shutdown()
+    server.shutdown()
@@ -7,6 +7,12 @@ class GetTimeRun(object):
     description = (
         "Useful for when you need to answer questions about the current date or time."
     )
+    timeout = 1
+    cache_ttl = 1  # 结果精确到秒
+
+    @staticmethod
+    def normalize_input(no_use: str) -> str:
+        return ""
 
     def run(self, no_use: str) -> str:
         time_now = datetime.now()
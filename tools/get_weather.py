@@ -1,6 +1,7 @@
 """获取当前天气的工具."""
-import requests
+from tools.http_pool import DEFAULT_TIMEOUT, get_session
 OPENWEATHER_API_KEY = ""
+OPENWEATHER_BASE_URL = "http://api.openweathermap.org"
 
 
 class GetWeatherRun(object):
@@ -10,13 +11,32 @@ class GetWeatherRun(object):
         "Input should be a string of city and country split by ',', both must be in English, the country should be a "
         "ISO 3166-1 alpha-2 code, for example 'London,GB'."
     )
+    # 整个工具调用（含重试）的时间上限，由 ToolRuntime 执行
+    timeout = 10
+    # 天气数据十分钟内视为有效
+    cache_ttl = 600
+
+    def __init__(self, base_url=OPENWEATHER_BASE_URL, session=None, request_timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url
+        self.session = session
+        self.request_timeout = request_timeout
+
+    @staticmethod
+    def normalize_input(city_country: str) -> str:
+        # "london, gb" / "London,GB?" -> "london,GB"
+        parts = [" ".join(part.split()) for part in city_country.strip().strip("?.!").split(",")]
+        city = parts[0].casefold()
+        if len(parts) > 1 and parts[1]:
+            return f"{city},{parts[1].upper()}"
+        return city
 
     def run(self, city_country: str) -> str:
         # 获取当天天气的工具
-        base_url = f'http://api.openweathermap.org/data/2.5/weather?'
-        city = city_country.split(",", 0)
-        url = f"{base_url}q={city_country}&appid={OPENWEATHER_API_KEY}"
-        res = requests.get(url)
+        session = self.session or get_session()
+        res = session.get(f"{self.base_url}/data/2.5/weather",
+                          params={"q": city_country.strip(), "appid": OPENWEATHER_API_KEY},
+                          timeout=self.request_timeout)
+        res.raise_for_status()
         weather = res.json()
         temp = int(weather["main"]["temp"] - 273.15)
         feels_like = int(weather["main"]["feels_like"] - 273.15)
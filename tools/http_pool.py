@@ -0,0 +1,33 @@
+"""Shared keep-alive HTTP session for tools that call web APIs."""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (连接超时, 读取超时)，单位秒
+DEFAULT_TIMEOUT = (3.05, 8)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """
+    One pooled `requests.Session` for all tools, so repeated calls reuse TCP/TLS connections.
+
+    Retries are limited to two quick attempts on connection errors and 502/503/504, which keeps a flaky upstream
+    from multiplying a tool call's latency.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                retry = Retry(total=2, connect=2, read=0, backoff_factor=0.2,
+                              status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
@@ -0,0 +1,88 @@
+"""Time-bounded, concurrent execution of agent tools."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from langchain.agents import Tool
+
+DEFAULT_TOOL_TIMEOUT = 10
+
+
+class ToolRuntime(object):
+    """
+    Runs tool calls on a shared thread pool, each bounded by the tool's own `timeout` and by the turn deadline.
+
+    A tool that misses its time limit is abandoned (its worker finishes in the background) and the agent gets an
+    error observation right away, so one slow upstream cannot stall the whole turn. Several calls requested in the
+    same step run concurrently.
+    """
+
+    def __init__(self, max_workers=8, default_timeout=DEFAULT_TOOL_TIMEOUT):
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._local = threading.local()
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def begin_turn(self, turn_timeout=None):
+        """Start a new turn; every tool call in it must finish within `turn_timeout` seconds from now."""
+        self._local.deadline = time.monotonic() + turn_timeout if turn_timeout else None
+
+    def time_limit(self, tool, timeout=None):
+        limit = timeout or getattr(tool, "timeout", None) or self.default_timeout
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is not None:
+            limit = min(limit, max(0.0, deadline - time.monotonic()))
+        return limit
+
+    def run(self, tool, tool_input, timeout=None):
+        limit = self.time_limit(tool, timeout)
+        self.calls += 1
+        return self._result(tool, self._executor.submit(tool.run, tool_input), limit, limit)
+
+    async def arun(self, tool, tool_input, timeout=None):
+        limit = self.time_limit(tool, timeout)
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, tool.run, tool_input), limit)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return f"Error: {tool.name} did not respond within {limit:.1f} seconds."
+        except Exception as e:
+            self.errors += 1
+            return f"Error: {tool.name} failed: {e}"
+
+    def run_many(self, calls, timeout=None):
+        """Run [(tool, tool_input), ...] concurrently; results come back in the same order."""
+        start = time.monotonic()
+        submitted = []
+        for tool, tool_input in calls:
+            self.calls += 1
+            submitted.append((tool, self.time_limit(tool, timeout), self._executor.submit(tool.run, tool_input)))
+        # 所有调用同时开始计时，总耗时取决于最慢的那个，而不是各自耗时之和
+        return [self._result(tool, future, max(0.0, limit - (time.monotonic() - start)), limit)
+                for tool, limit, future in submitted]
+
+    def _result(self, tool, future, wait, limit):
+        try:
+            return future.result(timeout=wait)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            return f"Error: {tool.name} did not respond within {limit:.1f} seconds."
+        except Exception as e:
+            self.errors += 1
+            return f"Error: {tool.name} failed: {e}"
+
+    def as_langchain_tool(self, tool):
+        return Tool(
+            name=tool.name,
+            description=tool.description,
+            func=lambda tool_input: self.run(tool, tool_input),
+            coroutine=lambda tool_input: self.arun(tool, tool_input),
+        )
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)